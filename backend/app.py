@@ -1,56 +1,243 @@
-from src.utils.functions import getImages, getConfig
+from src.utils.functions import getCatalogue, getConfig, getColours
 from src.pipelines.completePipeline import Pipeline
+from src.pipelines.httpApi import TryOnApi
+from src.utils.exceptions import CustomException
+from src.utils.metrics import metrics
+from src.utils.logger import logger
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi import FastAPI
 import gradio as gr
+import threading
+import uvicorn
 
-# initializing the pipeline for clothing and necklace try-ons
+# one output panel is shown per configured saree colour
+config = getConfig(path = "config.ini")
+colours = getColours(config)
+
+# initializing the pipeline for clothing and necklace try-ons, models are loaded lazily
 pipeline = Pipeline()
 
-# loading a set of images for examples
-allImages = getImages(nImages = 100)
+# with a worker pool the models are loaded now and shared with the forked workers,
+# which has to happen before the catalogue and warm-up threads below are started
+pipeline.startWorkers()
+
+# loading the catalogue for examples in the background, the galleries show thumbnails
+# and full images are only decoded once they are selected
+allImages = {"models": [], "chokers": [], "shortNecklaces": [], "longNecklaces": []}
+catalogueReady = threading.Event()
+
+def loadCatalogue():
+    try:
+        allImages.update(getCatalogue(nImages = 100))
+
+        # precomputing the catalogue index for every necklace
+        pipeline.catalogueIndex.build(
+            x.image for x in allImages["chokers"] + allImages["shortNecklaces"] + allImages["longNecklaces"]
+        )
+    except Exception as e:
+        metrics.recordError("loadCatalogue", e)
+        logger.error(CustomException(e))
+    finally:
+        catalogueReady.set()
+
+threading.Thread(target = loadCatalogue, name = "CatalogueLoader", daemon = True).start()
+
+# rendering the first example photos with every necklace into the result cache once the
+# catalogue is loaded, so kiosk demos with the stock photos are answered from the cache
+def prewarmResults():
+    catalogueReady.wait()
+    try:
+        nImages = config.getint("RESULT CACHE", "prewarmImages", fallback = 4)
+        pipeline.prewarmResultCache(
+            images = (x.image.convert("RGB") for x in allImages["models"][:nImages]),
+            jewelleries = [x.image.convert("RGBA") for x in allImages["chokers"] + allImages["shortNecklaces"] + allImages["longNecklaces"]],
+            clothing = config.getboolean("RESULT CACHE", "prewarmClothing", fallback = False)
+        )
+    except Exception as e:
+        metrics.recordError("prewarmResults", e)
+        logger.error(CustomException(e))
+
+if pipeline.resultCache is not None and config.getboolean("RESULT CACHE", "prewarm", fallback = False):
+    threading.Thread(target = prewarmResults, name = "ResultCacheWarmUp", daemon = True).start()
+
+# loading and warming up the models in the background, the workers of a pool always warm up
+if config.getboolean("WARM UP", "enabled", fallback = True) or pipeline.workerPool is not None:
+    pipeline.startWarmUp()
+
+def getGalleries():
+    catalogueReady.wait()
+    return [
+        [y.thumbnailPath for y in allImages[x]] for x in ["models", "chokers", "shortNecklaces", "longNecklaces"]
+    ]
+
+def selectFrom(category: str):
+    def select(evt: gr.SelectData):
+        return allImages[category][evt.index].image
+    return select
+
+def gridFrom(category: str):
+    def grid(image):
+        if image is None:
+            return gr.skip()
+        results = pipeline.necklaceGrid(image = image, jewelleries = [x.image for x in allImages[category]])
+        return [x for x in results or [] if x is not None]
+    return grid
+
+def findNecklace(fileId: str):
+    # the API only looks necklaces up once the catalogue is loaded, see isCatalogueReady
+    for category in ["chokers", "shortNecklaces", "longNecklaces"]:
+        for x in allImages[category]:
+            if x.fileId == fileId:
+                return x.image
+    return None
+
+def getStatus():
+    status = f"**Status:** {pipeline.state}"
+    videoStats = pipeline.videoStats()
+    if videoStats:
+        status += f" | **Camera:** {videoStats['fps']:.1f} FPS, {videoStats['dropped']} frames dropped"
+    return status
+
+def getConcurrencyLimit(limit: int):
+    # the worker pool bounds the requests of every worker itself, so it is kept saturated
+    return pipeline.workerPool.capacity if pipeline.workerPool is not None else limit
+
+def necklaceVideoTryOn(frame, jewellery):
+    # a dropped frame leaves the previous output on screen instead of queuing behind it
+    result = pipeline.necklaceVideoTryOn(frame = frame, jewellery = jewellery)
+    return gr.skip() if result is None else result
 
 # creating a Gradio interface using Blocks
 with gr.Blocks(title = "GemFit") as interface:
+    # Row for the readiness status
+    with gr.Row():
+        status = gr.Markdown(getStatus())
+
     # Row for input images
     with gr.Row():
-        inputImage = gr.Image(label = "Input Image", type = "pil", image_mode = "RGB", interactive = True)
-        selectedNecklace = gr.Image(label = "Selected Necklace", type = "pil", image_mode = "RGBA", visible = False)
+        # selected examples round-trip losslessly, so they keep matching their cached results
+        inputImage = gr.Image(label = "Input Image", type = "pil", image_mode = "RGB", format = "png", interactive = True)
+        selectedNecklace = gr.Image(label = "Selected Necklace", type = "pil", image_mode = "RGBA", format = "png", visible = False)
         necklaceTryOn = gr.Image(label = "Necklace Try-On", type = "pil", interactive = False)
 
+    # Row for the live camera try-on
+    if config.getboolean("VIDEO TRY ON", "enabled", fallback = False):
+        with gr.Row():
+            webcam = gr.Image(label = "Camera", sources = ["webcam"], streaming = True, type = "numpy")
+            liveOutput = gr.Image(label = "Live Necklace Try-On", type = "numpy", interactive = False)
+
     # Row for model examples
     with gr.Row():
-        gr.Examples(examples = allImages["models"], inputs = [inputImage], label = "Models")
+        models = gr.Gallery(label = "Models", columns = 8, height = "auto", allow_preview = False)
 
     # Row for choker examples
     with gr.Row():
-        gr.Examples(examples = allImages["chokers"], inputs = [selectedNecklace], label = "Chokers")
+        chokers = gr.Gallery(label = "Chokers", columns = 8, height = "auto", allow_preview = False)
 
     # Row for short necklace examples
     with gr.Row():
-        gr.Examples(examples = allImages["shortNecklaces"], inputs = [selectedNecklace], label = "Short Necklaces")
+        shortNecklaces = gr.Gallery(label = "Short Necklaces", columns = 8, height = "auto", allow_preview = False)
 
     # Row for long necklace examples
     with gr.Row():
-        gr.Examples(examples = allImages["longNecklaces"], inputs = [selectedNecklace], label = "Long Necklaces")
+        longNecklaces = gr.Gallery(label = "Long Necklaces", columns = 8, height = "auto", allow_preview = False)
+
+    # Row for trying a whole category on at once
+    with gr.Row():
+        gridChokers = gr.Button("Try All Chokers")
+        gridShortNecklaces = gr.Button("Try All Short Necklaces")
+        gridLongNecklaces = gr.Button("Try All Long Necklaces")
+
+    with gr.Row():
+        catalogueGrid = gr.Gallery(
+            label = "Catalogue Grid", columns = config.getint("CATALOGUE GRID", "columns", fallback = 4), height = "auto"
+        )
 
     # Row for output images
     with gr.Row():
-        outputOne = gr.Image(label = "Output 1", interactive = False)
-        outputTwo = gr.Image(label = "Output 2", interactive = False)
-        outputThree = gr.Image(label = "Output 3", interactive = False)
+        outputs = [
+            gr.Image(label = f"Output {x + 1}", interactive = False) for x in range(len(colours))
+        ]
 
     # Row for the submit button
     with gr.Row():
+        fastVariants = gr.Checkbox(
+            label = "Fast Colour Variants",
+            value = config.get("CLOTHING TRY ON", "variantMode", fallback = "full").strip().lower() == "fast"
+        )
         submit = gr.Button("Enter")
 
+    # Fill the galleries once the catalogue is loaded and keep the status up to date
+    interface.load(fn = getGalleries, outputs = [models, chokers, shortNecklaces, longNecklaces])
+    gr.Timer(value = 2).tick(fn = getStatus, outputs = [status])
+
+    # Selecting an example copies it into the corresponding input
+    models.select(fn = selectFrom("models"), outputs = [inputImage])
+    chokers.select(fn = selectFrom("chokers"), outputs = [selectedNecklace])
+    shortNecklaces.select(fn = selectFrom("shortNecklaces"), outputs = [selectedNecklace])
+    longNecklaces.select(fn = selectFrom("longNecklaces"), outputs = [selectedNecklace])
+
     # Connect input changes to the necklace try-on function
-    selectedNecklace.change(fn = pipeline.necklaceTryOn, inputs = [inputImage, selectedNecklace], outputs = [necklaceTryOn])
-    
+    # the overlay is CPU-bound, so concurrent requests may run in parallel on the pose detector pool
+    selectedNecklace.change(
+        fn = pipeline.necklaceTryOn, inputs = [inputImage, selectedNecklace], outputs = [necklaceTryOn],
+        concurrency_limit = getConcurrencyLimit(
+            pipeline.landmarkService.poolSize if config.getboolean("NECKLACE TRY ON", "parallelRequests", fallback = False) else 1
+        )
+    )
+
+    # A whole category is composited in one request, the landmarks are detected once
+    gridChokers.click(fn = gridFrom("chokers"), inputs = [inputImage], outputs = [catalogueGrid])
+    gridShortNecklaces.click(fn = gridFrom("shortNecklaces"), inputs = [inputImage], outputs = [catalogueGrid])
+    gridLongNecklaces.click(fn = gridFrom("longNecklaces"), inputs = [inputImage], outputs = [catalogueGrid])
+
+    # Stream camera frames through the live necklace try-on
+    # frames are not queued behind each other, a frame arriving while the previous one is processed is dropped
+    if config.getboolean("VIDEO TRY ON", "enabled", fallback = False):
+        webcam.stream(
+            fn = necklaceVideoTryOn, inputs = [webcam, selectedNecklace], outputs = [liveOutput],
+            stream_every = config.getfloat("VIDEO TRY ON", "streamEvery", fallback = 0.05),
+            concurrency_limit = None, show_progress = "hidden"
+        )
+
     # Connect the submit button to the clothing try-on function
-    submit.click(fn = pipeline.clothingTryOn, inputs = [inputImage, selectedNecklace], outputs = [outputOne, outputTwo, outputThree])
+    # streaming shows every colour as soon as it is ready, otherwise concurrent requests
+    # are let through so the inference scheduler can batch them together
+    if config.getboolean("STREAMING", "enabled", fallback = False):
+        submit.click(fn = pipeline.clothingTryOnStream, inputs = [inputImage, selectedNecklace, fastVariants], outputs = outputs)
+    else:
+        submit.click(
+            fn = pipeline.clothingTryOn, inputs = [inputImage, selectedNecklace, fastVariants], outputs = outputs,
+            concurrency_limit = getConcurrencyLimit(pipeline.scheduler.maxBatchSize if pipeline.scheduler is not None else 1)
+        )
 
-# Launch the Gradio interface with debug mode enabled
-config = getConfig(path = "config.ini")
-interface.launch(
-    server_name = config.get("WEBSERVER", "host"),
-    server_port = config.getint("WEBSERVER", "port")
-) 
\ No newline at end of file
+# Serve the Gradio interface next to a readiness endpoint
+app = FastAPI(title = "GemFit")
+
+@app.get("/health")
+def health():
+    return JSONResponse(
+        status_code = 200 if pipeline.isReady() else 503,
+        content = {"state": pipeline.state, "catalogueLoaded": catalogueReady.is_set()}
+    )
+
+@app.get("/metrics")
+def getMetrics():
+    return PlainTextResponse(pipeline.renderMetrics(), media_type = "text/plain; version=0.0.4")
+
+# Serve the binary-image API for the kiosk frontend, its routes take precedence over the Gradio mount
+if config.getboolean("HTTP API", "enabled", fallback = False):
+    allowedOrigins = [x.strip() for x in config.get("HTTP API", "allowedOrigins", fallback = "").split(",") if x.strip()]
+    if allowedOrigins:
+        app.add_middleware(CORSMiddleware, allow_origins = allowedOrigins, allow_methods = ["POST"], allow_headers = ["*"])
+    app.include_router(TryOnApi(pipeline, getNecklace = findNecklace, isCatalogueReady = catalogueReady.is_set).router)
+
+app = gr.mount_gradio_app(app, interface, path = "/")
+
+if __name__ == "__main__":
+    uvicorn.run(
+        app,
+        host = config.get("WEBSERVER", "host"),
+        port = config.getint("WEBSERVER", "port")
+    )
\ No newline at end of file
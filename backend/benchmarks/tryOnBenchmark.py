@@ -0,0 +1,524 @@
+from src.components.clothingTryOn import ClothingTryOn
+from src.components.necklaceTryOn import NecklaceTryOn
+from src.components.catalogueIndex import CatalogueIndex
+from src.components.poseLandmarks import PoseLandmarkService
+from src.utils.ingest import ingestImage, getMaxSide, getProxy
+from src.utils.logger import logger
+from types import SimpleNamespace
+from typing import Any, Callable
+from PIL import Image
+import numpy as np
+import torch
+import tempfile
+import tracemalloc
+import subprocess
+import argparse
+import platform
+import logging
+import json
+import time
+import zlib
+import sys
+import cv2
+import os
+
+DEFAULT_RESOLUTIONS = ["480x640", "960x1280", "1536x2048"]
+DEFAULT_BRANCH_FRACTIONS = [0.2, 0.3, 0.5]
+
+class SyntheticLandmarkService:
+    """
+    A landmark service returning the neck points of the synthetic portraits.
+
+    MediaPipe finds no person in the generated portraits, so the try-on stages are given the
+    known geometry of the portraits instead. Pose detection itself is timed separately by
+    the "landmarks" stage, see `detectLandmarks`.
+
+    Methods:
+        getNeckPoints(image: np.ndarray) -> tuple[int, int, int, int]:
+            Returns the neck points of a synthetic portrait of the same size.
+
+        cacheInfo() -> dict[str, int]:
+            Returns empty cache counters.
+    """
+
+    def getNeckPoints(self, image: np.ndarray) -> tuple[int, int, int, int]:
+        """
+        Calculate the neck points of a synthetic portrait.
+
+        Args:
+            image (np.ndarray): The synthetic portrait.
+
+        Returns:
+            tuple[int, int, int, int]: The (avgX1, avgY1, avgX2, avgY2) coordinates of the neck points.
+        """
+        h, w = image.shape[:2]
+        return (int(w * 0.38), int(h * 0.42), int(w * 0.62), int(h * 0.43))
+
+    def cacheInfo(self) -> dict[str, int]:
+        """Report empty cache counters."""
+        return {"hits": 0, "misses": 0, "size": 0, "maxSize": 0}
+
+
+class StubInpaintPipeline:
+    """
+    A tiny stand-in for the Stable Diffusion inpainting pipeline.
+
+    It accepts the same call arguments and runs a small convolutional denoising loop on
+    latents of the real shape, including the step-end callbacks, so the code around the
+    model is exercised and timed without downloading any weights. Every prompt pushes the
+    latents in its own fixed direction, so different prompts give different outputs. Its 
+    latency and output quality say nothing about the real model.
+
+    Attributes:
+        numInferenceSteps (int): The default number of denoising steps.
+
+    Methods:
+        __call__(prompt: list[str], negative_prompt: list[str], image: Any, mask_image: Any, **kwargs) -> SimpleNamespace:
+            Returns one generated image per prompt in the `images` attribute.
+
+        generateSharedPrefix(prompt: list[str], negative_prompt: str, neutralPrompt: str, image: Any, mask_image: Any, **kwargs) -> SimpleNamespace:
+            Returns one generated image per prompt from a shared start of the denoising loop, branched 
+            in batches of at most `batchSize` prompts.
+    """
+
+    def __init__(self, numInferenceSteps: int = 4):
+        """Initialize the StubInpaintPipeline with a fixed random denoiser."""
+        self.numInferenceSteps = numInferenceSteps
+        self.denoiser = torch.nn.Conv2d(4, 4, kernel_size = 3, padding = 1)
+        with torch.no_grad():
+            weight = torch.randn(self.denoiser.weight.shape, generator = torch.Generator().manual_seed(0))
+            self.denoiser.weight.copy_(weight * 0.05)
+            self.denoiser.bias.zero_()
+
+    @torch.no_grad()
+    def __call__(
+        self,
+        prompt: list[str],
+        negative_prompt: list[str],
+        image: Any,
+        mask_image: Any,
+        generator: Any = None,
+        num_inference_steps: int = None,
+        callback_on_step_end: Callable = None,
+        **kwargs
+    ) -> SimpleNamespace:
+        """Denoise random latents of the input size and return them as images."""
+        batchSize = len(prompt)
+        images = image if isinstance(image, list) else [image] * batchSize
+        generators = generator if isinstance(generator, list) else [generator] * batchSize
+        width, height = images[0].size
+
+        latents = torch.cat([
+            torch.randn((1, 4, height // 8, width // 8), generator = x) for x in generators
+        ])
+        bias = torch.cat([self._getPromptBias(x) for x in prompt])
+        steps = num_inference_steps or self.numInferenceSteps
+        for step in range(steps):
+            latents = latents - 0.1 * self.denoiser(latents) + bias
+            if callback_on_step_end is not None:
+                latents = callback_on_step_end(self, step, steps - step, {"latents": latents})["latents"]
+        return SimpleNamespace(images = self._decode(latents, height, width))
+
+    @torch.no_grad()
+    def generateSharedPrefix(
+        self,
+        prompt: list[str],
+        negative_prompt: str,
+        neutralPrompt: str,
+        image: Any,
+        mask_image: Any,
+        height: int,
+        width: int,
+        branchFraction: float = 0.3,
+        generator: Any = None,
+        num_inference_steps: int = None,
+        callback_on_step_end: Callable = None,
+        batchSize: int = None,
+        callback_on_batch_end: Callable = None,
+        **kwargs
+    ) -> SimpleNamespace:
+        """Denoise a single latent with the neutral prompt, then branch it into one trajectory per prompt."""
+        steps = num_inference_steps or self.numInferenceSteps
+        branchStep = min(max(int(round(branchFraction * steps)), 0), steps)
+        count = len(prompt)
+        batchSize = batchSize or count
+        latents = torch.randn((1, 4, height // 8, width // 8), generator = generator)
+        for step in range(branchStep):
+            latents = latents - 0.1 * self.denoiser(latents) + self._getPromptBias(neutralPrompt)
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, steps - step, {"latents": latents.expand(count, -1, -1, -1), "indices": list(range(count))})
+
+        images = []
+        for start in range(0, count, batchSize):
+            indices = list(range(start, min(start + batchSize, count)))
+            batchLatents = latents.repeat(len(indices), 1, 1, 1)
+            bias = torch.cat([self._getPromptBias(prompt[x]) for x in indices])
+            for step in range(branchStep, steps):
+                batchLatents = batchLatents - 0.1 * self.denoiser(batchLatents) + bias
+                if callback_on_step_end is not None:
+                    callback_on_step_end(self, step, steps - step, {"latents": batchLatents, "indices": indices})
+            batchImages = self._decode(batchLatents, height, width)
+            images.extend(batchImages)
+            if callback_on_batch_end is not None:
+                callback_on_batch_end(indices, batchImages)
+        return SimpleNamespace(images = images, branchStep = branchStep, steps = steps)
+
+    @staticmethod
+    def _getPromptBias(prompt: str) -> torch.Tensor:
+        """Return the fixed per-channel direction a prompt pushes the latents in."""
+        generator = torch.Generator().manual_seed(zlib.crc32(prompt.encode()))
+        return torch.randn((1, 4, 1, 1), generator = generator) * 0.05
+
+    @staticmethod
+    def _decode(latents: torch.Tensor, height: int, width: int) -> list[Image.Image]:
+        """Turn latents into images of the requested size."""
+        rgb = torch.nn.functional.interpolate(latents[:, :3], size = (height, width), mode = "nearest")
+        rgb = ((rgb.tanh() + 1) * 127.5).to(torch.uint8).permute(0, 2, 3, 1).numpy()
+        return [Image.fromarray(x) for x in rgb]
+
+
+def makePortrait(width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    Draw a synthetic portrait with a head, a neck and shoulders on a textured background.
+
+    Args:
+        width (int): The width of the portrait.
+        height (int): The height of the portrait.
+        seed (int, optional): The seed of the background texture. Defaults to 0.
+
+    Returns:
+        Image.Image: The RGB portrait.
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.integers(90, 170, size = (height, width, 3), dtype = np.uint8)
+    image = cv2.GaussianBlur(image, (0, 0), sigmaX = max(width / 200, 1))
+    skin = (190, 150, 120)
+    cv2.ellipse(image, (width // 2, int(height * 0.25)), (int(width * 0.12), int(height * 0.13)), 0, 0, 360, skin, -1)
+    cv2.rectangle(image, (int(width * 0.44), int(height * 0.33)), (int(width * 0.56), int(height * 0.46)), skin, -1)
+    cv2.ellipse(image, (width // 2, height), (int(width * 0.4), int(height * 0.56)), 0, 180, 360, (150, 40, 60), -1)
+    return Image.fromarray(image)
+
+
+def makeNecklace(width: int = 600, height: int = 400, seed: int = 0) -> Image.Image:
+    """
+    Draw a synthetic necklace as a U-shaped string of beads with an anti-aliased alpha channel.
+
+    Args:
+        width (int, optional): The width of the sprite. Defaults to 600.
+        height (int, optional): The height of the sprite. Defaults to 400.
+        seed (int, optional): The seed of the bead colours. Defaults to 0.
+
+    Returns:
+        Image.Image: The RGBA necklace.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 4), dtype = np.uint8)
+    radius = max(width // 40, 2)
+    for t in np.linspace(0, np.pi, 40):
+        x = int(width / 2 - np.cos(t) * (width / 2 - radius))
+        y = int(radius + np.sin(t) * (height - 2 * radius - 1))
+        colour = tuple(int(c) for c in rng.integers(150, 256, size = 3)) + (255,)
+        cv2.circle(image, (x, y), radius, colour, -1, lineType = cv2.LINE_AA)
+    return Image.fromarray(image, mode = "RGBA")
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """
+    Summarize latency samples.
+
+    Args:
+        samples (list[float]): The latencies in seconds.
+
+    Returns:
+        dict[str, float]: The p50, p95 and mean latency in milliseconds and the throughput per second.
+    """
+    samples = np.array(samples)
+    return {
+        "p50Ms": float(np.percentile(samples, 50) * 1000),
+        "p95Ms": float(np.percentile(samples, 95) * 1000),
+        "meanMs": float(samples.mean() * 1000),
+        "throughput": float(len(samples) / samples.sum())
+    }
+
+
+def measure(function: Callable[[], Any], repeats: int, warmup: int) -> dict[str, float]:
+    """
+    Time a stage and measure its peak memory.
+
+    Latencies are measured without tracing; the peak of Python and NumPy allocations is taken
+    from one extra traced run, since tracemalloc slows allocations down.
+
+    Args:
+        function (Callable[[], Any]): The stage to run, failing with an exception or returning None on error.
+        repeats (int): The number of timed runs.
+        warmup (int): The number of untimed runs before measuring.
+
+    Returns:
+        dict[str, float]: The latency summary and the peak memory in MB.
+
+    Raises:
+        RuntimeError: If the stage did not produce a result.
+    """
+    for _ in range(warmup):
+        if function() is None:
+            raise RuntimeError("the benchmarked stage did not produce a result, check the logs")
+
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"runs": repeats, **summarize(samples), "peakMemoryMB": peak / 2 ** 20}
+
+
+def detectLandmarks(landmarkService: PoseLandmarkService, image: np.ndarray) -> list[list[int]]:
+    """
+    Run pose detection on an image the way `PoseLandmarkService.getNeckPoints` does, bypassing the landmark cache.
+
+    The image is downscaled to the `detectionSide` proxy, hashed and passed to MediaPipe. No person 
+    is found in the synthetic portraits, but detection costs about the same either way.
+
+    Args:
+        landmarkService (PoseLandmarkService): The real landmark service.
+        image (np.ndarray): The portrait at working resolution.
+
+    Returns:
+        list[list[int]]: The detected landmarks, empty if no person was found.
+    """
+    landmarkService.cache.clear()
+    proxy, _ = getProxy(image, landmarkService.detectionSide)
+    return landmarkService.getLandmarks(proxy)
+
+
+def getPsnr(image: Image.Image, reference: Image.Image) -> float:
+    """Return the peak signal-to-noise ratio of an image against a reference in dB, capped at 100."""
+    error = np.mean((np.asarray(image, dtype = np.float32) - np.asarray(reference, dtype = np.float32)) ** 2)
+    return 100.0 if error == 0 else float(min(10 * np.log10(255 ** 2 / error), 100.0))
+
+
+def compareSharedPrefix(
+    clothingTryOn: ClothingTryOn,
+    tryOn: Image.Image,
+    mask: Image.Image,
+    branchFractions: list[float],
+    repeats: int,
+    warmup: int
+) -> list[dict[str, Any]]:
+    """
+    Compare shared-prefix denoising with independent runs of every colour.
+
+    The diffusion stage of one job is timed once with independent runs and once per branch 
+    fraction with a shared prefix. Quality is the PSNR of the raw output of the first colour 
+    against its independent run; the first colour starts from the same noise in both modes, 
+    so the PSNR isolates the effect of the colour-neutral prefix.
+
+    Args:
+        clothingTryOn (ClothingTryOn): The clothing try-on, with the stub or the real pipeline.
+        tryOn (Image.Image): The necklace try-on image.
+        mask (Image.Image): The binary necklace mask.
+        branchFractions (list[float]): The fractions of shared denoising steps to compare.
+        repeats (int): The number of timed runs per mode.
+        warmup (int): The number of untimed runs per mode.
+
+    Returns:
+        list[dict[str, Any]]: One result per mode, with the branch fraction and the PSNR of the shared-prefix modes.
+    """
+    job = clothingTryOn.prepareJob(image = tryOn, mask = mask)
+    width, height = job.image.size
+    sharedPrefix, branchFraction = clothingTryOn.sharedPrefix, clothingTryOn.branchFraction
+    try:
+        clothingTryOn.sharedPrefix = False
+        print(f"benchmarking independent diffusion at {width}x{height}", file = sys.stderr)
+        reference = clothingTryOn.runDiffusion([job])[0]
+        results = [{
+            "stage": "diffusionIndependent", "width": width, "height": height,
+            **measure(lambda: clothingTryOn.runDiffusion([job]), repeats = repeats, warmup = warmup)
+        }]
+
+        clothingTryOn.sharedPrefix = True
+        for fraction in branchFractions:
+            clothingTryOn.branchFraction = fraction
+            print(f"benchmarking shared-prefix diffusion branching at {fraction:.0%} at {width}x{height}", file = sys.stderr)
+            outputs = clothingTryOn.runDiffusion([job])[0]
+            results.append({
+                "stage": f"diffusionShared{round(fraction * 100)}", "width": width, "height": height,
+                "branchFraction": fraction, "psnrDb": getPsnr(outputs[0], reference[0]),
+                **measure(lambda: clothingTryOn.runDiffusion([job]), repeats = repeats, warmup = warmup)
+            })
+    finally:
+        clothingTryOn.sharedPrefix, clothingTryOn.branchFraction = sharedPrefix, branchFraction
+    return results
+
+
+def getEnvironment() -> dict[str, Any]:
+    """Describe the machine and library versions a run was made with."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpuCount": os.cpu_count(),
+        "torchThreads": torch.get_num_threads(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "torch": torch.__version__
+    }
+
+
+def runBenchmarks(
+    resolutions: list[tuple[int, int]],
+    repeats: int,
+    warmup: int,
+    steps: int,
+    branchFractions: list[float] = None,
+    realModel: bool = False
+) -> dict[str, Any]:
+    """
+    Benchmark pose detection, the necklace try-on, the binary mask and the clothing try-on on synthetic inputs.
+
+    Args:
+        resolutions (list[tuple[int, int]]): The (width, height) of the synthetic portraits.
+        repeats (int): The number of timed runs per stage and resolution.
+        warmup (int): The number of untimed runs per stage and resolution.
+        steps (int): The number of denoising steps of the stub pipeline.
+        branchFractions (list[float], optional): The shared-prefix branch fractions compared with 
+            independent diffusion runs. Defaults to no comparison.
+        realModel (bool, optional): Whether to load the configured inpainting model instead of the stub,
+            which makes the diffusion latencies and the shared-prefix quality meaningful. Defaults to False.
+
+    Returns:
+        dict[str, Any]: The environment, the settings and one result per stage and resolution.
+    """
+    torch.manual_seed(0)
+    landmarkService = SyntheticLandmarkService()
+    poseLandmarkService = PoseLandmarkService()
+    with tempfile.TemporaryDirectory() as directory:
+        catalogueIndex = CatalogueIndex()
+        catalogueIndex.directory = directory
+        necklaceTryOn = NecklaceTryOn(landmarkService = landmarkService, catalogueIndex = catalogueIndex)
+        clothingTryOn = ClothingTryOn(
+            landmarkService = landmarkService, catalogueIndex = catalogueIndex,
+            pipeline = None if realModel else StubInpaintPipeline(numInferenceSteps = steps)
+        )
+        necklace = makeNecklace()
+
+        results = []
+        for width, height in resolutions:
+            portrait = makePortrait(width, height)
+            workingImage = ingestImage(portrait, maxSide = getMaxSide(necklaceTryOn.config))
+            tryOn, mask = clothingTryOn.getBinaryMask(portrait, necklace)
+            stages = {
+                "landmarks": lambda: detectLandmarks(poseLandmarkService, workingImage),
+                "necklaceTryOn": lambda: necklaceTryOn.necklaceTryOn(portrait, necklace),
+                "getBinaryMask": lambda: clothingTryOn.getBinaryMask(portrait, necklace),
+                "generateImage": lambda: clothingTryOn.generateImage(tryOn, mask)
+            }
+            for stage, function in stages.items():
+                print(f"benchmarking {stage} at {width}x{height}", file = sys.stderr)
+                results.append({
+                    "stage": stage, "width": width, "height": height,
+                    **measure(function, repeats = repeats, warmup = warmup)
+                })
+            if branchFractions:
+                results.extend(compareSharedPrefix(
+                    clothingTryOn, tryOn, mask, branchFractions, repeats = repeats, warmup = warmup
+                ))
+
+    return {
+        "environment": getEnvironment(),
+        "settings": {
+            "repeats": repeats, "warmup": warmup, "stubSteps": None if realModel else steps,
+            "colours": clothingTryOn.colours, "branchFractions": branchFractions or []
+        },
+        "results": results
+    }
+
+
+def compareResults(current: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """
+    Compare the p50 latencies of two runs.
+
+    Args:
+        current (dict[str, Any]): The results of this run.
+        baseline (dict[str, Any]): The results of a previous run.
+        tolerance (float): The relative slowdown allowed before a stage counts as a regression.
+
+    Returns:
+        list[str]: A description of every regressed stage.
+    """
+    previous = {(x["stage"], x["width"], x["height"]): x for x in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get((result["stage"], result["width"], result["height"]))
+        if before is None:
+            continue
+        ratio = result["p50Ms"] / before["p50Ms"]
+        line = f"{result['stage']} {result['width']}x{result['height']}: {before['p50Ms']:.1f} ms -> {result['p50Ms']:.1f} ms ({ratio:.2f}x)"
+        print(line)
+        if ratio > 1 + tolerance:
+            regressions.append(line)
+    return regressions
+
+
+def printResults(report: dict[str, Any]) -> None:
+    """Print the results as a table."""
+    print(f"{'stage':<22}{'size':>12}{'p50 ms':>10}{'p95 ms':>10}{'per s':>9}{'peak MB':>10}{'PSNR dB':>9}")
+    for x in report["results"]:
+        psnr = f"{x['psnrDb']:>9.1f}" if "psnrDb" in x else f"{'':>9}"
+        print(
+            f"{x['stage']:<22}{str(x['width']) + 'x' + str(x['height']):>12}"
+            f"{x['p50Ms']:>10.1f}{x['p95Ms']:>10.1f}{x['throughput']:>9.2f}{x['peakMemoryMB']:>10.1f}{psnr}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Benchmark the try-on pipeline offline on CPU.")
+    parser.add_argument("--resolutions", nargs = "+", default = DEFAULT_RESOLUTIONS, help = "portrait sizes as WIDTHxHEIGHT")
+    parser.add_argument("--repeats", type = int, default = 20, help = "timed runs per stage and resolution")
+    parser.add_argument("--warmup", type = int, default = 2, help = "untimed runs per stage and resolution")
+    parser.add_argument("--steps", type = int, default = 4, help = "denoising steps of the stub pipeline")
+    parser.add_argument("--branch-fractions", type = float, nargs = "*", default = DEFAULT_BRANCH_FRACTIONS, help = "shared-prefix branch points to compare, none to skip")
+    parser.add_argument("--model", action = "store_true", help = "use the configured inpainting model instead of the stub")
+    parser.add_argument("--output", default = "artifacts/benchmarks/latest.json", help = "where to save the results")
+    parser.add_argument("--baseline", help = "a previous results file to compare against")
+    parser.add_argument("--tolerance", type = float, default = 0.15, help = "allowed relative p50 slowdown")
+    args = parser.parse_args()
+
+    # the step-by-step narration of the components would dominate the measurements
+    logger.setLevel(logging.WARNING)
+
+    resolutions = [tuple(int(y) for y in x.lower().split("x")) for x in args.resolutions]
+    report = runBenchmarks(
+        resolutions, repeats = args.repeats, warmup = args.warmup, steps = args.steps,
+        branchFractions = args.branch_fractions, realModel = args.model
+    )
+    printResults(report)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok = True)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent = 2)
+    print(f"results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compareResults(report, json.load(file), tolerance = args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
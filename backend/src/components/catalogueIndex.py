@@ -0,0 +1,235 @@
+from src.utils.functions import getConfig, getImageHash
+from src.utils.cache import LRUCache
+from src.utils.logger import logger
+from dataclasses import dataclass
+from typing import Iterable
+from PIL import Image
+import numpy as np
+import threading
+import os
+import cv2
+
+@dataclass
+class CatalogueEntry:
+    """
+    Precomputed data for a single catalogue necklace.
+
+    Attributes:
+        key (str): The content hash of the original necklace image.
+        size (tuple[int, int]): The (width, height) of the original necklace image.
+        alphaBounds (tuple[int, int, int, int]): The (x, y, width, height) bounding box of the visible pixels.
+        topEdge (float): The column of the first necklace pixel in the top row, normalized by the width.
+        pyramid (list[np.ndarray]): Premultiplied RGBA sprites, from full size down to the smallest level.
+
+    Methods:
+        getSprite(width: int, height: int) -> np.ndarray:
+            Resamples the closest pyramid level to the requested size.
+    """
+    key: str
+    size: tuple[int, int]
+    alphaBounds: tuple[int, int, int, int]
+    topEdge: float
+    pyramid: list[np.ndarray]
+
+    def getSprite(self, width: int, height: int) -> np.ndarray:
+        """
+        Resample the necklace to the requested size from the closest pyramid level.
+
+        The smallest level that is still at least as wide as the target is used, so
+        downscaling never reads more pixels than needed and upscaling starts from full size.
+
+        Args:
+            width (int): The target width in pixels.
+            height (int): The target height in pixels.
+
+        Returns:
+            np.ndarray: The premultiplied RGBA sprite of the requested size.
+        """
+        level = self.pyramid[0]
+        for candidate in self.pyramid[1:]:
+            if candidate.shape[1] < width:
+                break
+            level = candidate
+        if (level.shape[1], level.shape[0]) == (width, height):
+            return level.copy()
+        interpolation = cv2.INTER_AREA if level.shape[1] > width else cv2.INTER_CUBIC
+        return cv2.resize(level, (width, height), interpolation = interpolation)
+
+
+def premultiplyAlpha(image: np.ndarray) -> np.ndarray:
+    """
+    Premultiply the colour channels of an RGBA image by its alpha channel.
+
+    Args:
+        image (np.ndarray): The straight-alpha RGBA image.
+
+    Returns:
+        np.ndarray: The premultiplied RGBA image.
+    """
+    alpha = image[:, :, 3:4].astype(np.uint16)
+    premultiplied = image.copy()
+    premultiplied[:, :, :3] = ((image[:, :, :3].astype(np.uint16) * alpha + 127) // 255).astype(np.uint8)
+    return premultiplied
+
+
+class CatalogueIndex:
+    """
+    An index of precomputed catalogue necklaces.
+
+    Every necklace is analysed once: its visible bounding box, the normalized offset of its
+    top edge and a small pyramid of pre-scaled, premultiplied sprites are computed, so the
+    try-on components only look the entry up and do one final resample. Entries of the
+    catalogue are built at startup and written to disk, so they are reloaded after a restart.
+    Uploaded necklaces are built lazily the first time they are seen and only kept in a
+    bounded in-memory cache. Concurrent lookups of the same new necklace build it once,
+    while lookups of other necklaces go ahead.
+
+    Attributes:
+        config (ConfigParser): Configuration settings loaded from the config.ini file.
+        directory (str): The directory the index entries are persisted to.
+        entries (LRUCache): The most recently used entries, keyed by image hash.
+        pyramidLevels (int): The maximum number of levels in each sprite pyramid.
+        minWidth (int): The width below which no further pyramid levels are built.
+
+    Methods:
+        get(jewellery: np.ndarray) -> CatalogueEntry:
+            Returns the entry of a necklace, loading or building it if needed.
+
+        build(images: Iterable[Image.Image]) -> None:
+            Builds the entries of the whole catalogue.
+    """
+
+    def __init__(self):
+        """Initialize the CatalogueIndex with the configured storage directory and pyramid settings."""
+        self.config = getConfig("config.ini")
+        self.directory = self.config.get("CATALOGUE INDEX", "directory", fallback = "artifacts/catalogueIndex")
+        self.pyramidLevels = self.config.getint("CATALOGUE INDEX", "pyramidLevels", fallback = 4)
+        self.minWidth = self.config.getint("CATALOGUE INDEX", "minWidth", fallback = 64)
+        os.makedirs(self.directory, exist_ok = True)
+        self.entries = LRUCache(maxSize = self.config.getint("CATALOGUE INDEX", "memoryEntries", fallback = 512))
+        self._keyLocks = {}
+        self._lock = threading.Lock()
+
+    def get(self, jewellery: np.ndarray) -> CatalogueEntry:
+        """
+        Look up the index entry of a necklace, building it in memory if it is not indexed yet.
+
+        Args:
+            jewellery (np.ndarray): The RGBA necklace image.
+
+        Returns:
+            CatalogueEntry: The precomputed entry of the necklace.
+        """
+        key = getImageHash(jewellery)
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+
+        # only lookups of the same necklace wait for each other, the lock is dropped with its last user
+        with self._lock:
+            keyLock, users = self._keyLocks.get(key, (threading.Lock(), 0))
+            self._keyLocks[key] = (keyLock, users + 1)
+        try:
+            with keyLock:
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self._load(key)
+                    if entry is None:
+                        logger.info("building the catalogue index entry for a new necklace")
+                        entry = self._build(key, jewellery)
+                    self.entries.put(key, entry)
+        finally:
+            with self._lock:
+                keyLock, users = self._keyLocks[key]
+                if users > 1:
+                    self._keyLocks[key] = (keyLock, users - 1)
+                else:
+                    del self._keyLocks[key]
+        return entry
+
+    def build(self, images: Iterable[Image.Image]) -> None:
+        """
+        Build the index entries of every necklace in the catalogue and persist them.
+
+        Args:
+            images (Iterable[Image.Image]): The catalogue necklace images.
+        """
+        logger.info("building the catalogue index")
+        for image in images:
+            entry = self.get(np.array(image.convert("RGBA")))
+            if not os.path.exists(self._path(entry.key)):
+                self._save(entry)
+
+    def _build(self, key: str, jewellery: np.ndarray) -> CatalogueEntry:
+        """Analyse a necklace and build its pyramid of premultiplied sprites."""
+        if jewellery.shape[2] == 3:
+            jewellery = cv2.cvtColor(jewellery, cv2.COLOR_RGB2RGBA)
+        sprite = premultiplyAlpha(jewellery)
+
+        visibleRows = np.flatnonzero(sprite[:, :, 3].any(axis = 1))
+        visibleColumns = np.flatnonzero(sprite[:, :, 3].any(axis = 0))
+        if visibleRows.size:
+            alphaBounds = (
+                int(visibleColumns[0]),
+                int(visibleRows[0]),
+                int(visibleColumns[-1] - visibleColumns[0] + 1),
+                int(visibleRows[-1] - visibleRows[0] + 1)
+            )
+        else:
+            alphaBounds = (0, 0, 0, 0)
+
+        topRow = cv2.cvtColor(sprite[:1], cv2.COLOR_BGRA2GRAY)[0]
+        edge = (topRow != 255) & (topRow != 0)
+        topEdge = (int(edge.argmax()) if edge.any() else sprite.shape[1] - 1) / sprite.shape[1]
+
+        pyramid = [sprite]
+        while len(pyramid) < self.pyramidLevels and pyramid[-1].shape[1] // 2 >= self.minWidth:
+            level = pyramid[-1]
+            pyramid.append(cv2.resize(
+                level, (level.shape[1] // 2, max(level.shape[0] // 2, 1)), interpolation = cv2.INTER_AREA
+            ))
+
+        return CatalogueEntry(
+            key = key,
+            size = (sprite.shape[1], sprite.shape[0]),
+            alphaBounds = alphaBounds,
+            topEdge = topEdge,
+            pyramid = pyramid
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def _load(self, key: str) -> CatalogueEntry:
+        """Load a persisted entry, returning None if it does not exist or cannot be read."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                nLevels = int(data["nLevels"])
+                return CatalogueEntry(
+                    key = key,
+                    size = tuple(int(x) for x in data["size"]),
+                    alphaBounds = tuple(int(x) for x in data["alphaBounds"]),
+                    topEdge = float(data["topEdge"]),
+                    pyramid = [data[f"level{x}"] for x in range(nLevels)]
+                )
+        except Exception as e:
+            logger.warning(f"discarding unreadable catalogue index entry {path}: {e}")
+            return None
+
+    def _save(self, entry: CatalogueEntry) -> None:
+        """Persist an entry atomically so a crash never leaves a partial file behind."""
+        path = self._path(entry.key)
+        temporaryPath = f"{path}.{os.getpid()}.tmp"
+        with open(temporaryPath, "wb") as file:
+            np.savez(
+                file,
+                nLevels = len(entry.pyramid),
+                size = np.array(entry.size),
+                alphaBounds = np.array(entry.alphaBounds),
+                topEdge = entry.topEdge,
+                **{f"level{x}": level for x, level in enumerate(entry.pyramid)}
+            )
+        os.replace(temporaryPath, path)
\ No newline at end of file
@@ -1,17 +1,72 @@
-from diffusers import StableDiffusionInpaintPipeline
 from src.utils.exceptions import CustomException
-from cvzone.PoseModule import PoseDetector
-from src.utils.functions import getConfig
+from src.components.poseLandmarks import PoseLandmarkService
+from src.components.necklacePlacement import solvePlacement
+from src.components.catalogueIndex import CatalogueIndex
+from src.components.inpaintingModel import loadInpaintingPipeline
+from src.utils.compositing import compositeWithMask
+from src.utils.recolour import recolourVariants
+from src.utils.ingest import ingestImage, getMaxSide
+from src.utils.functions import getConfig, getColours
+from src.utils.metrics import metrics, span
 from src.utils.logger import logger
 from PIL.ImageOps import grayscale
+from typing import Any, Callable, Iterator
+from dataclasses import dataclass
 from PIL import Image
 import numpy as np
-import cvzone
 import torch
-import math
+import contextvars
+import threading
+import queue
 import cv2
 import gc
 
+PROMPT_TEMPLATE = "{colour}, South Indian Saree, properly worn, natural setting, elegant, natural look, neckline without jewellery, simple"
+NEUTRAL_PROMPT = PROMPT_TEMPLATE.format(colour = "").lstrip(", ")
+NEGATIVE_PROMPT = ("necklaces, jewellery, jewelry, necklace, neckpiece, garland, chain, neck wear, "
+                   "jewelled neck, jeweled neck, necklace on neck, jewellery on neck, accessories, "
+                   "watermark, text, changed background, wider body, narrower body, bad proportions, "
+                   "extra limbs, mutated hands, changed sizes, altered proportions, unnatural body proportions, "
+                   "blurry, ugly")
+
+# linear approximation of the Stable Diffusion VAE decoder used for previews
+LATENT_RGB_FACTORS = [
+    [0.298, 0.207, 0.208],
+    [0.187, 0.286, 0.173],
+    [-0.158, 0.189, 0.264],
+    [-0.184, -0.271, -0.473]
+]
+
+@dataclass
+class InpaintingJob:
+    """
+    The prepared inputs of the diffusion stage for a single request.
+
+    Attributes:
+        image (Image.Image): The classically inpainted image, or its inpainting window in ROI mode, at model resolution.
+        mask (Image.Image): The extended inpainting mask at model resolution.
+        originalSize (tuple[int, int]): The (width, height) of the user's image.
+        necklaceMask (np.ndarray): The original binary necklace mask at full resolution.
+        jewelleryMask (np.ndarray): The necklace pixels of the try-on image, black elsewhere. Unused in ROI mode.
+        region (tuple[int, int, int, int]): The (x1, y1, x2, y2) inpainting window in ROI mode, None otherwise.
+        background (np.ndarray): The try-on image the window is blended back into in ROI mode.
+        blendMask (np.ndarray): The feathered float32 weight of the generated pixels inside the window in ROI mode.
+        colourIndices (list[int]): The colours to generate for the job, all configured colours if None.
+        outputSize (tuple[int, int]): The (width, height) the merged images are resized to, such as the size of 
+            the upload before it was downscaled to the working resolution, None to keep the working resolution.
+    """
+    image: Image.Image
+    mask: Image.Image
+    originalSize: tuple[int, int]
+    necklaceMask: np.ndarray
+    jewelleryMask: np.ndarray
+    region: tuple[int, int, int, int] = None
+    background: np.ndarray = None
+    blendMask: np.ndarray = None
+    colourIndices: list[int] = None
+    outputSize: tuple[int, int] = None
+
+
 class ClothingTryOn:
     """
     A class to simulate clothing try-ons by overlaying clothing images on user images 
@@ -24,40 +79,106 @@ class ClothingTryOn:
     do not interfere with the clothing representation.
 
     Attributes:
-        detector (PoseDetector): An instance of PoseDetector for identifying body landmarks.
+        landmarkService (PoseLandmarkService): The shared service for identifying body landmarks.
+        catalogueIndex (CatalogueIndex): The shared index of precomputed necklace sprites.
         config (ConfigParser): Configuration settings loaded from an external config file.
-        pipeline (StableDiffusionInpaintPipeline): The Stable Diffusion inpainting model for 
-            generating images based on user prompts and masks.
+        maxSide (int): The longer side large uploads are downscaled to before processing, 0 to keep the original resolution.
+        pipeline (CachedInpaintPipeline): The Stable Diffusion inpainting model for 
+            generating images based on user prompts and masks, wrapped with caches for 
+            prompt embeddings and masked-image latents, loaded with the configured inference profile.
+        inferenceKwargs (dict[str, Any]): Extra generation arguments required by the inference profile.
+        onnx (bool): Whether the model runs on ONNX Runtime, which generates one variant per call 
+            with a numpy random state and streams no previews.
+        colours (list[str]): The colours a variant is generated for.
+        seed (int): The base seed; the variant at position i is generated with seed + i.
+        maxBatchSize (int): The maximum number of variants generated in a single pipeline call.
+        scheduler (InferenceScheduler): An optional scheduler batching the diffusion stage across requests.
+        previewEvery (int): The number of denoising steps between streamed previews, 0 to disable them.
+        streamBatchSize (int): The number of variants generated per pipeline call when streaming, `maxBatchSize` if not configured.
+        roiMode (bool): Whether only a window around the inpainting mask is inpainted, at its native aspect ratio.
+        roiPadding (int): The rows of context kept above the inpainting mask in ROI mode.
+        roiResolution (int): The longer side of the generated window in ROI mode.
+        fastVariants (bool): Whether, by default, only the first colour is generated and the others are 
+            derived from it by recolouring the garment.
+        sharedPrefix (bool): Whether the colours of a job share the early denoising steps, run with a colour-neutral prompt.
+        branchFraction (float): The fraction of the denoising steps shared before the colours branch off.
 
     Methods:
         getBinaryMask(image: Image.Image, jewellery: Image.Image) -> tuple[Image.Image]:
             Generates a binary mask indicating the presence of the clothing on the user's image.
         
-        generateImage(image: Image.Image, mask: Image.Image) -> tuple[Image.Image]:
+        prepareJob(image: Image.Image, mask: Image.Image) -> InpaintingJob:
+            Prepares the inputs of the diffusion stage for a single request.
+
+        runDiffusion(jobs: list[InpaintingJob]) -> list[list[Image.Image]]:
+            Generates every colour variant of several jobs in batched pipeline calls.
+
+        recolourOutputs(job: InpaintingJob, output: Image.Image) -> list[Image.Image]:
+            Derives the remaining colour variants from the first generated one.
+
+        mergeOutputs(job: InpaintingJob, outputs: list[Image.Image]) -> tuple[Image.Image]:
+            Restores the original size and the necklace on the generated images.
+
+        generateImage(image: Image.Image, mask: Image.Image, fastVariants: bool, outputSize: tuple[int, int]) -> tuple[Image.Image]:
             Applies inpainting to an image using the provided binary mask, generating new images 
             based on specific color prompts while excluding jewelry and accessories.
+
+        generateImageStream(image: Image.Image, mask: Image.Image, fastVariants: bool, outputSize: tuple[int, int]) -> Iterator[tuple[Image.Image]]:
+            Streams the colour variants and their previews as soon as they are available.
+
+        warmUp() -> None:
+            Runs a single-step dummy generation to set up the model kernels.
     """
 
-    def __init__(self):
-        """Initialize the NecklaceTryOn class with a PoseDetector and configuration settings."""
-        self.detector = PoseDetector()
-        self.config = getConfig("config.ini")
-        modelId = self.config.get("CLOTHING TRY ON", "modelId")
-        device = self.config.get("CLOTHING TRY ON", "device")
-        self.pipeline = StableDiffusionInpaintPipeline.from_pretrained(
-            modelId, torch_dtype = torch.float16
-        ).to(device)
+    def __init__(self, landmarkService: PoseLandmarkService = None, catalogueIndex: CatalogueIndex = None, pipeline: Any = None):
+        """
+        Initialize the ClothingTryOn class with a landmark service, configuration settings and the inpainting model.
 
-    def getBinaryMask(self, image: Image.Image, jewellery: Image.Image) -> tuple[Image.Image]:
+        Args:
+            landmarkService (PoseLandmarkService, optional): The landmark service to share with 
+                other components. A new one is created if not provided.
+            catalogueIndex (CatalogueIndex, optional): The catalogue index to share with other 
+                components. A new one is created if not provided.
+            pipeline (Any, optional): An inpainting pipeline to use instead of loading the 
+                configured model, such as the stub used by the benchmarks.
+        """
+        self.landmarkService = landmarkService if landmarkService is not None else PoseLandmarkService()
+        self.catalogueIndex = catalogueIndex if catalogueIndex is not None else CatalogueIndex()
+        self.config = getConfig("config.ini")
+        self.maxSide = getMaxSide(self.config)
+        if pipeline is not None:
+            self.pipeline, self.inferenceKwargs = pipeline, {}
+        else:
+            self.pipeline, self.inferenceKwargs = loadInpaintingPipeline(self.config)
+        self.onnx = pipeline is None and self.config.get("CLOTHING TRY ON", "profile", fallback = "cuda") == "cpu" \
+            and self.config.getboolean("CPU PROFILE", "onnx", fallback = False)
+        self.colours = getColours(self.config)
+        self.seed = self.config.getint("CLOTHING TRY ON", "seed", fallback = 0)
+        self.maxBatchSize = max(self.config.getint("CLOTHING TRY ON", "maxBatchSize", fallback = len(self.colours)), 1)
+        self.scheduler = None
+        self.previewEvery = self.config.getint("STREAMING", "previewEvery", fallback = 0)
+        if self.onnx and self.previewEvery > 0:
+            logger.warning("streamed previews are not supported by the ONNX Runtime backend and are disabled")
+            self.previewEvery = 0
+        self.streamBatchSize = max(self.config.getint("STREAMING", "batchSize", fallback = 0) or self.maxBatchSize, 1)
+        self.roiMode = self.config.getboolean("CLOTHING TRY ON", "roiMode", fallback = False)
+        self.roiPadding = self.config.getint("CLOTHING TRY ON", "roiPadding", fallback = 32)
+        self.roiResolution = self.config.getint("CLOTHING TRY ON", "roiResolution", fallback = 512)
+        self.fastVariants = self.config.get("CLOTHING TRY ON", "variantMode", fallback = "full").strip().lower() == "fast"
+        self.sharedPrefix = self.config.getboolean("SHARED PREFIX", "enabled", fallback = False)
+        self.branchFraction = self.config.getfloat("SHARED PREFIX", "branchFraction", fallback = 0.3)
+
+    def getBinaryMask(self, image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray) -> tuple[Image.Image]:
         """
         Generate a binary mask indicating the presence of the necklace on the user's image.
 
         This function overlays a jewelry image on the user's image and creates a binary mask, where
-        the necklace is represented in white and the background in black.
+        the necklace is represented in white and the background in black. Both are produced in a 
+        single pass over the bounding box of the necklace.
 
         Args:
-            image (Image.Image): The user's image, ideally captured in a standing, upright position.
-            jewellery (Image.Image): The image of the jewelry piece (e.g., necklace) to be overlaid.
+            image (Image.Image | np.ndarray): The user's image, ideally captured in a standing, upright position.
+            jewellery (Image.Image | np.ndarray): The RGBA image of the jewelry piece (e.g., necklace) to be overlaid.
 
         Returns:
             tuple[Image.Image]: A tuple containing:
@@ -69,160 +190,542 @@ class ClothingTryOn:
         """
         try:
             logger.info("converting images to numpy arrays")
-            image = np.array(image)
-            jewellery = np.array(jewellery)
-
-            logger.info("creating a copy of original image for actual overlay")
-            copyImage = image.copy()
-            
-            logger.info("detecting body landmarks from the input image")
-            image = self.detector.findPose(image)
-            lmList, _ = self.detector.findPosition(image, bboxWithHands = False, draw = False)
-            pt12, pt11, pt10, pt9 = (
-                lmList[12][:2],
-                lmList[11][:2],
-                lmList[10][:2],
-                lmList[9][:2],
-            )        
+            with span("ingest"):
+                image = ingestImage(image, maxSide = self.maxSide)
+                jewellery = np.array(jewellery)
 
             logger.info("calculating the precise neck points")
-            avgX1 = int(pt12[0] + (pt10[0] - pt12[0]) / 1.75)
-            avgY1 = int(pt12[1] - (pt12[1] - pt10[1]) / 1.75)
-            avgX2 = int(pt11[0] - (pt11[0] - pt9[0]) / 1.75)
-            avgY2 = int(pt11[1] - (pt11[1] - pt9[1]) / 1.75)
-
-            logger.info("rescaling the necklace to appropriate dimensions")
-            xDist = avgX2 - avgX1
-            origImgRatio = xDist / jewellery.shape[1]
-            yDist = jewellery.shape[0] * origImgRatio
-            jewellery = cv2.resize(
-                jewellery, (int(xDist), int(yDist)), interpolation = cv2.INTER_CUBIC
-            )        
-
-            logger.info("calculating required offset to be added to the necklace image for perfect fitting")
-            imageGray = cv2.cvtColor(jewellery, cv2.COLOR_BGRA2GRAY)
-            for offsetOrig in range(imageGray.shape[1]):
-                pixelValue = imageGray[0, :][offsetOrig]
-                if (pixelValue != 255) & (pixelValue != 0):
-                    break
-                else:
-                    continue
-            offset = int(self.config.getfloat("NECKLACE TRY ON", "offsetFactor") * xDist * (offsetOrig / jewellery.shape[1]))
-            yCoordinate = avgY1 - offset
-
-            logger.info("tilting the necklace image as per the necklace points")
-            angle = math.ceil(
-                self.detector.findAngle(
-                    p1 = (avgX2, avgY2), p2 = (avgX1, avgY1), p3 = (avgX2, avgY1)
-                )[0]
-            )
-            if avgY2 < avgY1:
-                pass
-            else:
-                angle = angle * -1
-            jewellery = cvzone.rotateImage(jewellery, angle)
-
-            logger.info("checking if the necklace is getting out of the frame and trimming from above if needed")
-            availableSpace = copyImage.shape[0] - yCoordinate
-            extra = jewellery.shape[0] - availableSpace
-
-            logger.info("applying the calculated settings")
-            if extra > 0:
-                jewellery = jewellery[extra + 10 :, :]
-                return self.getBinaryMask(
-                    Image.fromarray(copyImage), Image.fromarray(jewellery)
+            with span("landmarks"):
+                avgX1, avgY1, avgX2, avgY2 = self.landmarkService.getNeckPoints(image)
+
+            logger.info("solving the necklace placement in a single pass")
+            with span("placement"):
+                placement = solvePlacement(
+                    jewellery = self.catalogueIndex.get(jewellery),
+                    neckPoints = (avgX1, avgY1, avgX2, avgY2),
+                    frameHeight = image.shape[0],
+                    offsetFactor = self.config.getfloat("NECKLACE TRY ON", "offsetFactor")
                 )
-            else:
-                tryOnOutput = cvzone.overlayPNG(copyImage, jewellery, (avgX1, yCoordinate))
-                tryOnOutput = Image.fromarray(tryOnOutput.astype(np.uint8))
-                blackedNecklace = np.zeros(shape = copyImage.shape)
-                cvzone.overlayPNG(blackedNecklace, jewellery, (avgX1, yCoordinate))
-                blackedNecklace = cv2.cvtColor(blackedNecklace.astype(np.uint8), cv2.COLOR_BGR2GRAY)
-                binaryMask = blackedNecklace * ((blackedNecklace > 5) * 255)
-                binaryMask[binaryMask >= 255] = 255
-                binaryMask[binaryMask < 255] = 0
-                binaryMask = Image.fromarray(binaryMask.astype(np.uint8))
-                return (tryOnOutput, binaryMask)
+
+            logger.info("applying the calculated settings and building the binary mask")
+            with span("compositing"):
+                tryOnOutput, binaryMask = compositeWithMask(image, placement.sprite, placement.position)
+            return (Image.fromarray(tryOnOutput), Image.fromarray(binaryMask))
 
         except Exception as e:
+            metrics.recordError("getBinaryMask", e)
             logger.error(CustomException(e))
-            print(CustomException(e))
 
 
-    def generateImage(self, image: Image.Image, mask: Image.Image) -> tuple[Image.Image]:
+    def prepareJob(self, image: Image.Image, mask: Image.Image) -> InpaintingJob:
+        """
+        Prepare the inputs of the diffusion stage for a single request.
+
+        The necklace area is first removed with classical inpainting, run only on the bounding 
+        box of the necklace, then the mask is extended down to the bottom of the frame. The whole 
+        image is then resized to the model resolution, or in ROI mode a padded window around the 
+        extended mask is cut out and resized at its own aspect ratio.
+
+        Args:
+            image (Image.Image): The input image where inpainting will be applied.
+            mask (Image.Image): The binary mask indicating areas to be inpainted.
+
+        Returns:
+            InpaintingJob: The prepared inputs of the diffusion stage.
+        """
+        arrOrig = np.array(grayscale(mask))
+        tryOn = np.array(image.convert("RGB"))
+
+        logger.info("inpainting the image using the original mask")
+        with span("inpaint"):
+            inpainted = inpaintNecklace(tryOn, arrOrig, radius = 15)
+
+        logger.info("preparing the mask for processing")
+        arr = arrOrig.copy()
+        maskY = np.where(arr == arr[arr != 0][0])[0][0]
+        arr[maskY:, :] = 255
+
+        if self.roiMode:
+            logger.info("cropping the inpainting window around the mask")
+            x1, y1, x2, y2 = getInpaintingWindow(int(maskY), image.size, padding = self.roiPadding)
+            size = getGenerationSize((x2 - x1, y2 - y1), resolution = self.roiResolution)
+            blendMask = cv2.GaussianBlur(
+                arr[y1:y2, x1:x2].astype(np.float32) / 255, (0, 0), sigmaX = max(self.roiPadding / 4, 1)
+            )
+            return InpaintingJob(
+                image = Image.fromarray(inpainted[y1:y2, x1:x2]).resize(size, Image.BICUBIC),
+                mask = Image.fromarray(arr[y1:y2, x1:x2]).resize(size),
+                originalSize = image.size,
+                necklaceMask = arrOrig,
+                jewelleryMask = None,
+                region = (x1, y1, x2, y2),
+                background = tryOn,
+                blendMask = blendMask
+            )
+
+        logger.info("creating a mask where the jewellery is represented")
+        jewelleryMask = np.bitwise_and(np.array(mask.convert("RGB")), tryOn)
+
+        logger.info("resizing images for consistency")
+        origSize = image.size
+        image = Image.fromarray(inpainted).resize((512, 512))
+        mask = Image.fromarray(arr).resize((512, 512))
+
+        return InpaintingJob(
+            image = image,
+            mask = mask,
+            originalSize = origSize,
+            necklaceMask = arrOrig,
+            jewelleryMask = jewelleryMask
+        )
+
+    def runDiffusion(
+        self,
+        jobs: list[InpaintingJob],
+        onOutput: Callable[[int, int, Image.Image], None] = None,
+        onPreview: Callable[[int, int, torch.Tensor], None] = None,
+        previewEvery: int = 0,
+        batchSize: int = None
+    ) -> list[list[Image.Image]]:
+        """
+        Generate every colour variant of every job in batched pipeline calls.
+
+        The (job, colour) pairs are flattened and sent to the pipeline in chunks of at most
+        `maxBatchSize` images, so several requests can share one denoising pass. Jobs with 
+        `colourIndices` only generate those colours. In shared-prefix mode, if the pipeline supports 
+        it, the colours of each job are generated from a single trajectory that branches after 
+        `branchFraction` of the steps, in batches of at most `batchSize` colours after the branch. 
+        Jobs are then generated one at a time, also inside a batch of the inference scheduler, so 
+        a result does not depend on the requests it was batched with. Only jobs with 
+        the same generation size share a chunk. Each variant is generated with the seed of its 
+        colour, so results do not depend on how it was batched. The ONNX Runtime pipeline only 
+        takes a single numpy random state, so on that backend every variant is generated in its 
+        own call and no previews are reported.
+
+        Args:
+            jobs (list[InpaintingJob]): The prepared jobs.
+            onOutput (Callable[[int, int, Image.Image], None], optional): Called with the job index, 
+                colour index and raw output as soon as a variant is finished.
+            onPreview (Callable[[int, int, torch.Tensor], None], optional): Called with the job index, 
+                colour index and intermediate latents of a variant every `previewEvery` denoising steps.
+            previewEvery (int, optional): The number of denoising steps between previews. Defaults to 0, 
+                which disables previews.
+            batchSize (int, optional): Overrides `maxBatchSize` for this call.
+
+        Returns:
+            list[list[Image.Image]]: The raw model outputs at model resolution, one list per job.
+        """
+        logger.info("generating images for different colors in batches")
+        entries = [
+            (x, y) for x in range(len(jobs))
+            for y in (jobs[x].colourIndices if jobs[x].colourIndices is not None else range(len(self.colours)))
+        ]
+        entries.sort(key = lambda x: jobs[x[0]].image.size)
+        outputs = [[] for _ in jobs]
+        batchSize = 1 if self.onnx else batchSize or self.maxBatchSize
+        sharedPrefix = self.sharedPrefix and hasattr(self.pipeline, "generateSharedPrefix")
+        chunks = []
+        for entry in entries:
+            if sharedPrefix:
+                # every job has its own shared trajectory, which the pipeline splits into batches after the branch
+                sameChunk = chunks and chunks[-1][0][0] == entry[0]
+            else:
+                sameChunk = chunks and len(chunks[-1]) < batchSize and jobs[chunks[-1][0][0]].image.size == jobs[entry[0]].image.size
+            if sameChunk:
+                chunks[-1].append(entry)
+            else:
+                chunks.append([entry])
+
+        def record(chunkEntries: list[tuple[int, int]], images: list[Image.Image]) -> None:
+            for (x, y), output in zip(chunkEntries, images):
+                outputs[x].append(output)
+                if onOutput is not None:
+                    onOutput(x, y, output)
+
+        for chunk in chunks:
+            width, height = jobs[chunk[0][0]].image.size
+            callbackKwargs = {}
+            if onPreview is not None and previewEvery > 0 and not self.onnx:
+                def previewCallback(pipeline, step, timestep, tensors, chunk = chunk):
+                    if (step + 1) % previewEvery == 0:
+                        for index, latents in zip(tensors.get("indices", range(len(chunk))), tensors["latents"]):
+                            onPreview(*chunk[index], latents)
+                    return tensors
+                callbackKwargs["callback_on_step_end"] = previewCallback
+
+            with span("diffusion"):
+                if sharedPrefix and len(chunk) > 1:
+                    self.pipeline.generateSharedPrefix(
+                        prompt = [PROMPT_TEMPLATE.format(colour = self.colours[y]) for _, y in chunk],
+                        negative_prompt = NEGATIVE_PROMPT,
+                        neutralPrompt = NEUTRAL_PROMPT,
+                        image = jobs[chunk[0][0]].image,
+                        mask_image = jobs[chunk[0][0]].mask,
+                        height = height,
+                        width = width,
+                        branchFraction = self.branchFraction,
+                        strength = 0.95,
+                        generator = torch.Generator("cpu").manual_seed(self.seed + chunk[0][1]),
+                        batchSize = batchSize,
+                        callback_on_batch_end = lambda indices, images, chunk = chunk: record([chunk[x] for x in indices], images),
+                        **self.inferenceKwargs,
+                        **callbackKwargs
+                    )
+                    continue
+                elif self.onnx:
+                    images = self.pipeline(
+                        prompt = [PROMPT_TEMPLATE.format(colour = self.colours[chunk[0][1]])],
+                        negative_prompt = [NEGATIVE_PROMPT],
+                        image = jobs[chunk[0][0]].image,
+                        mask_image = jobs[chunk[0][0]].mask,
+                        height = height,
+                        width = width,
+                        generator = np.random.RandomState(self.seed + chunk[0][1]),
+                        **self.inferenceKwargs
+                    ).images
+                else:
+                    images = self.pipeline(
+                        prompt = [PROMPT_TEMPLATE.format(colour = self.colours[y]) for _, y in chunk],
+                        negative_prompt = [NEGATIVE_PROMPT] * len(chunk),
+                        image = [jobs[x].image for x, _ in chunk],
+                        mask_image = [jobs[x].mask for x, _ in chunk],
+                        height = height,
+                        width = width,
+                        strength = 0.95,
+                        guidance_score = 9,
+                        generator = [
+                            torch.Generator("cpu").manual_seed(self.seed + y) for _, y in chunk
+                        ],
+                        **self.inferenceKwargs,
+                        **callbackKwargs
+                    ).images
+            record(chunk, images)
+        return outputs
+
+    def mergeOutputs(self, job: InpaintingJob, outputs: list[Image.Image]) -> tuple[Image.Image]:
+        """
+        Resize the model outputs back to the original size and restore the necklace.
+
+        In ROI mode, the outputs are resized back to the inpainting window and blended into the 
+        full-resolution try-on image with the feathered mask, outside the necklace only. The merged 
+        images are then upscaled to the `outputSize` of the job, if it differs from the working resolution.
+
+        Args:
+            job (InpaintingJob): The job the outputs were generated for.
+            outputs (list[Image.Image]): The raw model outputs of the job.
+
+        Returns:
+            tuple[Image.Image]: One merged image per configured colour.
+        """
+        if job.region is not None:
+            logger.info("blending the outputs into the inpainting window")
+            with span("merge"):
+                x1, y1, x2, y2 = job.region
+                original = job.background[y1:y2, x1:x2].astype(np.float32)
+                alpha = job.blendMask[:, :, None]
+                keep = job.necklaceMask[y1:y2, x1:x2, None] > 0
+                results = []
+                for output in outputs:
+                    generated = np.array(output.convert("RGB").resize((x2 - x1, y2 - y1), Image.BICUBIC), dtype = np.float32)
+                    blended = np.clip(generated * alpha + original * (1 - alpha) + 0.5, 0, 255).astype(np.uint8)
+                    result = job.background.copy()
+                    result[y1:y2, x1:x2] = np.where(keep, job.background[y1:y2, x1:x2], blended)
+                    results.append(self._resizeToOutput(job, Image.fromarray(result)))
+                return tuple(results)
+
+        logger.info("resizing the outputs to original size")
+        with span("merge"):
+            necklaceMask = np.bitwise_not(np.array(Image.fromarray(job.necklaceMask).convert("RGB")))
+            results = [
+                np.bitwise_and(np.array(x.resize(job.originalSize)), necklaceMask) for x in outputs
+            ]
+
+            logger.info("combining the results with the jewellery mask")
+            return tuple(
+                self._resizeToOutput(job, Image.fromarray(np.bitwise_or(x, job.jewelleryMask))) for x in results
+            )
+
+    @staticmethod
+    def _resizeToOutput(job: InpaintingJob, image: Image.Image, resample: int = Image.LANCZOS) -> Image.Image:
+        """Resize an image at working resolution to the output size of its job."""
+        if job.outputSize is None or tuple(job.outputSize) == image.size:
+            return image
+        return image.resize(tuple(job.outputSize), resample)
+
+    def recolourOutputs(self, job: InpaintingJob, output: Image.Image) -> list[Image.Image]:
+        """
+        Derive the remaining colour variants from the variant generated in the first colour.
+
+        The garment is segmented inside the inpainting mask and moved to every other colour in
+        CIELAB, keeping its shading and texture, so the diffusion stage runs once per request.
+
+        Args:
+            job (InpaintingJob): The job the output was generated for.
+            output (Image.Image): The raw model output of the first colour.
+
+        Returns:
+            list[Image.Image]: The raw outputs of the remaining colours at model resolution, or None 
+                if no garment in the first colour was found.
+        """
+        logger.info("deriving the remaining colours by recolouring the garment")
+        with span("recolour"):
+            return recolourVariants(output, job.mask, source = self.colours[0], targets = self.colours[1:])
+
+    def generateImage(
+        self, image: Image.Image, mask: Image.Image, fastVariants: bool = None, outputSize: tuple[int, int] = None
+    ) -> tuple[Image.Image]:
         """
         Apply inpainting to an image using the provided binary mask.
 
         This function utilizes the binary mask to inpaint areas of the image, enhancing the visual output
         by generating new images based on specific color prompts while excluding jewelry and other accessories.
+        All colour variants are generated in batched pipeline calls of at most `maxBatchSize` prompts,
+        each variant with its own seed so results are reproducible regardless of the batch size. When an
+        inference scheduler is attached, the diffusion stage is batched together with other requests.
+        With fast variants, only the first colour is generated and the others are recoloured from it,
+        falling back to generating them if the garment cannot be segmented.
 
         Args:
             image (Image.Image): The input image where inpainting will be applied.
             mask (Image.Image): The binary mask indicating areas to be inpainted.
+            fastVariants (bool, optional): Whether to derive the remaining colours by recolouring. 
+                Defaults to the configured variant mode.
+            outputSize (tuple[int, int], optional): The (width, height) of the returned images, such as the 
+                size of the original upload. Defaults to None, which keeps the size of `image`.
 
         Returns:
-            tuple: A tuple containing three images generated based on different color prompts.
+            tuple: A tuple containing one image per configured colour, in the configured order.
 
         Raises:
             CustomException: If an error occurs during the image processing.
         """
         try:
-            logger.info("creating a mask where the jewellery is represented")
-            jewelleryMask = Image.fromarray(np.bitwise_and(np.array(mask.convert("RGB")), np.array(image.convert("RGB"))))
-            arrOrig = np.array(grayscale(mask))
-
-            logger.info("inpainting the image using the original mask")
-            image = cv2.inpaint(np.array(image), arrOrig, 15, cv2.INPAINT_TELEA)
-            image = Image.fromarray(image)
-
-            logger.info("preparing the mask for processing")
-            arr = arrOrig.copy()
-            maskY = np.where(arr == arr[arr != 0][0])[0][0]
-            arr[maskY:, :] = 255
-            newMask = Image.fromarray(arr)
-            mask = newMask.copy()
-
-            logger.info("resizing images for consistency")
-            origSize = image.size
-            image = image.resize((512, 512))
-            mask = mask.resize((512, 512))
-
-            logger.info("generating images for different colors")
-            results = []
-            for colour in ["Red", "Blue", "Green"]:
-                prompt = f"{colour}, South Indian Saree, properly worn, natural setting, elegant, natural look, neckline without jewellery, simple"
-                negativePrompt = ("necklaces, jewellery, jewelry, necklace, neckpiece, garland, chain, neck wear, "
-                                "jewelled neck, jeweled neck, necklace on neck, jewellery on neck, accessories, "
-                                "watermark, text, changed background, wider body, narrower body, bad proportions, "
-                                "extra limbs, mutated hands, changed sizes, altered proportions, unnatural body proportions, "
-                                "blurry, ugly")
-                output = self.pipeline(
-                    prompt = prompt,
-                    negative_prompt = negativePrompt,
-                    image = image,
-                    mask_image = mask,
-                    strength = 0.95,
-                    guidance_score = 9,
-                ).images[0]
-
-                logger.info("resizing the output to original size")
-                output = output.resize(origSize)
-                tempGenerated = np.bitwise_and(
-                    np.array(output),
-                    np.bitwise_not(np.array(Image.fromarray(arrOrig).convert("RGB"))),
-                )
-                results.append(tempGenerated)
+            fastVariants = self.fastVariants if fastVariants is None else fastVariants
+            job = self.prepareJob(image = image, mask = mask)
+            job.outputSize = outputSize
+            if fastVariants and len(self.colours) > 1:
+                job.colourIndices = [0]
+                outputs = self._diffuse(job)
+                variants = self.recolourOutputs(job = job, output = outputs[0])
+                if variants is None:
+                    logger.info("no garment found to recolour, generating the remaining colours")
+                    job.colourIndices = list(range(1, len(self.colours)))
+                    variants = self._diffuse(job)
+                outputs = outputs + variants
+            else:
+                outputs = self._diffuse(job)
+            results = self.mergeOutputs(job = job, outputs = outputs)
 
-            logger.info("combining the results with the jewellery mask")
-            results = [
-                Image.fromarray(np.bitwise_or(x, np.array(jewelleryMask))) for x in results
-            ]
+            logger.info("Image generation completed successfully.")
+            gc.collect()
+            torch.cuda.empty_cache()
+            return results
+
+        except Exception as e:
+            metrics.recordError("generateImage", e)
+            logger.error(CustomException(e))
+
+    def _diffuse(self, job: InpaintingJob) -> list[Image.Image]:
+        """Run the diffusion stage of a single job, through the scheduler if one is attached."""
+        if self.scheduler is not None:
+            return self.scheduler.run(job)
+        return self.runDiffusion([job])[0]
+
+    def warmUp(self) -> None:
+        """
+        Run a single-step dummy generation so kernels are set up before the first real request.
+        """
+        logger.info("warming up the inpainting pipeline")
+        self.pipeline(
+            prompt = [PROMPT_TEMPLATE.format(colour = self.colours[0])],
+            negative_prompt = [NEGATIVE_PROMPT],
+            image = Image.new("RGB", (512, 512)),
+            mask_image = Image.new("L", (512, 512), 255),
+            num_inference_steps = 1,
+            **({} if self.onnx else {"strength": 1.0})
+        )
+
+    def generateImageStream(
+        self,
+        image: Image.Image,
+        mask: Image.Image,
+        fastVariants: bool = None,
+        onComplete: Callable[[tuple[Image.Image]], None] = None,
+        outputSize: tuple[int, int] = None
+    ) -> Iterator[tuple[Image.Image]]:
+        """
+        Apply inpainting to an image and stream the colour variants as they become available.
+
+        The diffusion stage runs on a background thread in small batches of `streamBatchSize` 
+        variants, so the first colour is not held back by the others. Every time a variant finishes, or a 
+        low-resolution preview of its intermediate latents is decoded, the current state of all 
+        variants is yielded, with None for variants that have nothing to show yet. Streaming 
+        requests bypass the inference scheduler. With fast variants, the remaining colours 
+        appear together as soon as the first one is recoloured.
+
+        Args:
+            image (Image.Image): The input image where inpainting will be applied.
+            mask (Image.Image): The binary mask indicating areas to be inpainted.
+            fastVariants (bool, optional): Whether to derive the remaining colours by recolouring. 
+                Defaults to the configured variant mode.
+            onComplete (Callable[[tuple[Image.Image]], None], optional): Called with the final images 
+                once every colour has finished, but not if the generation fails.
+            outputSize (tuple[int, int], optional): The (width, height) of the yielded images and previews, 
+                such as the size of the original upload. Defaults to None, which keeps the size of `image`.
+
+        Yields:
+            tuple[Image.Image]: One image or None per configured colour, in the configured order.
+
+        Raises:
+            CustomException: If an error occurs during the image processing.
+        """
+        try:
+            fastVariants = (self.fastVariants if fastVariants is None else fastVariants) and len(self.colours) > 1
+            job = self.prepareJob(image = image, mask = mask)
+            job.outputSize = outputSize
+            if fastVariants:
+                job.colourIndices = [0]
+            updates = queue.Queue()
+            results = [None] * len(self.colours)
+
+            def onOutput(x: int, y: int, output: Image.Image) -> None:
+                updates.put((y, self.mergeOutputs(job = job, outputs = [output])[0]))
+
+            def onPreview(x: int, y: int, latents: torch.Tensor) -> None:
+                preview = Image.fromarray(decodeLatentPreview(latents))
+                if job.region is None:
+                    updates.put((y, self._resizeToOutput(job, preview.resize(job.originalSize, Image.NEAREST), Image.NEAREST)))
+                else:
+                    x1, y1, x2, y2 = job.region
+                    canvas = Image.fromarray(job.background)
+                    canvas.paste(preview.resize((x2 - x1, y2 - y1), Image.NEAREST), (x1, y1))
+                    updates.put((y, self._resizeToOutput(job, canvas, Image.NEAREST)))
+
+            def worker() -> None:
+                try:
+                    outputs = self.runDiffusion(
+                        [job], onOutput = onOutput, onPreview = onPreview,
+                        previewEvery = self.previewEvery, batchSize = self.streamBatchSize
+                    )[0]
+                    if fastVariants:
+                        variants = self.recolourOutputs(job = job, output = outputs[0])
+                        if variants is None:
+                            logger.info("no garment found to recolour, generating the remaining colours")
+                            job.colourIndices = list(range(1, len(self.colours)))
+                            self.runDiffusion(
+                                [job], onOutput = onOutput, onPreview = onPreview,
+                                previewEvery = self.previewEvery, batchSize = self.streamBatchSize
+                            )
+                        else:
+                            for y, variant in enumerate(variants, start = 1):
+                                onOutput(0, y, variant)
+                    updates.put(None)
+                except Exception as e:
+                    updates.put(e)
+
+            logger.info("streaming images for different colors")
+            # the worker runs in a copy of the current context so its spans count towards this request
+            threading.Thread(target = contextvars.copy_context().run, args = (worker,), name = "DiffusionStream", daemon = True).start()
+            while True:
+                update = updates.get()
+                if update is None:
+                    break
+                if isinstance(update, Exception):
+                    raise update
+                colour, result = update
+                results[colour] = result
+                yield tuple(results)
 
             logger.info("Image generation completed successfully.")
+            if onComplete is not None:
+                onComplete(tuple(results))
             gc.collect()
             torch.cuda.empty_cache()
-            return (results[0], results[1], results[2])
 
         except Exception as e:
+            metrics.recordError("generateImageStream", e)
             logger.error(CustomException(e))
-            print(CustomException(e))
\ No newline at end of file
+
+
+def inpaintNecklace(image: np.ndarray, mask: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Remove the necklace with classical inpainting, processing only its bounding box.
+
+    The box is padded by twice the inpainting radius so every masked pixel sees the same 
+    neighbourhood as it would in the full frame.
+
+    Args:
+        image (np.ndarray): The RGB image.
+        mask (np.ndarray): The binary necklace mask.
+        radius (int): The inpainting radius.
+
+    Returns:
+        np.ndarray: A copy of the image with the necklace inpainted.
+    """
+    result = image.copy()
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        return result
+    x1, y1 = max(x - 2 * radius, 0), max(y - 2 * radius, 0)
+    x2, y2 = min(x + w + 2 * radius, image.shape[1]), min(y + h + 2 * radius, image.shape[0])
+    result[y1:y2, x1:x2] = cv2.inpaint(image[y1:y2, x1:x2], mask[y1:y2, x1:x2], radius, cv2.INPAINT_TELEA)
+    return result
+
+
+def getInpaintingWindow(maskTop: int, frameSize: tuple[int, int], padding: int, multiple: int = 8) -> tuple[int, int, int, int]:
+    """
+    Compute the window cut out for ROI inpainting.
+
+    The extended mask covers the full width from `maskTop` to the bottom of the frame, so the 
+    window keeps that region plus `padding` rows of context above it, and its height is grown 
+    upwards to a multiple of `multiple` as far as the frame allows. The window always spans the 
+    full width, since trimming columns would leave part of the mask untouched; the generation 
+    size is aligned separately.
+
+    Args:
+        maskTop (int): The first row of the extended mask.
+        frameSize (tuple[int, int]): The (width, height) of the image.
+        padding (int): The rows of context kept above the mask.
+        multiple (int, optional): The multiple the window sides are aligned to. Defaults to 8.
+
+    Returns:
+        tuple[int, int, int, int]: The (x1, y1, x2, y2) coordinates of the window.
+    """
+    width, height = frameSize
+    y1 = max(maskTop - padding, 0)
+    y1 = max(height - -(-(height - y1) // multiple) * multiple, 0)
+    return (0, y1, width, height)
+
+
+def getGenerationSize(windowSize: tuple[int, int], resolution: int, multiple: int = 8) -> tuple[int, int]:
+    """
+    Scale a window so its longer side is `resolution`, keeping its aspect ratio.
+
+    Args:
+        windowSize (tuple[int, int]): The (width, height) of the window.
+        resolution (int): The longer side of the generated image.
+        multiple (int, optional): The multiple both sides are rounded to. Defaults to 8.
+
+    Returns:
+        tuple[int, int]: The (width, height) the window is generated at.
+    """
+    scale = resolution / max(windowSize)
+    return tuple(max(int(round(x * scale / multiple)) * multiple, multiple * 8) for x in windowSize)
+
+
+def decodeLatentPreview(latents: torch.Tensor) -> np.ndarray:
+    """
+    Decode a cheap low-resolution preview from intermediate diffusion latents.
+
+    Instead of running the VAE decoder, the four latent channels are mapped to RGB with a 
+    fixed linear approximation, which is enough to show the emerging colours and layout.
+
+    Args:
+        latents (torch.Tensor): The latents of a single image, of shape (4, height / 8, width / 8).
+
+    Returns:
+        np.ndarray: The RGB preview at latent resolution.
+    """
+    factors = torch.tensor(LATENT_RGB_FACTORS, dtype = torch.float32)
+    rgb = torch.einsum("chw,cr->hwr", latents.detach().float().cpu(), factors)
+    return ((rgb + 1) * 127.5).clamp(0, 255).to(torch.uint8).numpy()
\ No newline at end of file
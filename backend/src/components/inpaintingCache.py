@@ -0,0 +1,291 @@
+from diffusers import StableDiffusionInpaintPipeline
+from diffusers.utils.torch_utils import randn_tensor
+from src.utils.functions import getConfig, getImageHash
+from src.utils.cache import LRUCache
+from src.utils.metrics import metrics
+from src.utils.logger import logger
+from types import SimpleNamespace
+from typing import Any, Callable
+from PIL import Image
+import numpy as np
+import torch
+import copy
+
+class CachedInpaintPipeline:
+    """
+    A memoizing wrapper around the Stable Diffusion inpainting pipeline.
+
+    The prompts sent to the inpainting model only differ in the colour word and the negative
+    prompt never changes, yet the pipeline runs the text encoder on every call. Likewise the
+    masked image is encoded by the VAE again for every call on the same photo. This wrapper
+    caches prompt embeddings by text and masked-image latents by a hash of the image and mask,
+    and hands the precomputed tensors to the diffusion call.
+
+    Any attribute that is not defined here is forwarded to the wrapped pipeline, so the
+    wrapper can be used wherever the pipeline itself is expected.
+
+    Attributes:
+        pipeline (StableDiffusionInpaintPipeline): The wrapped inpainting pipeline.
+        config (ConfigParser): Configuration settings loaded from the config.ini file.
+        embeddingCache (LRUCache): The cache of prompt embeddings keyed by text.
+        latentCache (LRUCache): The cache of masked-image latents keyed by image and mask hash.
+
+    Methods:
+        encodePrompt(text: str) -> torch.Tensor:
+            Returns the text-encoder embedding of a prompt.
+
+        encodeMaskedImage(image: Image.Image, mask: Image.Image) -> torch.Tensor:
+            Returns the VAE latents of the masked image.
+
+        generateSharedPrefix(prompt: list[str], negative_prompt: str, neutralPrompt: str, image: Image.Image, mask_image: Image.Image, **kwargs) -> SimpleNamespace:
+            Generates several prompts of one image from a shared, prompt-neutral start of the denoising.
+
+        cacheInfo() -> dict[str, dict[str, int]]:
+            Returns the hit/miss counters of both caches.
+    """
+
+    def __init__(self, pipeline: StableDiffusionInpaintPipeline):
+        """
+        Initialize the CachedInpaintPipeline around an already loaded inpainting pipeline.
+
+        Args:
+            pipeline (StableDiffusionInpaintPipeline): The inpainting pipeline to wrap.
+        """
+        self.pipeline = pipeline
+        self.config = getConfig("config.ini")
+        self.embeddingCache = LRUCache(maxSize = self.config.getint("INPAINTING CACHE", "embeddingCacheSize", fallback = 16))
+        self.latentCache = LRUCache(maxSize = self.config.getint("INPAINTING CACHE", "latentCacheSize", fallback = 8))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.pipeline, name)
+
+    @torch.no_grad()
+    def encodePrompt(self, text: str) -> torch.Tensor:
+        """
+        Encode a prompt with the text encoder, reusing the cached embedding if available.
+
+        Args:
+            text (str): The prompt to encode.
+
+        Returns:
+            torch.Tensor: The prompt embedding of shape (1, tokens, hidden size).
+        """
+        embedding = self.embeddingCache.get(text)
+        if embedding is None:
+            logger.info("encoding a new prompt with the text encoder")
+            embedding, _ = self.pipeline.encode_prompt(
+                text, self.pipeline._execution_device, 1, False
+            )
+            self.embeddingCache.put(text, embedding)
+        return embedding
+
+    @torch.no_grad()
+    def encodeMaskedImage(self, image: Image.Image, mask: Image.Image, height: int = None, width: int = None) -> torch.Tensor:
+        """
+        Encode the masked image with the VAE, reusing the cached latents if available.
+
+        The image is masked the same way the pipeline does it, but the latents are taken from
+        the mode of the VAE posterior so that cached and freshly computed values are identical.
+
+        Args:
+            image (Image.Image): The image to be inpainted.
+            mask (Image.Image): The inpainting mask, white where the image is regenerated.
+            height (int, optional): The generation height. Defaults to the pipeline's default height.
+            width (int, optional): The generation width. Defaults to the pipeline's default width.
+
+        Returns:
+            torch.Tensor: The scaled masked-image latents of shape (1, 4, height / 8, width / 8).
+        """
+        defaultSize = self.pipeline.unet.config.sample_size * self.pipeline.vae_scale_factor
+        height = height or defaultSize
+        width = width or defaultSize
+        key = (getImageHash(np.array(image)), getImageHash(np.array(mask)), height, width)
+        latents = self.latentCache.get(key)
+        if latents is None:
+            logger.info("encoding the masked image with the VAE")
+            vae = self.pipeline.vae
+            initImage = self.pipeline.image_processor.preprocess(image, height = height, width = width).to(dtype = torch.float32)
+            maskCondition = self.pipeline.mask_processor.preprocess(mask, height = height, width = width)
+            maskedImage = initImage * (maskCondition < 0.5)
+            maskedImage = maskedImage.to(device = self.pipeline._execution_device, dtype = vae.dtype)
+            latents = vae.encode(maskedImage).latent_dist.mode() * vae.config.scaling_factor
+            self.latentCache.put(key, latents)
+        return latents
+
+    def __call__(
+        self,
+        prompt: list[str],
+        negative_prompt: list[str],
+        image: Image.Image | list[Image.Image],
+        mask_image: Image.Image | list[Image.Image],
+        **kwargs
+    ):
+        """
+        Run the inpainting pipeline with cached prompt embeddings and masked-image latents.
+
+        Args:
+            prompt (list[str]): One prompt per generated image.
+            negative_prompt (list[str]): One negative prompt per generated image.
+            image (Image.Image | list[Image.Image]): The image to be inpainted, or one image per prompt.
+            mask_image (Image.Image | list[Image.Image]): The inpainting mask, or one mask per prompt.
+            **kwargs: Any other argument accepted by the inpainting pipeline.
+
+        Returns:
+            The output of the wrapped pipeline.
+        """
+        promptEmbeds = torch.cat([self.encodePrompt(x) for x in prompt])
+        negativePromptEmbeds = torch.cat([self.encodePrompt(x) for x in negative_prompt])
+        images = image if isinstance(image, list) else [image]
+        masks = mask_image if isinstance(mask_image, list) else [mask_image]
+        maskedImageLatents = torch.cat([
+            self.encodeMaskedImage(x, y, height = kwargs.get("height"), width = kwargs.get("width"))
+            for x, y in zip(images, masks)
+        ])
+        return self.pipeline(
+            prompt_embeds = promptEmbeds,
+            negative_prompt_embeds = negativePromptEmbeds,
+            image = image,
+            mask_image = mask_image,
+            masked_image_latents = maskedImageLatents,
+            **kwargs
+        )
+
+    @torch.no_grad()
+    def generateSharedPrefix(
+        self,
+        prompt: list[str],
+        negative_prompt: str,
+        neutralPrompt: str,
+        image: Image.Image,
+        mask_image: Image.Image,
+        height: int,
+        width: int,
+        branchFraction: float = 0.3,
+        num_inference_steps: int = 50,
+        strength: float = 1.0,
+        guidance_scale: float = 7.5,
+        generator: torch.Generator = None,
+        callback_on_step_end: Callable = None,
+        batchSize: int = None,
+        callback_on_batch_end: Callable[[list[int], list[Image.Image]], None] = None,
+        **kwargs
+    ) -> SimpleNamespace:
+        """
+        Generate several prompts of the same image and mask from a shared start of the denoising.
+
+        The prompts usually differ in a single word, and the coarse structure of the result is fixed 
+        by the early, noisiest steps. Those steps are therefore run once, on a single latent, with the 
+        prompt-neutral `neutralPrompt`, and the latent is then copied into one trajectory per prompt 
+        for the remaining steps. The trajectories are denoised in batches of at most `batchSize` 
+        prompts, each from a copy of the scheduler state at the branch point, so the batch size 
+        bounds the memory of a call without changing its results. With a branch fraction of 0 every 
+        trajectory only shares its starting noise. Only 9-channel inpainting UNets are supported.
+
+        Args:
+            prompt (list[str]): One prompt per generated image.
+            negative_prompt (str): The negative prompt shared by every image.
+            neutralPrompt (str): The prompt used for the shared steps.
+            image (Image.Image): The image to be inpainted.
+            mask_image (Image.Image): The inpainting mask, white where the image is regenerated.
+            height (int): The generation height.
+            width (int): The generation width.
+            branchFraction (float, optional): The fraction of the denoising steps that are shared. Defaults to 0.3.
+            num_inference_steps (int, optional): The number of denoising steps before strength is applied. Defaults to 50.
+            strength (float, optional): How much of the masked area is regenerated. Defaults to 1.0.
+            guidance_scale (float, optional): The classifier-free guidance scale. Defaults to 7.5.
+            generator (torch.Generator, optional): The generator of the shared noise.
+            callback_on_step_end (Callable, optional): Called as the pipeline does after every step, 
+                with one latent per prompt of the current batch in `latents` and their positions in `indices`.
+            batchSize (int, optional): The maximum number of trajectories denoised together after the 
+                branch point. Defaults to None, which denoises every prompt together.
+            callback_on_batch_end (Callable[[list[int], list[Image.Image]], None], optional): Called with the 
+                positions and images of the prompts of every batch as soon as it is decoded.
+            **kwargs: Other pipeline arguments, which are ignored.
+
+        Returns:
+            SimpleNamespace: The generated `images`, the `branchStep` the trajectories split at and the total `steps`.
+
+        Raises:
+            ValueError: If the UNet is not an inpainting UNet.
+        """
+        pipeline = self.pipeline
+        unet, vae, scheduler = pipeline.unet, pipeline.vae, pipeline.scheduler
+        if unet.config.in_channels != 9:
+            raise ValueError("shared-prefix denoising requires a 9-channel inpainting UNet")
+        device = pipeline._execution_device
+        count = len(prompt)
+
+        scheduler.set_timesteps(num_inference_steps, device = device)
+        timesteps, _ = pipeline.get_timesteps(num_inference_steps, strength, device)
+        branchStep = min(max(int(round(branchFraction * len(timesteps))), 0), len(timesteps))
+        logger.info(f"sharing {branchStep} of {len(timesteps)} denoising steps between {count} prompts")
+        metrics.setGauge("gemfit_shared_prefix_steps", branchStep, field = "shared")
+        metrics.setGauge("gemfit_shared_prefix_steps", len(timesteps), field = "total")
+
+        negativeEmbeds = self.encodePrompt(negative_prompt)
+        neutralEmbeds = self.encodePrompt(neutralPrompt)
+        promptEmbeds = torch.cat([self.encodePrompt(x) for x in prompt])
+        maskedImageLatents = self.encodeMaskedImage(image, mask_image, height = height, width = width).to(dtype = unet.dtype)
+        maskCondition = pipeline.mask_processor.preprocess(mask_image, height = height, width = width)
+        mask = torch.nn.functional.interpolate(
+            maskCondition, size = (height // pipeline.vae_scale_factor, width // pipeline.vae_scale_factor)
+        ).to(device = device, dtype = unet.dtype)
+
+        # starting from the noised image as the pipeline does, with a single latent for the shared steps
+        initImage = pipeline.image_processor.preprocess(image, height = height, width = width).to(device = device, dtype = vae.dtype)
+        imageLatents = pipeline._encode_vae_image(initImage, generator = generator).to(dtype = unet.dtype)
+        noise = randn_tensor(imageLatents.shape, generator = generator, device = device, dtype = unet.dtype)
+        if strength >= 1.0:
+            latents = noise * scheduler.init_noise_sigma
+        else:
+            latents = scheduler.add_noise(imageLatents, noise, timesteps[:1])
+
+        def denoise(latents: torch.Tensor, embeds: torch.Tensor, timestep: torch.Tensor, stepScheduler: Any) -> torch.Tensor:
+            batch = latents.shape[0]
+            modelInput = stepScheduler.scale_model_input(torch.cat([latents] * 2), timestep)
+            modelInput = torch.cat([
+                modelInput, mask.repeat(batch * 2, 1, 1, 1), maskedImageLatents.repeat(batch * 2, 1, 1, 1)
+            ], dim = 1)
+            noiseUncond, noiseText = unet(
+                modelInput, timestep, encoder_hidden_states = torch.cat([negativeEmbeds.repeat(batch, 1, 1), embeds])
+            ).sample.chunk(2)
+            noisePred = noiseUncond + guidance_scale * (noiseText - noiseUncond)
+            return stepScheduler.step(noisePred, timestep, latents).prev_sample
+
+        for step, timestep in enumerate(timesteps[:branchStep]):
+            latents = denoise(latents, neutralEmbeds, timestep, scheduler)
+            if callback_on_step_end is not None:
+                callback_on_step_end(
+                    pipeline, step, timestep, {"latents": latents.expand(count, -1, -1, -1), "indices": list(range(count))}
+                )
+
+        # every batch continues from the scheduler state at the branch point
+        batchSize = batchSize or count
+        images = []
+        for start in range(0, count, batchSize):
+            indices = list(range(start, min(start + batchSize, count)))
+            batchScheduler = copy.deepcopy(scheduler) if start + batchSize < count else scheduler
+            batchLatents = latents.repeat(len(indices), 1, 1, 1)
+            for step, timestep in enumerate(timesteps[branchStep:], start = branchStep):
+                batchLatents = denoise(batchLatents, promptEmbeds[start:indices[-1] + 1], timestep, batchScheduler)
+                if callback_on_step_end is not None:
+                    callback_on_step_end(pipeline, step, timestep, {"latents": batchLatents, "indices": indices})
+
+            decoded = vae.decode(batchLatents.to(dtype = vae.dtype) / vae.config.scaling_factor).sample
+            batchImages = pipeline.image_processor.postprocess(decoded, output_type = "pil", do_denormalize = [True] * len(indices))
+            images.extend(batchImages)
+            if callback_on_batch_end is not None:
+                callback_on_batch_end(indices, batchImages)
+        return SimpleNamespace(images = images, branchStep = branchStep, steps = len(timesteps))
+
+    def cacheInfo(self) -> dict[str, dict[str, int]]:
+        """
+        Report the counters of the embedding and latent caches.
+
+        Returns:
+            dict[str, dict[str, int]]: The hits, misses, size and maximum size of each cache.
+        """
+        return {
+            "embeddings": self.embeddingCache.stats(),
+            "latents": self.latentCache.stats()
+        }
\ No newline at end of file
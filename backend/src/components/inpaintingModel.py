@@ -0,0 +1,81 @@
+from diffusers import StableDiffusionInpaintPipeline, DPMSolverMultistepScheduler
+from src.components.inpaintingCache import CachedInpaintPipeline
+from src.utils.logger import logger
+from configparser import ConfigParser
+from typing import Any
+import torch
+import os
+
+DTYPES = {
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "float32": torch.float32
+}
+
+def loadInpaintingPipeline(config: ConfigParser) -> tuple[Any, dict[str, Any]]:
+    """
+    Load the inpainting model according to the configured inference profile.
+
+    The "cuda" profile loads the model in half precision on the configured device. The "cpu"
+    profile is meant for kiosks without a GPU and applies the settings of the [CPU PROFILE]
+    section: the dtype, the torch thread pools, the channels-last memory layout, attention
+    slicing, an optional torch.compile of the UNet or an ONNX Runtime export, and an optional
+    faster scheduler with fewer denoising steps.
+
+    Args:
+        config (ConfigParser): The loaded configuration object.
+
+    Returns:
+        tuple[Any, dict[str, Any]]: The loaded pipeline and the extra keyword arguments to pass
+            to every generation call, such as the number of denoising steps.
+
+    Raises:
+        ImportError: If the ONNX export is enabled but optimum is not installed.
+    """
+    modelId = config.get("CLOTHING TRY ON", "modelId")
+    profile = config.get("CLOTHING TRY ON", "profile", fallback = "cuda")
+    if profile != "cpu":
+        logger.info(f"loading the inpainting model with the {profile} profile")
+        pipeline = StableDiffusionInpaintPipeline.from_pretrained(
+            modelId, torch_dtype = torch.float16
+        ).to(config.get("CLOTHING TRY ON", "device"))
+        return CachedInpaintPipeline(pipeline), {}
+
+    logger.info("loading the inpainting model with the cpu profile")
+    threads = config.getint("CPU PROFILE", "threads", fallback = 0) or os.cpu_count()
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(config.getint("CPU PROFILE", "interopThreads", fallback = 1))
+    except RuntimeError:
+        logger.warning("torch inter-op threads can only be set before any parallel work has started")
+
+    inferenceKwargs = {}
+    if config.getboolean("CPU PROFILE", "fastScheduler", fallback = False):
+        inferenceKwargs["num_inference_steps"] = config.getint("CPU PROFILE", "numInferenceSteps", fallback = 20)
+
+    if config.getboolean("CPU PROFILE", "onnx", fallback = False):
+        try:
+            from optimum.onnxruntime import ORTStableDiffusionInpaintPipeline
+        except ImportError as e:
+            raise ImportError("the ONNX export of the cpu profile requires `optimum[onnxruntime]`") from e
+        logger.info("exporting the inpainting model to ONNX Runtime")
+        pipeline = ORTStableDiffusionInpaintPipeline.from_pretrained(modelId, export = True)
+        if "num_inference_steps" in inferenceKwargs:
+            pipeline.scheduler = DPMSolverMultistepScheduler.from_config(pipeline.scheduler.config)
+        return pipeline, inferenceKwargs
+
+    dtype = DTYPES[config.get("CPU PROFILE", "dtype", fallback = "float32")]
+    pipeline = StableDiffusionInpaintPipeline.from_pretrained(modelId, torch_dtype = dtype).to("cpu")
+
+    if "num_inference_steps" in inferenceKwargs:
+        pipeline.scheduler = DPMSolverMultistepScheduler.from_config(pipeline.scheduler.config)
+    if config.getboolean("CPU PROFILE", "channelsLast", fallback = True):
+        pipeline.unet.to(memory_format = torch.channels_last)
+        pipeline.vae.to(memory_format = torch.channels_last)
+    if config.getboolean("CPU PROFILE", "attentionSlicing", fallback = False):
+        pipeline.enable_attention_slicing()
+    if config.getboolean("CPU PROFILE", "compile", fallback = False):
+        logger.info("compiling the UNet with torch.compile")
+        pipeline.unet = torch.compile(pipeline.unet)
+
+    return CachedInpaintPipeline(pipeline), inferenceKwargs
\ No newline at end of file
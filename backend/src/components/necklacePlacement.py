@@ -0,0 +1,112 @@
+from src.components.catalogueIndex import CatalogueEntry
+from src.components.poseLandmarks import getNeckAngle
+from dataclasses import dataclass
+import numpy as np
+import cvzone
+import cv2
+
+@dataclass
+class Placement:
+    """
+    The final placement of a necklace sprite on a user's image.
+
+    Attributes:
+        sprite (np.ndarray): The premultiplied RGBA necklace sprite, already scaled, rotated and trimmed.
+        position (tuple[int, int]): The (x, y) coordinates at which the sprite is pasted.
+        scale (float): The scale factor applied to the original necklace image.
+        angle (int): The rotation angle in degrees applied to the scaled necklace.
+        crop (int): The number of rows trimmed from the top of the rotated necklace.
+    """
+    sprite: np.ndarray
+    position: tuple[int, int]
+    scale: float
+    angle: int
+    crop: int
+
+
+def getTopEdgeOffsets(gray: np.ndarray) -> np.ndarray:
+    """
+    Find the first column of every row that belongs to the necklace.
+
+    A pixel belongs to the necklace when it is neither pure black nor pure white. Rows
+    without any such pixel report the last column, matching the original offset scan.
+
+    Args:
+        gray (np.ndarray): The grayscale necklace image.
+
+    Returns:
+        np.ndarray: The column index of the first necklace pixel for every row.
+    """
+    edge = (gray != 255) & (gray != 0)
+    offsets = edge.argmax(axis = 1)
+    offsets[~edge.any(axis = 1)] = gray.shape[1] - 1
+    return offsets
+
+
+def solvePlacement(
+    jewellery: CatalogueEntry,
+    neckPoints: tuple[int, int, int, int],
+    frameHeight: int,
+    offsetFactor: float,
+    margin: int = 10
+) -> Placement:
+    """
+    Compute the crop, scale, angle and paste position of a necklace in a single pass.
+
+    The necklace is scaled to the width between the neck points, lifted by the offset of its
+    top edge and tilted to follow the neck. If the rotated necklace runs past the bottom of the
+    frame, rows are trimmed from its top. Trimming moves the top edge and therefore the paste
+    position, so the offset is evaluated for every candidate trim at once and the smallest
+    trim that fits the frame is chosen. The scaled sprite and its top-edge offset come 
+    from the catalogue index, so only one resample of the necklace is needed.
+
+    Args:
+        jewellery (CatalogueEntry): The catalogue index entry of the necklace.
+        neckPoints (tuple[int, int, int, int]): The (avgX1, avgY1, avgX2, avgY2) coordinates of the neck points.
+        frameHeight (int): The height of the user's image.
+        offsetFactor (float): The fraction of the top-edge offset used to lift the necklace.
+        margin (int, optional): The extra rows trimmed once the necklace overflows. Defaults to 10.
+
+    Returns:
+        Placement: The final sprite and where to paste it.
+
+    Raises:
+        ValueError: If the necklace cannot be fitted inside the frame.
+    """
+    avgX1, avgY1, avgX2, avgY2 = neckPoints
+
+    # rescaling the necklace to the width between the neck points
+    xDist = avgX2 - avgX1
+    scale = xDist / jewellery.size[0]
+    yDist = jewellery.size[1] * scale
+    sprite = jewellery.getSprite(int(xDist), int(yDist))
+
+    # lifting the necklace by the offset of its top edge
+    yCoordinate = avgY1 - int(offsetFactor * xDist * jewellery.topEdge)
+
+    # tilting the necklace as per the neck points
+    angle = getNeckAngle(neckPoints)
+    sprite = cvzone.rotateImage(sprite, angle)
+
+    # trimming from above if the necklace gets out of the frame
+    crop = 0
+    extra = sprite.shape[0] - (frameHeight - yCoordinate)
+    if extra > 0:
+        candidates = np.arange(extra + margin, sprite.shape[0])
+        topEdges = getTopEdgeOffsets(cv2.cvtColor(sprite, cv2.COLOR_BGRA2GRAY))[candidates]
+        offsets = (offsetFactor * xDist * (topEdges / sprite.shape[1])).astype(int)
+        fits = (avgY1 - offsets) + (sprite.shape[0] - candidates) <= frameHeight
+        if not fits.any():
+            raise ValueError("the necklace cannot be fitted inside the frame")
+        index = int(fits.argmax())
+        crop = int(candidates[index])
+        yCoordinate = avgY1 - int(offsets[index])
+        sprite = sprite[crop:, :]
+
+    return Placement(
+        sprite = sprite,
+        position = (avgX1, int(yCoordinate)),
+        scale = scale,
+        angle = angle,
+        crop = crop
+    )
\ No newline at end of file
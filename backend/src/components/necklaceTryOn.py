@@ -1,12 +1,14 @@
 from src.utils.exceptions import CustomException
-from cvzone.PoseModule import PoseDetector
+from src.components.poseLandmarks import PoseLandmarkService
+from src.components.necklacePlacement import solvePlacement
+from src.components.catalogueIndex import CatalogueIndex
+from src.utils.compositing import overlayPremultiplied, makeContactSheet
+from src.utils.ingest import ingestImage, getMaxSide
 from src.utils.functions import getConfig
+from src.utils.metrics import metrics, span
 from src.utils.logger import logger
 from PIL import Image
 import numpy as np
-import cvzone
-import math
-import cv2
 
 class NecklaceTryOn:
     """
@@ -17,106 +19,144 @@ class NecklaceTryOn:
     position and orientation.
 
     Attributes:
-        detector (PoseDetector): An instance of the PoseDetector for identifying 
+        landmarkService (PoseLandmarkService): The shared service for identifying 
             body landmarks in images.
+        catalogueIndex (CatalogueIndex): The shared index of precomputed necklace sprites.
         config (ConfigParser): Configuration settings loaded from a specified 
             configuration file (config.ini).
+        maxSide (int): The longer side large uploads are downscaled to before processing, 
+            0 to keep the original resolution.
+        gridSide (int): The longer side of every variant of a catalogue grid, 0 to use the working resolution.
+        gridColumns (int): The number of variants per row of a contact sheet.
 
     Methods:
-        necklaceTryOn(image: Image.Image, jewellery: Image.Image) -> Image.Image:
+        necklaceTryOn(image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray, asArray: bool) -> Image.Image | np.ndarray:
             Overlays a necklace onto the user's image based on detected pose 
-            landmarks and returns the resulting image.
+            landmarks and returns the resulting image at working resolution.
+
+        necklaceGrid(image: Image.Image, jewelleries: list[Image.Image], contactSheet: bool) -> list[Image.Image] | Image.Image:
+            Overlays every necklace of a list onto the same image, detecting the 
+            landmarks only once, and returns the variants or a contact sheet of them.
     """
     
-    def __init__(self):
-        """Initialize the NecklaceTryOn class with a PoseDetector and configuration settings."""
-        self.detector = PoseDetector()
+    def __init__(self, landmarkService: PoseLandmarkService = None, catalogueIndex: CatalogueIndex = None):
+        """
+        Initialize the NecklaceTryOn class with a landmark service and configuration settings.
+
+        Args:
+            landmarkService (PoseLandmarkService, optional): The landmark service to share with 
+                other components. A new one is created if not provided.
+            catalogueIndex (CatalogueIndex, optional): The catalogue index to share with other 
+                components. A new one is created if not provided.
+        """
+        self.landmarkService = landmarkService if landmarkService is not None else PoseLandmarkService()
+        self.catalogueIndex = catalogueIndex if catalogueIndex is not None else CatalogueIndex()
         self.config = getConfig("config.ini")
+        self.maxSide = getMaxSide(self.config)
+        self.gridSide = self.config.getint("CATALOGUE GRID", "tileSide", fallback = 768)
+        self.gridColumns = self.config.getint("CATALOGUE GRID", "columns", fallback = 4)
 
-    def necklaceTryOn(self, image: Image.Image, jewellery: Image.Image) -> Image.Image:
+    def necklaceTryOn(self, image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray, asArray: bool = False) -> Image.Image | np.ndarray:
         """
         Overlay a jewelry image onto a person's image to simulate wearing the jewelry.
 
         Args:
-            image (Image.Image): The user's image, ideally captured in a standing, upright position.
-            jewellery (Image.Image): The image of the jewelry piece (e.g., necklace) to be overlaid.
+            image (Image.Image | np.ndarray): The user's image, ideally captured in a standing, upright position.
+            jewellery (Image.Image | np.ndarray): The RGBA image of the jewelry piece (e.g., necklace) to be overlaid.
+            asArray (bool, optional): Whether to return the RGB array instead of a PIL Image, 
+                which saves a conversion when the result is encoded directly. Defaults to False.
 
         Returns:
-            Image.Image: A PIL Image depicting the user wearing the specified jewelry.
+            Image.Image | np.ndarray: A PIL Image depicting the user wearing the specified jewelry, or its array.
 
         Raises:
             CustomException: If an error occurs during the image processing.
         """
         try:
             logger.info("converting images to numpy arrays")
-            image = np.array(image)
-            jewellery = np.array(jewellery)
-
-            logger.info("creating a copy of original image for actual overlay")
-            copyImage = image.copy()
-            
-            logger.info("detecting body landmarks from the input image")
-            image = self.detector.findPose(image)
-            lmList, _ = self.detector.findPosition(image, bboxWithHands = False, draw = False)
-            pt12, pt11, pt10, pt9 = (
-                lmList[12][:2],
-                lmList[11][:2],
-                lmList[10][:2],
-                lmList[9][:2],
-            )        
+            with span("ingest"):
+                image = ingestImage(image, maxSide = self.maxSide)
+                jewellery = np.array(jewellery)
 
             logger.info("calculating the precise neck points")
-            avgX1 = int(pt12[0] + (pt10[0] - pt12[0]) / 1.75)
-            avgY1 = int(pt12[1] - (pt12[1] - pt10[1]) / 1.75)
-            avgX2 = int(pt11[0] - (pt11[0] - pt9[0]) / 1.75)
-            avgY2 = int(pt11[1] - (pt11[1] - pt9[1]) / 1.75)
-
-            logger.info("rescaling the necklace to appropriate dimensions")
-            xDist = avgX2 - avgX1
-            origImgRatio = xDist / jewellery.shape[1]
-            yDist = jewellery.shape[0] * origImgRatio
-            jewellery = cv2.resize(
-                jewellery, (int(xDist), int(yDist)), interpolation = cv2.INTER_CUBIC
-            )        
-
-            logger.info("calculating required offset to be added to the necklace image for perfect fitting")
-            imageGray = cv2.cvtColor(jewellery, cv2.COLOR_BGRA2GRAY)
-            for offsetOrig in range(imageGray.shape[1]):
-                pixelValue = imageGray[0, :][offsetOrig]
-                if (pixelValue != 255) & (pixelValue != 0):
-                    break
-                else:
-                    continue
-            offset = int(self.config.getfloat("NECKLACE TRY ON", "offsetFactor") * xDist * (offsetOrig / jewellery.shape[1]))
-            yCoordinate = avgY1 - offset
-
-            logger.info("tilting the necklace image as per the necklace points")
-            angle = math.ceil(
-                self.detector.findAngle(
-                    p1 = (avgX2, avgY2), p2 = (avgX1, avgY1), p3 = (avgX2, avgY1)
-                )[0]
-            )
-            if avgY2 < avgY1:
-                pass
-            else:
-                angle = angle * -1
-            jewellery = cvzone.rotateImage(jewellery, angle)
-
-            logger.info("checking if the necklace is getting out of the frame and trimming from above if needed")
-            availableSpace = copyImage.shape[0] - yCoordinate
-            extra = jewellery.shape[0] - availableSpace
+            with span("landmarks"):
+                avgX1, avgY1, avgX2, avgY2 = self.landmarkService.getNeckPoints(image)
 
-            logger.info("applying the calculated settings")
-            if extra > 0:
-                jewellery = jewellery[extra + 10 :, :]
-                return self.necklaceTryOn(
-                    Image.fromarray(copyImage), Image.fromarray(jewellery)
+            logger.info("solving the necklace placement in a single pass")
+            with span("placement"):
+                placement = solvePlacement(
+                    jewellery = self.catalogueIndex.get(jewellery),
+                    neckPoints = (avgX1, avgY1, avgX2, avgY2),
+                    frameHeight = image.shape[0],
+                    offsetFactor = self.config.getfloat("NECKLACE TRY ON", "offsetFactor")
                 )
-            else:
-                result = cvzone.overlayPNG(copyImage, jewellery, (avgX1, yCoordinate))
-                result = Image.fromarray(result.astype(np.uint8))
-                return result
+
+            logger.info("applying the calculated settings")
+            with span("compositing"):
+                result = overlayPremultiplied(image, placement.sprite, placement.position)
+                if not asArray:
+                    result = Image.fromarray(result)
+            return result
         
         except Exception as e:
+            metrics.recordError("necklaceTryOn", e)
             logger.error(CustomException(e))
-            print(CustomException(e))
\ No newline at end of file
+
+    def necklaceGrid(self, image: Image.Image, jewelleries: list[Image.Image], contactSheet: bool = False) -> list[Image.Image] | Image.Image:
+        """
+        Overlay every necklace of a list onto the same image.
+
+        The image is converted and its neck points are detected once for the whole list. Every
+        variant is then composited into its own slice of a single preallocated stack, touching
+        only the bounding box of its necklace, and the contact sheet is tiled from that stack.
+
+        Args:
+            image (Image.Image): The user's image, ideally captured in a standing, upright position.
+            jewelleries (list[Image.Image]): The images of the necklaces to be overlaid.
+            contactSheet (bool, optional): Whether to return a single contact sheet instead of 
+                one image per necklace. Defaults to False.
+
+        Returns:
+            list[Image.Image] | Image.Image: One PIL Image per necklace, None where the necklace 
+                could not be placed, or the contact sheet with a black tile in its place.
+
+        Raises:
+            CustomException: If an error occurs during the image processing.
+        """
+        try:
+            logger.info("converting the image to a numpy array at grid resolution")
+            with span("ingest"):
+                maxSide = min(self.gridSide, self.maxSide) if self.gridSide and self.maxSide else self.gridSide or self.maxSide
+                image = ingestImage(image, maxSide = maxSide)
+
+            logger.info("calculating the precise neck points once for every necklace")
+            with span("landmarks"):
+                neckPoints = self.landmarkService.getNeckPoints(image)
+
+            logger.info(f"compositing {len(jewelleries)} necklaces onto the same image")
+            variants = np.repeat(image[np.newaxis], len(jewelleries), axis = 0)
+            placed = np.ones(len(jewelleries), dtype = bool)
+            for index, jewellery in enumerate(jewelleries):
+                try:
+                    with span("placement"):
+                        placement = solvePlacement(
+                            jewellery = self.catalogueIndex.get(np.array(jewellery)),
+                            neckPoints = neckPoints,
+                            frameHeight = image.shape[0],
+                            offsetFactor = self.config.getfloat("NECKLACE TRY ON", "offsetFactor")
+                        )
+                    with span("compositing"):
+                        overlayPremultiplied(variants[index], placement.sprite, placement.position)
+                except ValueError as e:
+                    metrics.recordError("necklaceGrid", e)
+                    logger.error(CustomException(e))
+                    placed[index] = False
+
+            if contactSheet:
+                variants[~placed] = 0
+                return Image.fromarray(makeContactSheet(variants, columns = self.gridColumns))
+            return [Image.fromarray(x) if y else None for x, y in zip(variants, placed)]
+
+        except Exception as e:
+            metrics.recordError("necklaceGrid", e)
+            logger.error(CustomException(e))
\ No newline at end of file
@@ -0,0 +1,178 @@
+from src.components.necklaceTryOn import NecklaceTryOn
+from src.components.poseLandmarks import getNeckPointsFromLandmarks, getNeckAngle
+from src.components.necklacePlacement import Placement, solvePlacement
+from src.components.catalogueIndex import CatalogueEntry
+from src.utils.compositing import overlayPremultiplied
+from src.utils.exceptions import CustomException
+from src.utils.ingest import getProxy
+from src.utils.metrics import metrics, span
+from src.utils.logger import logger
+from cvzone.PoseModule import PoseDetector
+from collections import deque
+from PIL import Image
+import numpy as np
+import threading
+import time
+
+class NecklaceVideoTryOn:
+    """
+    A real-time necklace try-on for a stream of camera frames.
+
+    Unlike the still-image try-on, the pose detector runs in MediaPipe's video mode, which
+    tracks the person from one frame to the next instead of detecting them from scratch, on
+    a small proxy of every frame. The neck points are smoothed over time with an exponential
+    moving average, and the scaled and rotated necklace sprite is reused for as long as its
+    width and angle stay within a small tolerance. Frames that arrive while the previous one
+    is still being processed are dropped rather than queued, so the output never lags behind
+    the camera.
+
+    The tracking state belongs to a single camera, such as the kiosk mirror.
+
+    Attributes:
+        necklaceTryOn (NecklaceTryOn): The still-image try-on whose catalogue index and settings are reused.
+        config (ConfigParser): Configuration settings loaded from the config.ini file.
+        detectionSide (int): The longer side of the proxy the landmarks are tracked on.
+        smoothing (float): The weight of the newest neck points in the moving average, 1 to disable smoothing.
+        scaleTolerance (float): The relative change of the necklace width below which the sprite is reused.
+
+    Methods:
+        processFrame(frame: np.ndarray, jewellery: Image.Image) -> np.ndarray:
+            Overlays the necklace onto a camera frame, or returns None if the frame was dropped.
+
+        stats() -> dict[str, float]:
+            Returns the achieved frame rate and the number of processed and dropped frames.
+
+        reset() -> None:
+            Forgets the tracking state, for example when a new customer steps in front of the camera.
+    """
+
+    def __init__(self, necklaceTryOn: NecklaceTryOn = None):
+        """
+        Initialize the NecklaceVideoTryOn with a tracking pose detector.
+
+        Args:
+            necklaceTryOn (NecklaceTryOn, optional): The still-image try-on to share the catalogue
+                index with. A new one is created if not provided.
+        """
+        self.necklaceTryOn = necklaceTryOn if necklaceTryOn is not None else NecklaceTryOn()
+        self.config = self.necklaceTryOn.config
+        self.detectionSide = self.config.getint("VIDEO TRY ON", "detectionSide", fallback = 320)
+        self.smoothing = self.config.getfloat("VIDEO TRY ON", "smoothing", fallback = 0.5)
+        self.scaleTolerance = self.config.getfloat("VIDEO TRY ON", "scaleTolerance", fallback = 0.03)
+        self.detector = PoseDetector(
+            staticMode = False,
+            modelComplexity = self.config.getint("VIDEO TRY ON", "modelComplexity", fallback = 0),
+            smoothLandmarks = True
+        )
+        self._busy = threading.Lock()
+        # guards the counters, which frames dropped while another one is processed update concurrently
+        self._counterLock = threading.Lock()
+        self._frameTimes = deque(maxlen = 30)
+        self._processed = 0
+        self._dropped = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the smoothed neck points and the reused sprite."""
+        self._neckPoints = None
+        self._placement = None
+        self._placementKey = None
+
+    def processFrame(self, frame: np.ndarray, jewellery: Image.Image) -> np.ndarray:
+        """
+        Overlay the necklace onto a camera frame.
+
+        Args:
+            frame (np.ndarray): The RGB camera frame.
+            jewellery (Image.Image): The image of the necklace to be overlaid.
+
+        Returns:
+            np.ndarray: The frame wearing the necklace, the unchanged frame if no person is in view,
+                or None if the frame was dropped because the previous one is still being processed.
+
+        Raises:
+            CustomException: If an error occurs during the image processing.
+        """
+        if not self._busy.acquire(blocking = False):
+            with self._counterLock:
+                self._dropped += 1
+            return None
+
+        try:
+            if jewellery is None:
+                return frame
+
+            with span("videoLandmarks"):
+                proxy, scale = getProxy(frame, self.detectionSide)
+                self.detector.findPose(proxy, draw = False)
+                lmList, _ = self.detector.findPosition(proxy, bboxWithHands = False, draw = False)
+            if not lmList:
+                self.reset()
+                return frame
+            neckPoints = self._smooth(getNeckPointsFromLandmarks(lmList, scale = scale))
+
+            with span("videoPlacement"):
+                entry = self.necklaceTryOn.catalogueIndex.get(np.array(jewellery))
+                placement = self._getPlacement(entry, neckPoints, frame.shape[0])
+
+            with span("videoCompositing"):
+                result = overlayPremultiplied(frame.copy(), placement.sprite, placement.position)
+            return result
+
+        except Exception as e:
+            metrics.recordError("necklaceVideoTryOn", e)
+            logger.error(CustomException(e))
+            return frame
+
+        finally:
+            with self._counterLock:
+                self._processed += 1
+                self._frameTimes.append(time.perf_counter())
+            self._busy.release()
+
+    def stats(self) -> dict[str, float]:
+        """
+        Report the achieved frame rate over the last frames and the processed and dropped frame counters.
+
+        Returns:
+            dict[str, float]: The frames per second and the number of processed and dropped frames.
+        """
+        with self._counterLock:
+            times = list(self._frameTimes)
+            processed, dropped = self._processed, self._dropped
+        fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+        return {"fps": fps, "processed": processed, "dropped": dropped}
+
+    def _smooth(self, neckPoints: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        """Blend new neck points into the exponential moving average."""
+        points = np.array(neckPoints, dtype = np.float32)
+        if self._neckPoints is None:
+            self._neckPoints = points
+        else:
+            self._neckPoints = self.smoothing * points + (1 - self.smoothing) * self._neckPoints
+        return tuple(int(round(x)) for x in self._neckPoints)
+
+    def _getPlacement(self, entry: CatalogueEntry, neckPoints: tuple[int, int, int, int], frameHeight: int) -> Placement:
+        """Reuse the previous sprite while its width and angle are stable, or solve a new placement."""
+        offsetFactor = self.config.getfloat("NECKLACE TRY ON", "offsetFactor")
+        avgX1, avgY1, avgX2, _ = neckPoints
+        width, angle = avgX2 - avgX1, getNeckAngle(neckPoints)
+        if self._placement is not None and self._placementKey is not None:
+            key, cachedWidth, cachedAngle = self._placementKey
+            stable = key == entry.key and cachedAngle == angle and abs(width - cachedWidth) <= self.scaleTolerance * cachedWidth
+            # a trimmed sprite depends on the distance to the bottom of the frame, so it is never reused
+            if stable and self._placement.crop == 0:
+                lift = int(offsetFactor * cachedWidth * entry.topEdge)
+                position = (avgX1, avgY1 - lift)
+                if position[1] + self._placement.sprite.shape[0] <= frameHeight:
+                    self._placement.position = position
+                    return self._placement
+
+        self._placement = solvePlacement(
+            jewellery = entry,
+            neckPoints = neckPoints,
+            frameHeight = frameHeight,
+            offsetFactor = offsetFactor
+        )
+        self._placementKey = (entry.key, width, angle)
+        return self._placement
\ No newline at end of file
@@ -0,0 +1,204 @@
+from src.utils.functions import getConfig, getImageHash
+from src.utils.ingest import getProxy
+from cvzone.PoseModule import PoseDetector
+from src.utils.cache import LRUCache
+from src.utils.logger import logger
+from contextlib import contextmanager
+from typing import Iterator
+import numpy as np
+import threading
+import queue
+import math
+import os
+
+class PoseLandmarkService:
+    """
+    A shared service for detecting body landmarks in user images.
+
+    The same user photo is usually processed several times, once for every necklace that
+    is tried on and once more for the clothing try-on. This service keeps a bounded LRU cache
+    of the detected landmarks keyed by a content hash of the image, so repeated requests for
+    the same photo skip pose detection entirely.
+
+    Every PoseDetector wraps a stateful MediaPipe graph that must not be used by two threads
+    at once, so the service owns a bounded pool of detectors. A request checks a detector out,
+    creating a new one while the pool is below its size, and returns it when done, so up to
+    `poolSize` requests detect landmarks in parallel.
+
+    MediaPipe analyses a small internal copy of the frame anyway, so the neck points are
+    detected on a proxy downscaled to `detectionSide` and mapped back to the resolution of the
+    input, which keeps both detection and hashing cheap on large photos.
+
+    Attributes:
+        config (ConfigParser): Configuration settings loaded from the config.ini file.
+        cache (LRUCache): The cache of detected landmarks keyed by image hash.
+        poolSize (int): The maximum number of PoseDetector instances, one per CPU core by default.
+        detectionSide (int): The longer side of the proxy the landmarks are detected on, 0 to use the full image.
+
+    Methods:
+        checkoutDetector() -> Iterator[PoseDetector]:
+            Lends a PoseDetector from the pool for the duration of a `with` block.
+
+        getLandmarks(image: np.ndarray) -> list[list[int]]:
+            Returns the pose landmarks of the image, running detection only on a cache miss.
+
+        getNeckPoints(image: np.ndarray) -> tuple[int, int, int, int]:
+            Returns the left and right neck points used to place a necklace.
+
+        cacheInfo() -> dict[str, int]:
+            Returns the hit/miss counters of the landmark cache and the state of the detector pool.
+    """
+
+    def __init__(self):
+        """Initialize the PoseLandmarkService with an empty landmark cache; PoseDetectors are created on first use."""
+        self.config = getConfig("config.ini")
+        self.cache = LRUCache(maxSize = self.config.getint("POSE LANDMARKS", "cacheSize", fallback = 32))
+        self.poolSize = max(self.config.getint("POSE LANDMARKS", "poolSize", fallback = 0) or os.cpu_count(), 1)
+        self.detectionSide = self.config.getint("INGEST", "detectionSide", fallback = 0)
+        self._idleDetectors = queue.LifoQueue()
+        self._createdDetectors = 0
+        self._poolLock = threading.Lock()
+
+    @contextmanager
+    def checkoutDetector(self) -> Iterator[PoseDetector]:
+        """
+        Borrow a PoseDetector from the pool for the duration of a `with` block.
+
+        An idle detector is reused when available, a new one is created while the pool is
+        below its size, and otherwise the call blocks until another request returns one.
+
+        Yields:
+            PoseDetector: A detector used by no other thread until the block exits.
+        """
+        try:
+            detector = self._idleDetectors.get_nowait()
+        except queue.Empty:
+            with self._poolLock:
+                create = self._createdDetectors < self.poolSize
+                if create:
+                    self._createdDetectors += 1
+            if create:
+                logger.info("creating a new pose detector for the pool")
+                try:
+                    detector = PoseDetector()
+                except Exception:
+                    with self._poolLock:
+                        self._createdDetectors -= 1
+                    raise
+            else:
+                detector = self._idleDetectors.get()
+        try:
+            yield detector
+        finally:
+            self._idleDetectors.put(detector)
+
+    def getLandmarks(self, image: np.ndarray) -> list[list[int]]:
+        """
+        Detect the body landmarks of an image.
+
+        Args:
+            image (np.ndarray): The user's image as a NumPy array.
+
+        Returns:
+            list[list[int]]: The [x, y, z] pixel coordinates of every pose landmark,
+                or an empty list if no person was detected.
+        """
+        key = getImageHash(image)
+        lmList = self.cache.get(key)
+        if lmList is not None:
+            logger.info("reusing cached body landmarks")
+            return lmList
+
+        logger.info("detecting body landmarks from the input image")
+        with self.checkoutDetector() as detector:
+            detector.findPose(image, draw = False)
+            lmList, _ = detector.findPosition(image, bboxWithHands = False, draw = False)
+        self.cache.put(key, lmList)
+        return lmList
+
+    def getNeckPoints(self, image: np.ndarray) -> tuple[int, int, int, int]:
+        """
+        Calculate the precise neck points of the person in the image.
+
+        The neck points are interpolated between the shoulder and mouth landmarks and mark
+        the left and right ends of where a necklace should sit. The landmarks are detected on a
+        downscaled proxy and the neck points are returned in the coordinates of `image`.
+
+        Args:
+            image (np.ndarray): The user's image as a NumPy array.
+
+        Returns:
+            tuple[int, int, int, int]: The (avgX1, avgY1, avgX2, avgY2) coordinates of the neck points.
+
+        Raises:
+            ValueError: If no person is detected in the image.
+        """
+        proxy, scale = getProxy(image, self.detectionSide)
+        lmList = self.getLandmarks(proxy)
+        if not lmList:
+            raise ValueError("no person detected in the input image")
+        return getNeckPointsFromLandmarks(lmList, scale = scale)
+
+    def cacheInfo(self) -> dict[str, int]:
+        """
+        Report the landmark cache counters and the state of the detector pool.
+
+        Returns:
+            dict[str, int]: The number of hits, misses, the current size and the maximum size of the cache,
+                and the number of created, idle and maximum detectors.
+        """
+        return {
+            **self.cache.stats(),
+            "detectors": self._createdDetectors,
+            "idleDetectors": self._idleDetectors.qsize(),
+            "poolSize": self.poolSize
+        }
+
+
+def getNeckPointsFromLandmarks(lmList: list[list[int]], scale: float = 1.0) -> tuple[int, int, int, int]:
+    """
+    Interpolate the neck points between the shoulder and mouth landmarks.
+
+    Args:
+        lmList (list[list[int]]): The [x, y, z] pixel coordinates of every pose landmark.
+        scale (float, optional): The scale of the image the landmarks were detected on, relative 
+            to the image the neck points are returned for. Defaults to 1.0.
+
+    Returns:
+        tuple[int, int, int, int]: The (avgX1, avgY1, avgX2, avgY2) coordinates of the neck points.
+    """
+    pt12, pt11, pt10, pt9 = (
+        lmList[12][:2],
+        lmList[11][:2],
+        lmList[10][:2],
+        lmList[9][:2],
+    )
+    avgX1 = int((pt12[0] + (pt10[0] - pt12[0]) / 1.75) / scale)
+    avgY1 = int((pt12[1] - (pt12[1] - pt10[1]) / 1.75) / scale)
+    avgX2 = int((pt11[0] - (pt11[0] - pt9[0]) / 1.75) / scale)
+    avgY2 = int((pt11[1] - (pt11[1] - pt9[1]) / 1.75) / scale)
+    return (avgX1, avgY1, avgX2, avgY2)
+
+
+def getNeckAngle(neckPoints: tuple[int, int, int, int]) -> int:
+    """
+    Calculate the angle a necklace has to be tilted by to follow the neck points.
+
+    Args:
+        neckPoints (tuple[int, int, int, int]): The (avgX1, avgY1, avgX2, avgY2) coordinates of the neck points.
+
+    Returns:
+        int: The rotation angle in degrees.
+    """
+    avgX1, avgY1, avgX2, avgY2 = neckPoints
+    angle = math.degrees(
+        math.atan2(avgY1 - avgY1, avgX2 - avgX1) - math.atan2(avgY2 - avgY1, avgX2 - avgX1)
+    )
+    if angle < 0:
+        angle += 360
+    angle = math.ceil(angle)
+    if avgY2 < avgY1:
+        pass
+    else:
+        angle = angle * -1
+    return angle
\ No newline at end of file
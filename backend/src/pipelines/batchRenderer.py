@@ -0,0 +1,334 @@
+from src.pipelines.completePipeline import Pipeline
+from src.components.catalogueIndex import CatalogueIndex
+from src.utils.functions import getCatalogue, getConfig, getColours
+from src.utils.exceptions import CustomException
+from src.utils.metrics import metrics
+from src.utils.logger import logger
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Iterator
+from PIL import Image
+import multiprocessing
+import argparse
+import json
+import time
+import cv2
+import os
+
+NECKLACE_CATEGORIES = ["chokers", "shortNecklaces", "longNecklaces"]
+
+# the pipeline of the current worker process, created by the pool initializer
+workerPipeline = None
+
+@dataclass
+class RenderGroup:
+    """
+    The necklaces to render on a single model photo.
+
+    Grouping the work by model photo means each worker detects the landmarks of a photo
+    once and reuses them for every necklace through its landmark cache.
+
+    Attributes:
+        modelId (str): The catalogue ID of the model photo.
+        modelPath (str): The path of the cached model photo.
+        necklaces (list[tuple[str, str]]): The (catalogue ID, path) of every necklace still to render.
+    """
+    modelId: str
+    modelPath: str
+    necklaces: list[tuple[str, str]]
+
+
+def initWorker(opencvThreads: int) -> None:
+    """
+    Create the pipeline of a necklace worker process.
+
+    Every worker owns its pipeline and therefore its own PoseDetector and landmark cache,
+    but no result cache or worker pool, since the renders are written to the output directory.
+    OpenCV is limited to a few threads since the pool already keeps every core busy.
+
+    Args:
+        opencvThreads (int): The number of threads OpenCV may use inside the worker.
+    """
+    global workerPipeline
+    cv2.setNumThreads(opencvThreads)
+    workerPipeline = Pipeline(resultCache = False, workerPool = False)
+
+
+def initDiffusionWorker() -> None:
+    """Create the pipeline of the diffusion worker process, without a result cache, and load the inpainting model."""
+    global workerPipeline
+    workerPipeline = Pipeline(resultCache = False, workerPool = False)
+    workerPipeline.warmUp()
+
+
+def saveAtomically(image: Image.Image, path: str) -> None:
+    """
+    Save an image so that an interrupted run never leaves a partial file behind.
+
+    Args:
+        image (Image.Image): The image to save.
+        path (str): The destination of the PNG file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    temporaryPath = f"{path}.{os.getpid()}.tmp"
+    image.save(temporaryPath, format = "PNG")
+    os.replace(temporaryPath, path)
+
+
+def renderNecklaces(group: RenderGroup, outputDirectory: str) -> list[dict]:
+    """
+    Render every necklace of a group on its model photo inside a worker process.
+
+    Args:
+        group (RenderGroup): The model photo and the necklaces to render on it.
+        outputDirectory (str): The root directory of the renders.
+
+    Returns:
+        list[dict]: One record per necklace with its output path, status and duration.
+    """
+    model = Image.open(group.modelPath).convert("RGB")
+    records = []
+    for necklaceId, necklacePath in group.necklaces:
+        started = time.perf_counter()
+        outputPath = os.path.join(outputDirectory, "necklace", group.modelId, f"{necklaceId}.png")
+        result = workerPipeline.necklaceTryOn(image = model, jewellery = Image.open(necklacePath).convert("RGBA"))
+        if result is not None:
+            saveAtomically(result, outputPath)
+        records.append({
+            "stage": "necklace",
+            "modelId": group.modelId,
+            "necklaceId": necklaceId,
+            "output": outputPath,
+            "status": "done" if result is not None else "failed",
+            "seconds": round(time.perf_counter() - started, 3)
+        })
+    return records
+
+
+def renderClothing(modelId: str, modelPath: str, necklaceId: str, necklacePath: str, outputDirectory: str) -> list[dict]:
+    """
+    Run the clothing try-on of a single pair inside the diffusion worker process.
+
+    Args:
+        modelId (str): The catalogue ID of the model photo.
+        modelPath (str): The path of the cached model photo.
+        necklaceId (str): The catalogue ID of the necklace.
+        necklacePath (str): The path of the cached necklace image.
+        outputDirectory (str): The root directory of the renders.
+
+    Returns:
+        list[dict]: A single record with the output paths, status and duration.
+    """
+    started = time.perf_counter()
+    results = workerPipeline.clothingTryOn(
+        image = Image.open(modelPath).convert("RGB"),
+        jewellery = Image.open(necklacePath).convert("RGBA")
+    )
+    outputs = getClothingPaths(outputDirectory, modelId, necklaceId, workerPipeline.clothingTryOnObject.colours)
+    if results is not None:
+        for result, path in zip(results, outputs):
+            saveAtomically(result, path)
+    return [{
+        "stage": "clothing",
+        "modelId": modelId,
+        "necklaceId": necklaceId,
+        "output": outputs,
+        "status": "done" if results is not None else "failed",
+        "seconds": round(time.perf_counter() - started, 3)
+    }]
+
+
+def getClothingPaths(outputDirectory: str, modelId: str, necklaceId: str, colours: list[str]) -> list[str]:
+    """Return the output path of every colour variant of a pair."""
+    return [
+        os.path.join(outputDirectory, "clothing", modelId, f"{necklaceId}_{x.lower()}.png") for x in colours
+    ]
+
+
+class BatchRenderer:
+    """
+    An offline renderer of every catalogue necklace on every catalogue model photo.
+
+    The (model, necklace) pairs are grouped by model photo and streamed through a pool of
+    worker processes, each with its own pipeline and PoseDetector. Renders are written as
+    soon as they are finished and every result is appended to a manifest, so an interrupted
+    run resumes where it stopped by skipping the renders that already exist. The clothing
+    try-on can be added to every pair; it runs on a separate lane with a single worker
+    process that holds the inpainting model.
+
+    Attributes:
+        config (ConfigParser): Configuration settings loaded from the config.ini file.
+        outputDirectory (str): The root directory of the renders and the manifest.
+        workers (int): The number of necklace worker processes.
+        includeClothing (bool): Whether the clothing try-on is rendered for every pair as well.
+
+    Methods:
+        getGroups(catalogue: dict) -> list[RenderGroup]:
+            Lists the necklaces still to render on each model photo.
+
+        run(nImages: int) -> dict[str, int]:
+            Renders the catalogue and returns the number of finished, skipped and failed renders.
+    """
+
+    def __init__(self, outputDirectory: str = None, workers: int = None, includeClothing: bool = False):
+        """
+        Initialize the BatchRenderer.
+
+        Args:
+            outputDirectory (str, optional): The root directory of the renders. Defaults to the configured directory.
+            workers (int, optional): The number of necklace worker processes. Defaults to the configured
+                number, or one per CPU core when it is 0.
+            includeClothing (bool, optional): Whether the clothing try-on is rendered for every pair as well. Defaults to False.
+        """
+        self.config = getConfig("config.ini")
+        self.outputDirectory = outputDirectory or self.config.get("BATCH RENDERER", "outputDirectory", fallback = "artifacts/renders")
+        self.workers = workers or self.config.getint("BATCH RENDERER", "workers", fallback = 0) or os.cpu_count()
+        self.includeClothing = includeClothing
+        self._manifestPath = os.path.join(self.outputDirectory, "manifest.jsonl")
+
+    def getGroups(self, catalogue: dict) -> list[RenderGroup]:
+        """
+        List the necklaces that still have to be rendered on each model photo.
+
+        Args:
+            catalogue (dict): The catalogue items by category, as returned by getCatalogue.
+
+        Returns:
+            list[RenderGroup]: One group per model photo with at least one missing render.
+        """
+        necklaces = [x for category in NECKLACE_CATEGORIES for x in catalogue[category]]
+        groups = []
+        for model in catalogue["models"]:
+            missing = [
+                (x.fileId, x.path) for x in necklaces
+                if not os.path.exists(os.path.join(self.outputDirectory, "necklace", model.fileId, f"{x.fileId}.png"))
+            ]
+            if missing:
+                groups.append(RenderGroup(modelId = model.fileId, modelPath = model.path, necklaces = missing))
+        return groups
+
+    def run(self, nImages: int) -> dict[str, int]:
+        """
+        Render every necklace on every model photo of the catalogue.
+
+        Args:
+            nImages (int): The maximum number of catalogue files to retrieve from the bucket.
+
+        Returns:
+            dict[str, int]: The number of renders that were finished, skipped because they already existed, and failed.
+        """
+        logger.info("loading the catalogue for batch rendering")
+        catalogue = getCatalogue(nImages = nImages)
+        necklaces = [x for category in NECKLACE_CATEGORIES for x in catalogue[category]]
+
+        # building the catalogue index once up front so the workers only load it from disk
+        logger.info("building the catalogue index before starting the workers")
+        CatalogueIndex().build(x.image for x in necklaces)
+
+        groups = self.getGroups(catalogue)
+        total = len(catalogue["models"]) * len(necklaces)
+        counts = {"done": 0, "skipped": total - sum(len(x.necklaces) for x in groups), "failed": 0}
+        clothingPairs = self._getClothingPairs(catalogue, necklaces) if self.includeClothing else []
+        logger.info(
+            f"rendering {total - counts['skipped']} necklace pairs and {len(clothingPairs)} clothing pairs "
+            f"with {self.workers} workers, {counts['skipped']} necklace renders already exist"
+        )
+
+        os.makedirs(self.outputDirectory, exist_ok = True)
+        context = multiprocessing.get_context("spawn")
+        necklaceExecutor = ProcessPoolExecutor(
+            max_workers = self.workers, mp_context = context, initializer = initWorker, initargs = (1,)
+        )
+        diffusionExecutor = ProcessPoolExecutor(
+            max_workers = 1, mp_context = context, initializer = initDiffusionWorker
+        ) if clothingPairs else None
+
+        try:
+            with open(self._manifestPath, "a") as manifest:
+                # every task is mapped to the records written in its place if it raises
+                pending = {}
+                colours = getColours(self.config)
+                for pair in clothingPairs:
+                    future = diffusionExecutor.submit(renderClothing, *pair, self.outputDirectory)
+                    pending[future] = [{
+                        "stage": "clothing",
+                        "modelId": pair[0],
+                        "necklaceId": pair[2],
+                        "output": getClothingPaths(self.outputDirectory, pair[0], pair[2], colours),
+                        "status": "failed"
+                    }]
+                for records in self._stream(necklaceExecutor, groups, pending):
+                    for record in records:
+                        counts[record["status"]] += 1
+                        manifest.write(json.dumps(record) + "\n")
+                    manifest.flush()
+        finally:
+            necklaceExecutor.shutdown(cancel_futures = True)
+            if diffusionExecutor is not None:
+                diffusionExecutor.shutdown(cancel_futures = True)
+
+        logger.info(f"batch rendering finished: {counts}")
+        return counts
+
+    def _getClothingPairs(self, catalogue: dict, necklaces: list) -> list[tuple[str, str, str, str]]:
+        """List the (modelId, modelPath, necklaceId, necklacePath) pairs without clothing renders yet."""
+        colours = getColours(self.config)
+        return [
+            (model.fileId, model.path, x.fileId, x.path)
+            for model in catalogue["models"] for x in necklaces
+            if not all(os.path.exists(y) for y in getClothingPaths(self.outputDirectory, model.fileId, x.fileId, colours))
+        ]
+
+    def _stream(self, executor: ProcessPoolExecutor, groups: list[RenderGroup], pending: dict[Future, list[dict]]) -> Iterator[list[dict]]:
+        """
+        Submit the groups with a bounded number in flight and yield the records of every finished task.
+
+        A task that raises, for instance because its worker process died, yields a failed record 
+        for every render it held, so the manifest and the counts still cover them.
+        """
+        groups = iter(groups)
+        necklaceFutures = set()
+        while True:
+            while len(necklaceFutures) < self.workers * 2:
+                group = next(groups, None)
+                if group is None:
+                    break
+                future = executor.submit(renderNecklaces, group, self.outputDirectory)
+                necklaceFutures.add(future)
+                pending[future] = [{
+                    "stage": "necklace",
+                    "modelId": group.modelId,
+                    "necklaceId": x,
+                    "output": os.path.join(self.outputDirectory, "necklace", group.modelId, f"{x}.png"),
+                    "status": "failed"
+                } for x, _ in group.necklaces]
+            if not pending:
+                return
+
+            finished, _ = wait(pending, return_when = FIRST_COMPLETED)
+            for future in finished:
+                failedRecords = pending.pop(future)
+                necklaceFutures.discard(future)
+                try:
+                    records = future.result()
+                except Exception as e:
+                    metrics.recordError("batchRenderer", e)
+                    logger.error(CustomException(e))
+                    records = [{**x, "error": str(e)} for x in failedRecords]
+                yield records
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Render every catalogue necklace on every catalogue model photo.")
+    parser.add_argument("--output", help = "the root directory of the renders, defaults to [BATCH RENDERER] outputDirectory")
+    parser.add_argument("--workers", type = int, help = "the number of necklace worker processes, defaults to one per core")
+    parser.add_argument("--images", type = int, default = 100, help = "the maximum number of catalogue files to load")
+    parser.add_argument("--clothing", action = "store_true", help = "render the clothing try-on of every pair as well")
+    args = parser.parse_args()
+
+    renderer = BatchRenderer(outputDirectory = args.output, workers = args.workers, includeClothing = args.clothing)
+    counts = renderer.run(nImages = args.images)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
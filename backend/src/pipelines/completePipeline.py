@@ -1,6 +1,20 @@
 from src.components.necklaceTryOn import NecklaceTryOn
+from src.components.necklaceVideoTryOn import NecklaceVideoTryOn
 from src.components.clothingTryOn import ClothingTryOn
+from src.components.poseLandmarks import PoseLandmarkService
+from src.components.catalogueIndex import CatalogueIndex
+from src.pipelines.inferenceScheduler import InferenceScheduler
+from src.pipelines.workerPool import WorkerPool
+from src.utils.exceptions import CustomException
+from src.utils.resultCache import ResultCache
+from src.utils.ingest import getImageSize
+from src.utils.functions import getConfig
+from src.utils.metrics import metrics, requestSpan
+from src.utils.logger import logger
+from typing import Callable, Iterable, Iterator
 from PIL import Image
+import numpy as np
+import threading
 
 class Pipeline:
     """
@@ -8,48 +22,498 @@ class Pipeline:
 
     This class encapsulates the functionality for overlaying jewelry 
     and clothing on user images using the NecklaceTryOn and ClothingTryOn
-    components.
+    components. The components are loaded lazily on first use, or ahead of
+    time by the background warm-up, so creating the pipeline is cheap and the
+    web server can start immediately.
 
     Attributes:
-        necklaceTryOnObject (NecklaceTryOn): Instance for necklace try-on functionality.
-        clothingTryOnObject (ClothingTryOn): Instance for clothing try-on functionality.
+        landmarkService (PoseLandmarkService): Landmark service shared by both try-on components.
+        catalogueIndex (CatalogueIndex): Index of precomputed necklace sprites shared by both try-on components.
+        necklaceTryOnObject (NecklaceTryOn): Instance for necklace try-on functionality, loaded on first access.
+        clothingTryOnObject (ClothingTryOn): Instance for clothing try-on functionality, loaded on first access.
+        necklaceVideoTryOnObject (NecklaceVideoTryOn): Instance for the live camera try-on, loaded on first access.
+        scheduler (InferenceScheduler): Optional scheduler batching the diffusion stage across requests.
+        resultCache (ResultCache): Optional cache of finished results, so repeated requests skip the try-on.
+        workerPool (WorkerPool): Optional pool of forked processes the try-ons are routed to, sharing the loaded models.
+        state (str): The readiness state, one of "starting", "loading", "warming up", "ready" or "failed".
     """
 
-    def __init__(self):
+    def __init__(self, resultCache: bool = True, workerPool: bool = True):
         """
-        Initializes the Pipeline with instances of NecklaceTryOn and ClothingTryOn.
+        Initializes the Pipeline without loading any model.
 
-        This constructor sets up the necessary objects required for the 
-        try-on functionalities.
+        This constructor sets up the lightweight objects required for the 
+        try-on functionalities. Both components share a single landmark service
+        so a user photo only goes through pose detection once, and a single
+        catalogue index so every necklace is analysed once.
+
+        Args:
+            resultCache (bool, optional): Whether to create the result cache if it is configured. 
+                Defaults to True; offline renderers with several processes disable it, since the 
+                cache directory and its size limit belong to a single process.
+            workerPool (bool, optional): Whether to create the worker pool if one is configured. Defaults to True.
         """
-        self.necklaceTryOnObject = NecklaceTryOn()
-        self.clothingTryOnObject = ClothingTryOn()
+        self.config = getConfig("config.ini")
+        self.landmarkService = PoseLandmarkService()
+        self.catalogueIndex = CatalogueIndex()
+        self.state = "starting"
+        self._necklaceTryOnObject = None
+        self._clothingTryOnObject = None
+        self._necklaceVideoTryOnObject = None
+        self._loadLocks = {x: threading.Lock() for x in ["necklace", "clothing", "video"]}
+        self._ready = threading.Event()
+
+        self.scheduler = None
+        if self.config.getboolean("INFERENCE SCHEDULER", "enabled", fallback = False):
+            self.scheduler = self._createScheduler()
+
+        self.resultCache = None
+        if resultCache and self.config.getboolean("RESULT CACHE", "enabled", fallback = False):
+            self.resultCache = ResultCache(self.config)
+
+        self.workerPool = None
+        if workerPool and self.config.getint("WORKERS", "count", fallback = 0) > 0:
+            self.workerPool = WorkerPool(
+                self,
+                count = self.config.getint("WORKERS", "count"),
+                concurrency = self.config.getint("WORKERS", "concurrency", fallback = 1),
+                threadsPerWorker = self.config.getint("WORKERS", "threadsPerWorker", fallback = 0),
+                pinCores = self.config.getboolean("WORKERS", "pinCores", fallback = False)
+            )
+
+        # without a warm-up the components are loaded lazily by the first requests, which are served as usual
+        if self.workerPool is None and not self.config.getboolean("WARM UP", "enabled", fallback = True):
+            self.state = "ready"
+            self._ready.set()
+
+    def _createScheduler(self) -> InferenceScheduler:
+        """Create the diffusion scheduler with the configured batch settings."""
+        return InferenceScheduler(
+            batchFunction = lambda jobs: self.clothingTryOnObject.runDiffusion(jobs),
+            maxBatchSize = self.config.getint("INFERENCE SCHEDULER", "maxBatchSize", fallback = 4),
+            maxWait = self.config.getfloat("INFERENCE SCHEDULER", "maxWait", fallback = 0.05)
+        )
+
+    @property
+    def necklaceTryOnObject(self) -> NecklaceTryOn:
+        """The necklace try-on component, created on first access."""
+        if self._necklaceTryOnObject is None:
+            with self._loadLocks["necklace"]:
+                if self._necklaceTryOnObject is None:
+                    logger.info("loading the necklace try-on component")
+                    self._necklaceTryOnObject = NecklaceTryOn(landmarkService = self.landmarkService, catalogueIndex = self.catalogueIndex)
+        return self._necklaceTryOnObject
 
-    def necklaceTryOn(self, image: Image.Image, jewellery: Image.Image) -> Image.Image:
+    @property
+    def clothingTryOnObject(self) -> ClothingTryOn:
+        """The clothing try-on component, created on first access. This loads the inpainting model."""
+        if self._clothingTryOnObject is None:
+            with self._loadLocks["clothing"]:
+                if self._clothingTryOnObject is None:
+                    logger.info("loading the clothing try-on component")
+                    clothingTryOnObject = ClothingTryOn(landmarkService = self.landmarkService, catalogueIndex = self.catalogueIndex)
+                    clothingTryOnObject.scheduler = self.scheduler
+                    self._clothingTryOnObject = clothingTryOnObject
+        return self._clothingTryOnObject
+
+    @property
+    def necklaceVideoTryOnObject(self) -> NecklaceVideoTryOn:
+        """The live camera necklace try-on, created on first access with its own tracking pose detector."""
+        if self._necklaceVideoTryOnObject is None:
+            necklaceTryOnObject = self.necklaceTryOnObject
+            with self._loadLocks["video"]:
+                if self._necklaceVideoTryOnObject is None:
+                    logger.info("loading the live camera necklace try-on component")
+                    self._necklaceVideoTryOnObject = NecklaceVideoTryOn(necklaceTryOn = necklaceTryOnObject)
+        return self._necklaceVideoTryOnObject
+
+    def warmUp(self) -> None:
+        """
+        Load every component and run a dummy inference through them.
+
+        The dummy inference makes the first real request skip the one-off costs of 
+        initializing the pose graph and setting up the CPU/CUDA kernels of the diffusion model.
+        The readiness state is updated as the warm-up progresses. With a worker pool, every 
+        worker warms itself up and this waits for all of them.
+        """
+        try:
+            if self.workerPool is not None:
+                self.state = "warming up"
+                self.state = "ready" if self.workerPool.waitUntilReady() else "failed"
+                logger.info(f"the worker pool is {self.state}")
+                return
+
+            self.state = "loading"
+            self.necklaceTryOnObject
+            self.clothingTryOnObject
+
+            self.state = "warming up"
+            logger.info("warming up the pose detector")
+            self.landmarkService.getLandmarks(np.zeros((512, 512, 3), dtype = np.uint8))
+            self.clothingTryOnObject.warmUp()
+
+            self.state = "ready"
+            logger.info("the pipeline is ready")
+
+        except Exception as e:
+            self.state = "failed"
+            metrics.recordError("warmUp", e)
+            logger.error(CustomException(e))
+
+        finally:
+            self._ready.set()
+
+    def startWorkers(self) -> None:
+        """
+        Load the models and fork the worker pool, if one is configured.
+
+        This must run before the application starts threads of its own, such as the background 
+        warm-up, since only the calling thread survives the fork. The log listener thread, which 
+        is already running, is restarted in every worker.
+        """
+        if self.workerPool is not None:
+            self.state = "loading"
+            self.workerPool.start()
+
+    def resetAfterFork(self) -> None:
+        """
+        Prepare the pipeline of a forked worker to run the try-ons itself.
+
+        The worker serves the requests routed by its parent, so it neither routes them 
+        further nor caches their results, which the parent does. Threads do not survive 
+        the fork, so the locks and the scheduler thread are created again.
+        """
+        self.workerPool = None
+        self.resultCache = None
+        self.state = "starting"
+        self._loadLocks = {x: threading.Lock() for x in self._loadLocks}
+        self._ready = threading.Event()
+        if self.scheduler is not None:
+            self.scheduler = self._createScheduler()
+            self.clothingTryOnObject.scheduler = self.scheduler
+
+    def startWarmUp(self) -> threading.Thread:
+        """
+        Run the warm-up on a background thread.
+
+        Returns:
+            threading.Thread: The started warm-up thread.
+        """
+        thread = threading.Thread(target = self.warmUp, name = "PipelineWarmUp", daemon = True)
+        thread.start()
+        return thread
+
+    def isReady(self) -> bool:
+        """
+        Check whether every component is loaded and warmed up.
+
+        Returns:
+            bool: True once the warm-up has completed successfully, or right away if the warm-up 
+                is disabled and the components are loaded by the first requests.
+        """
+        return self.state == "ready"
+
+    def waitUntilReady(self, timeout: float = None) -> bool:
+        """
+        Block until the warm-up has finished.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait. Waits indefinitely if not provided.
+
+        Returns:
+            bool: True if the pipeline is ready, False if the warm-up failed or the timeout expired.
+        """
+        self._ready.wait(timeout = timeout)
+        return self.isReady()
+
+    def necklaceTryOn(self, image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray, asArray: bool = False) -> Image.Image | np.ndarray:
         """
         Overlay a necklace image onto the user's image.
 
+        Args:
+            image (Image.Image | np.ndarray): The user's image, ideally captured in a standing position.
+            jewellery (Image.Image | np.ndarray): The RGBA image of the necklace to be overlaid.
+            asArray (bool, optional): Whether to return the RGB array instead of a PIL Image. Defaults to False.
+
+        Returns:
+            Image.Image | np.ndarray: A PIL Image depicting the user wearing the specified necklace, or its array.
+                A cached array is read-only.
+        """
+        with requestSpan("necklaceTryOn"):
+            key, cached = self._getCachedResult("necklace", image, jewellery)
+            if cached is not None:
+                result = cached[0]
+            else:
+                if self.workerPool is not None:
+                    result = self.workerPool.run("necklaceTryOn", image = image, jewellery = jewellery, asArray = True)
+                else:
+                    result = self.necklaceTryOnObject.necklaceTryOn(image = image, jewellery = jewellery, asArray = True)
+                if result is not None and key is not None:
+                    self.resultCache.put("necklace", key, [result])
+        if result is None or asArray:
+            return result
+        return Image.fromarray(result)
+    
+    def necklaceGrid(self, image: Image.Image, jewelleries: list[Image.Image], contactSheet: bool = False) -> list[Image.Image] | Image.Image:
+        """
+        Overlay every necklace of a list onto the user's image in a single request.
+
         Args:
             image (Image.Image): The user's image, ideally captured in a standing position.
-            jewellery (Image.Image): The image of the necklace to be overlaid.
+            jewelleries (list[Image.Image]): The images of the necklaces to be overlaid, such as a whole catalogue category.
+            contactSheet (bool, optional): Whether to return a single contact sheet instead of one image per necklace. Defaults to False.
 
         Returns:
-            Image.Image: A PIL Image depicting the user wearing the specified necklace.
+            list[Image.Image] | Image.Image: One PIL Image per necklace, None where it could not be placed, or the contact sheet.
         """
-        result = self.necklaceTryOnObject.necklaceTryOn(image = image, jewellery = jewellery)
+        with requestSpan("necklaceGrid"):
+            if self.workerPool is not None:
+                result = self.workerPool.run("necklaceGrid", image = image, jewelleries = jewelleries, contactSheet = contactSheet)
+            else:
+                result = self.necklaceTryOnObject.necklaceGrid(image = image, jewelleries = jewelleries, contactSheet = contactSheet)
         return result
-    
-    def clothingTryOn(self, image: Image.Image, jewellery: Image.Image) -> Image.Image:
+
+    def necklaceVideoTryOn(self, frame: np.ndarray, jewellery: Image.Image) -> np.ndarray:
+        """
+        Overlay a necklace onto a frame of the live camera stream.
+
+        Frames are not wrapped in a request span, since logging a line per frame would flood the logs;
+        the stage latencies are still recorded.
+
+        Args:
+            frame (np.ndarray): The RGB camera frame.
+            jewellery (Image.Image): The image of the necklace to be overlaid.
+
+        Returns:
+            np.ndarray: The frame wearing the necklace, or None if the frame was dropped under load.
+        """
+        return self.necklaceVideoTryOnObject.processFrame(frame = frame, jewellery = jewellery)
+
+    def clothingTryOn(self, image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray, fastVariants: bool = None) -> tuple[Image.Image]:
         """
         Simulate wearing clothing on the user's image and generate the final output.
 
+        Args:
+            image (Image.Image | np.ndarray): The user's image, ideally captured in a standing position.
+            jewellery (Image.Image | np.ndarray): The image of the clothing item to be overlaid.
+            fastVariants (bool, optional): Whether to generate the first colour only and recolour it 
+                into the others. Defaults to the configured variant mode.
+
+        Returns:
+            tuple[Image.Image]: One PIL Image per configured colour depicting the user wearing the specified clothing, 
+                or None if the necklace could not be placed or the generation failed.
+        """
+        with requestSpan("clothingTryOn"):
+            key, cached = self._getCachedResult("clothing", image, jewellery, fastVariants = self._getVariantMode(fastVariants))
+            if cached is not None:
+                return tuple(Image.fromarray(x) for x in cached)
+            if self.workerPool is not None:
+                results = self.workerPool.run("clothingTryOn", image = image, jewellery = jewellery, fastVariants = fastVariants)
+            else:
+                masked = self.clothingTryOnObject.getBinaryMask(image = image, jewellery = jewellery)
+                if masked is None:
+                    return None
+                tryOnOutput, mask = masked
+                results = self.clothingTryOnObject.generateImage(
+                    image = tryOnOutput, mask = mask, fastVariants = fastVariants, outputSize = getImageSize(image)
+                )
+            if results is not None and key is not None:
+                self.resultCache.put("clothing", key, [np.asarray(x) for x in results])
+        return results
+
+    def clothingTryOnStream(
+        self,
+        image: Image.Image,
+        jewellery: Image.Image,
+        fastVariants: bool = None,
+        onComplete: Callable[[tuple[Image.Image]], None] = None
+    ) -> Iterator[tuple[Image.Image]]:
+        """
+        Simulate wearing clothing on the user's image, streaming each colour as soon as it is ready.
+
         Args:
             image (Image.Image): The user's image, ideally captured in a standing position.
             jewellery (Image.Image): The image of the clothing item to be overlaid.
+            fastVariants (bool, optional): Whether to generate the first colour only and recolour it 
+                into the others. Defaults to the configured variant mode.
+            onComplete (Callable[[tuple[Image.Image]], None], optional): Called with the final images 
+                once every colour has finished, as a worker reports them to its parent.
+
+        Yields:
+            tuple[Image.Image]: The current output of every configured colour, None where nothing is ready yet. 
+                Nothing is yielded if the necklace could not be placed.
+        """
+        with requestSpan("clothingTryOnStream"):
+            key, cached = self._getCachedResult("clothing", image, jewellery, fastVariants = self._getVariantMode(fastVariants))
+            if cached is not None:
+                yield tuple(Image.fromarray(x) for x in cached)
+                return
+
+            def complete(results: tuple[Image.Image]) -> None:
+                if key is not None:
+                    self.resultCache.put("clothing", key, [np.asarray(x) for x in results])
+                if onComplete is not None:
+                    onComplete(results)
+
+            if self.workerPool is not None:
+                yield from self.workerPool.stream(
+                    "clothingTryOnStream", image = image, jewellery = jewellery, fastVariants = fastVariants, onComplete = complete
+                )
+                return
+            masked = self.clothingTryOnObject.getBinaryMask(image = image, jewellery = jewellery)
+            if masked is None:
+                return
+            tryOnOutput, mask = masked
+            yield from self.clothingTryOnObject.generateImageStream(
+                image = tryOnOutput, mask = mask, fastVariants = fastVariants, onComplete = complete,
+                outputSize = getImageSize(image)
+            )
+
+    def prewarmResultCache(self, images: Iterable[Image.Image], jewelleries: list[Image.Image], clothing: bool = False) -> int:
+        """
+        Render and cache every combination of the given images and necklaces that is not cached yet.
+
+        Combinations are rendered image by image, and the pre-warming stops once the disk tier of 
+        the cache is full, so it never evicts results it has just rendered. The try-on components 
+        are called directly in this process rather than through the request entry points or the 
+        worker pool, so the renders do not count as requests in the metrics, and every result is 
+        written to disk before the next one is rendered.
+
+        Args:
+            images (Iterable[Image.Image]): The users' images, such as the example model photos, consumed one at a time.
+            jewelleries (list[Image.Image]): The necklaces, such as the example catalogue necklaces.
+            clothing (bool, optional): Whether to also render the clothing try-on, which runs the 
+                diffusion model for every combination. Defaults to False.
+
+        Returns:
+            int: The number of results rendered, 0 if the result cache is disabled.
+        """
+        if self.resultCache is None:
+            return 0
+
+        kinds = [("necklace", {})]
+        if clothing:
+            kinds.append(("clothing", {"fastVariants": self._getVariantMode(None)}))
+        logger.info(f"pre-warming the result cache with {len(jewelleries)} necklaces per image")
+        rendered = 0
+        for image in images:
+            for jewellery in jewelleries:
+                for kind, options in kinds:
+                    if self.resultCache.isFull():
+                        logger.info(f"the result cache is full, stopping the pre-warming after {rendered} results")
+                        return rendered
+                    key = self.resultCache.getKey(image, jewellery, **options)
+                    if not self.resultCache.contains(kind, key):
+                        results = self._render(kind, image, jewellery, **options)
+                        if results is not None:
+                            self.resultCache.put(kind, key, [np.asarray(x) for x in results])
+                            self.resultCache.flush()
+                        rendered += 1
+        logger.info(f"pre-warmed the result cache with {rendered} results")
+        return rendered
+
+    def _render(self, kind: str, image: Image.Image, jewellery: Image.Image, fastVariants: bool = None) -> list[Image.Image | np.ndarray]:
+        """Run a try-on on the components of this process, without the result cache and the request metrics."""
+        if kind == "necklace":
+            result = self.necklaceTryOnObject.necklaceTryOn(image = image, jewellery = jewellery, asArray = True)
+            return None if result is None else [result]
+        masked = self.clothingTryOnObject.getBinaryMask(image = image, jewellery = jewellery)
+        if masked is None:
+            return None
+        tryOnOutput, mask = masked
+        return self.clothingTryOnObject.generateImage(
+            image = tryOnOutput, mask = mask, fastVariants = fastVariants, outputSize = getImageSize(image)
+        )
+
+    def _getCachedResult(self, kind: str, image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray, **options) -> tuple[str, list[np.ndarray]]:
+        """Compute the result cache key of a request and look it up, returning no key if the cache is disabled."""
+        if self.resultCache is None:
+            return None, None
+        key = self.resultCache.getKey(image, jewellery, **options)
+        return key, self.resultCache.get(kind, key)
+
+    def _getVariantMode(self, fastVariants: bool) -> bool:
+        """Resolve the variant mode of a request against the configured one, without loading the model."""
+        if fastVariants is not None:
+            return bool(fastVariants)
+        return self.config.get("CLOTHING TRY ON", "variantMode", fallback = "full").strip().lower() == "fast"
+
+    def landmarkCacheInfo(self) -> dict[str, int]:
+        """
+        Report the hit/miss counters of the shared landmark cache and the state of its detector pool.
+
+        Returns:
+            dict[str, int]: The number of hits, misses, the current size and the maximum size of the cache,
+                and the number of created, idle and maximum pose detectors.
+        """
+        return self.landmarkService.cacheInfo()
+
+    def schedulerStats(self) -> dict[str, float]:
+        """
+        Report the counters of the diffusion scheduler.
+
+        Returns:
+            dict[str, float]: The queue depth, batch fill ratio and wait times, or an empty 
+                dictionary if the scheduler is disabled.
+        """
+        if self.scheduler is None:
+            return {}
+        return self.scheduler.stats()
+
+    def videoStats(self) -> dict[str, float]:
+        """
+        Report the achieved frame rate of the live camera try-on.
+
+        Returns:
+            dict[str, float]: The frames per second and the number of processed and dropped frames, 
+                or an empty dictionary if the camera has not been used yet.
+        """
+        if self._necklaceVideoTryOnObject is None:
+            return {}
+        return self._necklaceVideoTryOnObject.stats()
+
+    def resultCacheStats(self) -> dict[str, float]:
+        """
+        Report the counters of the result cache.
+
+        Returns:
+            dict[str, float]: The memory hits, disk hits, misses, hit rate and tier sizes, or an 
+                empty dictionary if the cache is disabled.
+        """
+        if self.resultCache is None:
+            return {}
+        return self.resultCache.stats()
+
+    def workerStats(self) -> dict[str, dict[str, float]]:
+        """
+        Report the load and memory of the worker processes.
+
+        Returns:
+            dict[str, dict[str, float]]: The in-flight and completed requests and the resident and 
+                proportional set sizes of the parent and of every worker, or an empty dictionary 
+                if the worker pool is disabled.
+        """
+        if self.workerPool is None:
+            return {}
+        return self.workerPool.stats()
+
+    def renderMetrics(self) -> str:
+        """
+        Render the latency histograms, error counters and current cache and scheduler state.
 
         Returns:
-            Image.Image: A PIL Image depicting the user wearing the specified clothing.
+            str: Every metric in the Prometheus text exposition format.
         """
-        tryOnOutput, mask = self.clothingTryOnObject.getBinaryMask(image = image, jewellery = jewellery)
-        results = self.clothingTryOnObject.generateImage(image = tryOnOutput, mask = mask)
-        return results
\ No newline at end of file
+        metrics.setGauge("gemfit_ready", 1 if self.isReady() else 0)
+        for key, value in self.landmarkCacheInfo().items():
+            metrics.setGauge("gemfit_landmark_cache", value, field = key)
+        for key, value in self.schedulerStats().items():
+            metrics.setGauge("gemfit_scheduler", value, field = key)
+        for key, value in self.videoStats().items():
+            metrics.setGauge("gemfit_video", value, field = key)
+        for key, value in self.resultCacheStats().items():
+            metrics.setGauge("gemfit_result_cache", value, field = key)
+        for worker, values in self.workerStats().items():
+            for key, value in values.items():
+                metrics.setGauge("gemfit_worker", value, worker = worker, field = key)
+        return metrics.render()
\ No newline at end of file
@@ -0,0 +1,238 @@
+from src.pipelines.completePipeline import Pipeline
+from src.utils.imageCodec import decodeImage, encodeImage, MEDIA_TYPES
+from src.utils.exceptions import CustomException
+from src.utils.metrics import metrics
+from src.utils.logger import logger
+from fastapi.responses import JSONResponse, Response
+from fastapi import APIRouter, Request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from PIL import Image
+import numpy as np
+import asyncio
+import uuid
+
+class TryOnApi:
+    """
+    A lean HTTP API for the try-on pipeline, used by the kiosk frontend instead of the Gradio UI.
+
+    Requests carry the user's photo as a raw JPEG, WebP or PNG body, either on its own with a
+    `necklaceId` query parameter naming a catalogue necklace, or as the `image` part of a
+    multipart form next to a `jewellery` part. Requests naming a catalogue necklace are answered
+    with 503 while the catalogue is still loading. Bodies are decoded straight into NumPy arrays
+    and the results are encoded straight from them, without base64 or PIL round trips.
+    The handlers are asynchronous and run the decoding, try-on and encoding on dedicated
+    thread pools, so the event loop keeps accepting requests while the CPU work runs.
+
+    The necklace endpoint returns a single image. The clothing endpoint returns a
+    `multipart/mixed` body with one image part per configured colour.
+
+    Attributes:
+        pipeline (Pipeline): The shared try-on pipeline.
+        config (ConfigParser): Configuration settings loaded from the config.ini file.
+        format (str): The default output format, one of "jpeg", "webp" or "png".
+        quality (int): The default JPEG or WebP quality of the outputs.
+        maxSide (int): The longer side outputs are downscaled to before encoding, 0 to keep the working resolution.
+        maxBodySize (int): The largest accepted request body in bytes.
+        router (APIRouter): The routes to include in the FastAPI app.
+
+    Methods:
+        necklaceTryOn(request: Request) -> Response:
+            Overlays a necklace onto the posted photo and returns the encoded result.
+
+        clothingTryOn(request: Request) -> Response:
+            Runs the clothing try-on on the posted photo and returns every colour variant.
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        getNecklace: Callable[[str], Image.Image] = None,
+        isCatalogueReady: Callable[[], bool] = None
+    ):
+        """
+        Initialize the TryOnApi and its routes.
+
+        Args:
+            pipeline (Pipeline): The try-on pipeline to serve.
+            getNecklace (Callable[[str], Image.Image], optional): Looks up a catalogue necklace by its ID,
+                returning None if it does not exist. Without it, the necklace must be posted with every request.
+                It is called on the try-on executors, since it may decode the image.
+            isCatalogueReady (Callable[[], bool], optional): Checks without blocking whether the catalogue 
+                `getNecklace` looks up is loaded. Defaults to None, which treats it as always loaded.
+        """
+        self.pipeline = pipeline
+        self.getNecklace = getNecklace
+        self.isCatalogueReady = isCatalogueReady
+        self.config = pipeline.config
+        self.format = self.config.get("HTTP API", "format", fallback = "jpeg")
+        self.quality = self.config.getint("HTTP API", "quality", fallback = 85)
+        self.maxSide = self.config.getint("HTTP API", "maxSide", fallback = 0)
+        self.maxBodySize = self.config.getint("HTTP API", "maxBodyMegabytes", fallback = 16) * 1024 * 1024
+
+        # the necklace try-on scales with the pose detector pool, the diffusion stage with the scheduler batch,
+        # and both with the capacity of the worker pool if there is one
+        necklaceWorkers = pipeline.landmarkService.poolSize
+        clothingWorkers = pipeline.scheduler.maxBatchSize if pipeline.scheduler is not None else 1
+        if pipeline.workerPool is not None:
+            necklaceWorkers = clothingWorkers = pipeline.workerPool.capacity
+        self._necklaceExecutor = ThreadPoolExecutor(max_workers = necklaceWorkers, thread_name_prefix = "NecklaceApi")
+        self._clothingExecutor = ThreadPoolExecutor(max_workers = clothingWorkers, thread_name_prefix = "ClothingApi")
+
+        self.router = APIRouter(prefix = self.config.get("HTTP API", "prefix", fallback = "/api"))
+        self.router.add_api_route("/necklace", self.necklaceTryOn, methods = ["POST"])
+        self.router.add_api_route("/clothing", self.clothingTryOn, methods = ["POST"])
+
+    async def necklaceTryOn(self, request: Request) -> Response:
+        """
+        Overlay a necklace onto the posted photo.
+
+        Args:
+            request (Request): The raw or multipart request, with optional `necklaceId`, `format`,
+                `quality` and `maxSide` query parameters.
+
+        Returns:
+            Response: The encoded image, or a JSON error, with status 503 while the catalogue is loading.
+        """
+        try:
+            imageData, jewellery = await self._readInputs(request)
+            outputFormat, quality, maxSide = self._getOutputSettings(request)
+            if isinstance(jewellery, str) and not self._isCatalogueReady():
+                return JSONResponse(status_code = 503, content = {"error": "the catalogue is still loading"})
+        except ValueError as e:
+            return JSONResponse(status_code = 400, content = {"error": str(e)})
+        except OverflowError as e:
+            return JSONResponse(status_code = 413, content = {"error": str(e)})
+
+        def render() -> bytes:
+            image = decodeImage(imageData)
+            result = self.pipeline.necklaceTryOn(image = image, jewellery = self._getJewelleryArray(jewellery), asArray = True)
+            return None if result is None else encodeImage(result, outputFormat, quality, maxSide)
+
+        body = await self._run(self._necklaceExecutor, render, "necklaceApi")
+        if isinstance(body, Response):
+            return body
+        return Response(content = body, media_type = MEDIA_TYPES[outputFormat])
+
+    async def clothingTryOn(self, request: Request) -> Response:
+        """
+        Run the clothing try-on on the posted photo.
+
+        Args:
+            request (Request): The raw or multipart request, with optional `necklaceId`, `format`,
+                `quality`, `maxSide` and `variants` query parameters, `variants` being "fast" or "full".
+
+        Returns:
+            Response: A `multipart/mixed` body with one image part per colour, or a JSON error, with 
+                status 503 while the catalogue is loading.
+        """
+        try:
+            imageData, jewellery = await self._readInputs(request)
+            outputFormat, quality, maxSide = self._getOutputSettings(request)
+            fastVariants = self._getVariantMode(request)
+            if isinstance(jewellery, str) and not self._isCatalogueReady():
+                return JSONResponse(status_code = 503, content = {"error": "the catalogue is still loading"})
+        except ValueError as e:
+            return JSONResponse(status_code = 400, content = {"error": str(e)})
+        except OverflowError as e:
+            return JSONResponse(status_code = 413, content = {"error": str(e)})
+
+        def render() -> list[bytes]:
+            image = decodeImage(imageData)
+            results = self.pipeline.clothingTryOn(
+                image = image, jewellery = self._getJewelleryArray(jewellery), fastVariants = fastVariants
+            )
+            return None if results is None else [encodeImage(np.asarray(x), outputFormat, quality, maxSide) for x in results]
+
+        bodies = await self._run(self._clothingExecutor, render, "clothingApi")
+        if isinstance(bodies, Response):
+            return bodies
+
+        boundary = uuid.uuid4().hex
+        extension = "jpg" if outputFormat == "jpeg" else outputFormat
+        parts = []
+        for colour, body in zip(self.pipeline.clothingTryOnObject.colours, bodies):
+            header = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {MEDIA_TYPES[outputFormat]}\r\n"
+                f"Content-Disposition: inline; name=\"{colour}\"; filename=\"{colour.lower()}.{extension}\"\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            )
+            parts.extend([header.encode(), body, b"\r\n"])
+        parts.append(f"--{boundary}--\r\n".encode())
+        return Response(content = b"".join(parts), media_type = f"multipart/mixed; boundary={boundary}")
+
+    async def _readInputs(self, request: Request) -> tuple[bytes, bytes | str]:
+        """Read the encoded photo and the encoded necklace or catalogue necklace ID of a request."""
+        contentLength = int(request.headers.get("content-length") or 0)
+        if contentLength > self.maxBodySize:
+            raise OverflowError(f"the request body exceeds {self.maxBodySize} bytes")
+
+        jewellery = None
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form(max_files = 2, max_part_size = self.maxBodySize)
+            if not hasattr(form.get("image"), "read"):
+                raise ValueError("the multipart form has no image part")
+            imageData = await form["image"].read()
+            if hasattr(form.get("jewellery"), "read"):
+                jewellery = await form["jewellery"].read()
+        else:
+            imageData = await request.body()
+        if len(imageData) > self.maxBodySize:
+            raise OverflowError(f"the request body exceeds {self.maxBodySize} bytes")
+
+        necklaceId = request.query_params.get("necklaceId")
+        if jewellery is None and necklaceId is not None and self.getNecklace is not None:
+            jewellery = necklaceId
+        if jewellery is None:
+            raise ValueError("a necklaceId query parameter or a jewellery part is required")
+        return imageData, jewellery
+
+    def _getOutputSettings(self, request: Request) -> tuple[str, int, int]:
+        """Read the output format, quality and size of a request, falling back to the configured defaults."""
+        outputFormat = request.query_params.get("format", self.format).lower().replace("jpg", "jpeg")
+        if outputFormat not in MEDIA_TYPES:
+            raise ValueError(f"unsupported output format: {outputFormat}")
+        quality = min(max(int(request.query_params.get("quality", self.quality)), 1), 100)
+        maxSide = int(request.query_params.get("maxSide", self.maxSide))
+        if maxSide < 0:
+            raise ValueError(f"maxSide must not be negative: {maxSide}")
+        return outputFormat, quality, maxSide
+
+    @staticmethod
+    def _getVariantMode(request: Request) -> bool:
+        """Read whether the colours are recoloured or all generated, None for the configured mode."""
+        variants = request.query_params.get("variants")
+        if variants is None:
+            return None
+        if variants.lower() not in ["fast", "full"]:
+            raise ValueError(f"unsupported variant mode: {variants}")
+        return variants.lower() == "fast"
+
+    def _isCatalogueReady(self) -> bool:
+        """Check whether catalogue necklaces can be looked up yet."""
+        return self.isCatalogueReady is None or self.isCatalogueReady()
+
+    def _getJewelleryArray(self, jewellery: bytes | str) -> np.ndarray:
+        """Decode a posted necklace or look up a catalogue necklace by its ID, as an RGBA array."""
+        if isinstance(jewellery, bytes):
+            return decodeImage(jewellery, alpha = True)
+        necklace = self.getNecklace(jewellery)
+        if necklace is None:
+            raise ValueError(f"unknown necklace: {jewellery}")
+        return np.array(necklace if necklace.mode == "RGBA" else necklace.convert("RGBA"))
+
+    async def _run(self, executor: ThreadPoolExecutor, function: Callable[[], object], component: str) -> object:
+        """Run the CPU work of a request on an executor, turning failures into JSON error responses."""
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, function)
+        except ValueError as e:
+            return JSONResponse(status_code = 400, content = {"error": str(e)})
+        except Exception as e:
+            metrics.recordError(component, e)
+            logger.error(CustomException(e))
+            return JSONResponse(status_code = 500, content = {"error": "the try-on failed"})
+
+        if result is None:
+            return JSONResponse(status_code = 422, content = {"error": "no person or necklace placement was found in the image"})
+        return result
\ No newline at end of file
@@ -0,0 +1,132 @@
+from src.utils.logger import logger
+from concurrent.futures import Future
+from typing import Any, Callable
+import threading
+import queue
+import time
+
+class InferenceScheduler:
+    """
+    A micro-batching scheduler that groups work from concurrent requests into single batches.
+
+    Requests submit their prepared job and wait for the result. A background worker takes the
+    first pending job, keeps collecting further jobs until the batch is full or the maximum wait
+    has passed, runs the whole batch through `batchFunction` in one call and hands each caller
+    its own result.
+
+    Attributes:
+        batchFunction (Callable[[list[Any]], list[Any]]): Processes a list of jobs and returns one result per job.
+        maxBatchSize (int): The maximum number of jobs run together.
+        maxWait (float): The maximum time in seconds the first job of a batch waits for others.
+
+    Methods:
+        submit(job: Any) -> Future:
+            Queues a job and returns a future for its result.
+
+        run(job: Any) -> Any:
+            Queues a job and blocks until its result is available.
+
+        stats() -> dict[str, float]:
+            Returns the queue depth, batch fill ratio and wait time counters.
+    """
+
+    def __init__(self, batchFunction: Callable[[list[Any]], list[Any]], maxBatchSize: int, maxWait: float):
+        """
+        Initialize the InferenceScheduler and start its worker thread.
+
+        Args:
+            batchFunction (Callable[[list[Any]], list[Any]]): Processes a list of jobs and returns one result per job.
+            maxBatchSize (int): The maximum number of jobs run together.
+            maxWait (float): The maximum time in seconds the first job of a batch waits for others.
+        """
+        self.batchFunction = batchFunction
+        self.maxBatchSize = max(int(maxBatchSize), 1)
+        self.maxWait = max(float(maxWait), 0.0)
+        self._queue = queue.Queue()
+        self._statsLock = threading.Lock()
+        self._batches = 0
+        self._jobs = 0
+        self._totalWait = 0.0
+        self._maxWait = 0.0
+        self._worker = threading.Thread(target = self._loop, name = "InferenceScheduler", daemon = True)
+        self._worker.start()
+
+    def submit(self, job: Any) -> Future:
+        """
+        Queue a job for the next batch.
+
+        Args:
+            job (Any): The job to process.
+
+        Returns:
+            Future: A future resolved with the result of the job.
+        """
+        future = Future()
+        self._queue.put((job, future, time.perf_counter()))
+        return future
+
+    def run(self, job: Any) -> Any:
+        """
+        Queue a job and wait for its result.
+
+        Args:
+            job (Any): The job to process.
+
+        Returns:
+            Any: The result of the job.
+        """
+        return self.submit(job).result()
+
+    def stats(self) -> dict[str, float]:
+        """
+        Report the scheduler counters.
+
+        Returns:
+            dict[str, float]: The current queue depth, the number of batches and jobs processed,
+                the mean batch fill ratio and the mean and maximum time jobs waited in the queue.
+        """
+        with self._statsLock:
+            return {
+                "queueDepth": self._queue.qsize(),
+                "batches": self._batches,
+                "jobs": self._jobs,
+                "meanFillRatio": self._jobs / (self._batches * self.maxBatchSize) if self._batches else 0.0,
+                "meanWaitSeconds": self._totalWait / self._jobs if self._jobs else 0.0,
+                "maxWaitSeconds": self._maxWait
+            }
+
+    def _collect(self) -> list[tuple[Any, Future, float]]:
+        """Block for the first job, then gather more until the batch is full or the window closes."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.maxWait
+        while len(batch) < self.maxBatchSize:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout = remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            waits = [started - x[2] for x in batch]
+            with self._statsLock:
+                self._batches += 1
+                self._jobs += len(batch)
+                self._totalWait += sum(waits)
+                self._maxWait = max(self._maxWait, *waits)
+            logger.info(f"running a batch of {len(batch)} jobs, {self._queue.qsize()} still queued")
+
+            try:
+                results = self.batchFunction([x[0] for x in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
\ No newline at end of file
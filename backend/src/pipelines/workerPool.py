@@ -0,0 +1,368 @@
+from src.utils.exceptions import CustomException
+from src.utils.metrics import metrics
+from src.utils.logger import logger, stopLogger
+from multiprocessing.connection import Connection
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+import multiprocessing
+import itertools
+import threading
+import psutil
+import queue
+import torch
+import gc
+import os
+
+@dataclass
+class WorkerState:
+    """
+    The routing state of a single worker process, as seen by the parent.
+
+    Attributes:
+        index (int): The position of the worker in the pool.
+        process (multiprocessing.Process): The forked worker process.
+        connection (Connection): The parent end of the pipe to the worker.
+        sendLock (threading.Lock): Serializes the requests written to the pipe.
+        inFlight (int): The number of requests currently routed to the worker.
+        completed (int): The number of requests the worker has finished.
+        ready (bool): Whether the worker has finished its warm-up.
+        warm (bool): Whether the warm-up of the worker succeeded.
+        alive (bool): Whether the worker process is still running.
+    """
+    index: int
+    process: multiprocessing.Process
+    connection: Connection
+    sendLock: threading.Lock = field(default_factory = threading.Lock)
+    inFlight: int = 0
+    completed: int = 0
+    ready: bool = False
+    warm: bool = False
+    alive: bool = True
+
+
+class WorkerPool:
+    """
+    A pool of forked processes that run the try-ons of a single loaded pipeline.
+
+    The models are loaded once in the parent process, which then forks the workers. The
+    forked workers see the weights through copy-on-write pages that are never written to, so
+    the Stable Diffusion weights exist once in physical memory however many workers run. The
+    garbage collector is frozen before forking so that collections in the workers do not
+    touch, and thereby copy, the pages of objects created during loading. Everything that
+    must not cross a fork is created in the workers instead: the MediaPipe graphs, the torch
+    thread pool, sized to `threadsPerWorker` and optionally pinned to a group of cores, and
+    the inference scheduler thread. Every worker warms itself up after the fork. The logger
+    restarts its listener thread in every worker, and the workers send the metrics they record
+    to the parent after every request, where they are merged into the metrics endpoint.
+
+    The parent routes each request to the least busy ready worker that is below its
+    `concurrency` limit and blocks while every worker is at its limit. Requests and results
+    are pickled over a pipe per worker, and streamed results arrive one message per update.
+    Forking requires the models to live in CPU memory, so only the cpu profile is supported,
+    and a worker that exits is not replaced.
+
+    Attributes:
+        pipeline (Pipeline): The pipeline whose loaded models are shared with the workers.
+        count (int): The number of worker processes.
+        concurrency (int): The maximum number of requests a worker runs at once.
+        capacity (int): The maximum number of requests the whole pool runs at once.
+        threadsPerWorker (int): The number of torch threads of every worker.
+        pinCores (bool): Whether every worker is pinned to its own group of cores.
+
+    Methods:
+        start() -> None:
+            Loads the models and forks the workers.
+
+        run(method: str, **kwargs) -> Any:
+            Runs a pipeline method on a worker and returns its result.
+
+        stream(method: str, onComplete: Callable[[Any], None] = None, **kwargs) -> Iterator[Any]:
+            Runs a streaming pipeline method on a worker and yields its updates.
+
+        waitUntilReady(timeout: float = None) -> bool:
+            Blocks until every worker has finished its warm-up.
+
+        stats() -> dict[str, dict[str, float]]:
+            Returns the load, completed requests and memory of the parent and of every worker.
+    """
+
+    def __init__(self, pipeline: Any, count: int, concurrency: int = 1, threadsPerWorker: int = 0, pinCores: bool = False):
+        """
+        Initialize the WorkerPool without forking any process.
+
+        Args:
+            pipeline (Pipeline): The pipeline to share with the workers.
+            count (int): The number of worker processes.
+            concurrency (int, optional): The maximum number of requests a worker runs at once. Defaults to 1.
+            threadsPerWorker (int, optional): The number of torch threads of every worker. Defaults to 0,
+                which splits the available cores evenly between the workers.
+            pinCores (bool, optional): Whether to pin every worker to its own group of cores. Defaults to False.
+        """
+        self.pipeline = pipeline
+        self.count = max(int(count), 1)
+        self.concurrency = max(int(concurrency), 1)
+        self.capacity = self.count * self.concurrency
+        self._cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+        self.threadsPerWorker = threadsPerWorker or max(len(self._cores) // self.count, 1)
+        self.pinCores = pinCores
+        self._workers = []
+        self._requests = {}
+        self._requestIds = itertools.count()
+        self._slots = threading.Condition()
+
+    def start(self) -> None:
+        """
+        Load the models in this process and fork the workers.
+
+        Only the calling thread survives the fork, so locks held by other threads at that moment 
+        would stay locked in the workers. The log listener thread is restarted in every worker, 
+        but this should be called before the application starts threads of its own, such as the 
+        catalogue loader.
+
+        Raises:
+            ValueError: If the inpainting model is not loaded with the cpu profile.
+        """
+        if self.pipeline.config.get("CLOTHING TRY ON", "profile", fallback = "cuda") != "cpu":
+            raise ValueError("multi-worker serving forks the loaded models and requires the cpu profile")
+
+        logger.info(f"loading the models once for {self.count} workers")
+        self.pipeline.necklaceTryOnObject
+        self.pipeline.clothingTryOnObject
+        gc.collect()
+        gc.freeze()
+
+        context = multiprocessing.get_context("fork")
+        for index in range(self.count):
+            parentConnection, childConnection = context.Pipe()
+            process = context.Process(
+                target = self._serve, args = (index, childConnection), name = f"TryOnWorker-{index}", daemon = True
+            )
+            process.start()
+            childConnection.close()
+            self._workers.append(WorkerState(index = index, process = process, connection = parentConnection))
+        logger.info(f"forked {self.count} workers with {self.threadsPerWorker} threads each")
+
+        for worker in self._workers:
+            threading.Thread(
+                target = self._receive, args = (worker,), name = f"TryOnWorkerReceiver-{worker.index}", daemon = True
+            ).start()
+
+    def run(self, method: str, **kwargs) -> Any:
+        """
+        Run a pipeline method on the least busy worker.
+
+        Args:
+            method (str): The name of the Pipeline method.
+            **kwargs: The arguments of the method, which must be picklable.
+
+        Returns:
+            Any: The result of the method.
+
+        Raises:
+            RuntimeError: If the worker failed or no worker is running.
+        """
+        result = None
+        for _, payload in self._submit(method, kwargs, notifyComplete = False):
+            result = payload
+        return result
+
+    def stream(self, method: str, onComplete: Callable[[Any], None] = None, **kwargs) -> Iterator[Any]:
+        """
+        Run a streaming pipeline method on the least busy worker.
+
+        Args:
+            method (str): The name of the Pipeline method, which must accept an `onComplete` callback if one is given.
+            onComplete (Callable[[Any], None], optional): Called in this process when the worker reports
+                the final result of the stream.
+            **kwargs: The arguments of the method, which must be picklable.
+
+        Yields:
+            Any: Every update yielded by the method.
+
+        Raises:
+            RuntimeError: If the worker failed or no worker is running.
+        """
+        for kind, payload in self._submit(method, kwargs, notifyComplete = onComplete is not None):
+            if kind == "item":
+                yield payload
+            elif kind == "complete":
+                onComplete(payload)
+
+    def waitUntilReady(self, timeout: float = None) -> bool:
+        """
+        Block until every running worker has finished its warm-up.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait. Waits indefinitely if not provided.
+
+        Returns:
+            bool: True if at least one worker is running and every running worker warmed up successfully.
+        """
+        with self._slots:
+            self._slots.wait_for(lambda: all(x.ready or not x.alive for x in self._workers), timeout = timeout)
+            running = [x for x in self._workers if x.alive]
+            return bool(running) and all(x.ready and x.warm for x in running)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Report the load and memory of the parent process and of every worker.
+
+        The resident set size counts the shared model weights in every process that maps them,
+        so the proportional set size, which splits shared pages between the processes, is
+        reported as well where the platform provides it.
+
+        Returns:
+            dict[str, dict[str, float]]: The in-flight and completed requests, liveness, resident
+                and proportional set sizes in bytes, keyed by "parent" or the worker index.
+        """
+        stats = {"parent": self._getMemory(os.getpid())}
+        with self._slots:
+            workers = [(x.index, x.process.pid, x.inFlight, x.completed, x.alive) for x in self._workers]
+        for index, pid, inFlight, completed, alive in workers:
+            stats[str(index)] = {
+                "inFlight": inFlight, "completed": completed, "alive": int(alive),
+                **(self._getMemory(pid) if alive else {})
+            }
+        return stats
+
+    def _submit(self, method: str, kwargs: dict[str, Any], notifyComplete: bool) -> Iterator[tuple[str, Any]]:
+        """Route a request to a worker and yield its responses until the final one."""
+        worker = self._acquire()
+        requestId = next(self._requestIds)
+        responses = queue.Queue()
+        self._requests[requestId] = (worker, responses)
+        try:
+            try:
+                with worker.sendLock:
+                    worker.connection.send((requestId, method, kwargs, notifyComplete))
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f"try-on worker {worker.index} is not reachable") from e
+
+            while True:
+                kind, payload = responses.get()
+                if kind == "error":
+                    raise RuntimeError(f"try-on worker {worker.index} failed: {payload}")
+                yield kind, payload
+                if kind in ["result", "done"]:
+                    return
+        finally:
+            self._requests.pop(requestId, None)
+            with self._slots:
+                worker.inFlight -= 1
+                self._slots.notify_all()
+
+    def _acquire(self) -> WorkerState:
+        """Reserve a slot on the least busy ready worker, waiting while every worker is at its limit."""
+        with self._slots:
+            while True:
+                if not any(x.alive for x in self._workers):
+                    raise RuntimeError("no try-on worker is running")
+                candidates = [x for x in self._workers if x.alive and x.ready and x.inFlight < self.concurrency]
+                if candidates:
+                    worker = min(candidates, key = lambda x: x.inFlight)
+                    worker.inFlight += 1
+                    return worker
+                self._slots.wait()
+
+    def _receive(self, worker: WorkerState) -> None:
+        """Hand the responses of a worker to the waiting requests, and fail them if the worker exits."""
+        while True:
+            try:
+                requestId, kind, payload = worker.connection.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "ready":
+                with self._slots:
+                    worker.ready, worker.warm = True, payload
+                    self._slots.notify_all()
+                continue
+            if kind == "metrics":
+                metrics.merge(payload, worker = str(worker.index))
+                continue
+            if kind in ["result", "done", "error"]:
+                with self._slots:
+                    worker.completed += 1
+            request = self._requests.get(requestId)
+            if request is not None:
+                request[1].put((kind, payload))
+
+        worker.process.join(timeout = 5)
+        logger.error(f"try-on worker {worker.index} exited with code {worker.process.exitcode}")
+        metrics.increment("gemfit_worker_exits_total", worker = str(worker.index))
+        with self._slots:
+            worker.alive = False
+            self._slots.notify_all()
+        for owner, responses in list(self._requests.values()):
+            if owner is worker:
+                responses.put(("error", "the worker exited"))
+
+    def _serve(self, index: int, connection: Connection) -> None:
+        """Run the requests of the parent in a forked worker until the pipe is closed."""
+        if self.pinCores and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self._cores[index * self.threadsPerWorker:(index + 1) * self.threadsPerWorker] or self._cores)
+        torch.set_num_threads(self.threadsPerWorker)
+        # the metrics inherited from the parent are already counted there
+        metrics.drain()
+        self.pipeline.resetAfterFork()
+        sendLock = threading.Lock()
+
+        def send(requestId: int, kind: str, payload: Any) -> None:
+            with sendLock:
+                connection.send((requestId, kind, payload))
+
+        self.pipeline.warmUp()
+        send(None, "ready", self.pipeline.isReady())
+        self._sendMetrics(send)
+
+        executor = ThreadPoolExecutor(max_workers = self.concurrency, thread_name_prefix = "TryOnWorker")
+        while True:
+            try:
+                requestId, method, kwargs, notifyComplete = connection.recv()
+            except (EOFError, OSError):
+                break
+            executor.submit(self._handle, send, requestId, method, kwargs, notifyComplete)
+        executor.shutdown(wait = False, cancel_futures = True)
+        stopLogger()
+        os._exit(0)
+
+    def _handle(self, send: Callable[[int, str, Any], None], requestId: int, method: str, kwargs: dict[str, Any], notifyComplete: bool) -> None:
+        """Run a single request in a worker and send back its result or every update of its stream."""
+        try:
+            if notifyComplete:
+                kwargs["onComplete"] = lambda results: send(requestId, "complete", results)
+            result = getattr(self.pipeline, method)(**kwargs)
+            if isinstance(result, Iterator):
+                for item in result:
+                    send(requestId, "item", item)
+                send(requestId, "done", None)
+            else:
+                send(requestId, "result", result)
+        except Exception as e:
+            metrics.recordError("tryOnWorker", e)
+            logger.error(CustomException(e))
+            send(requestId, "error", str(e))
+        finally:
+            self._sendMetrics(send)
+
+    @staticmethod
+    def _sendMetrics(send: Callable[[int, str, Any], None]) -> None:
+        """Send the metrics a worker recorded since the last call to the parent."""
+        # the parent times the whole request itself, including the routing to the worker
+        try:
+            send(None, "metrics", metrics.drain(exclude = ("gemfit_request_seconds",)))
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _getMemory(pid: int) -> dict[str, float]:
+        """Read the resident and proportional set sizes of a process, skipping what the platform does not report."""
+        try:
+            process = psutil.Process(pid)
+            memory = {"rssBytes": process.memory_info().rss}
+            pss = getattr(process.memory_full_info(), "pss", None)
+            if pss is not None:
+                memory["pssBytes"] = pss
+            return memory
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return {}
\ No newline at end of file
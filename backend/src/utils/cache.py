@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+import threading
+
+class LRUCache:
+    """
+    A small thread-safe, size-bounded least-recently-used cache.
+
+    Entries are evicted in least-recently-used order once the cache holds more
+    than `maxSize` items. Hit and miss counters are kept so callers can expose
+    cache effectiveness.
+
+    Attributes:
+        maxSize (int): The maximum number of entries held by the cache.
+        hits (int): The number of successful lookups.
+        misses (int): The number of failed lookups.
+
+    Methods:
+        get(key: Hashable) -> Any:
+            Returns the cached value for the key or None if it is missing.
+
+        put(key: Hashable, value: Any) -> None:
+            Stores a value, evicting the least recently used entry if needed.
+
+        stats() -> dict[str, int]:
+            Returns the hit/miss counters and the current size of the cache.
+    """
+
+    def __init__(self, maxSize: int):
+        """Initialize an empty cache holding at most `maxSize` entries."""
+        self.maxSize = max(int(maxSize), 0)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Look up a key, marking it as most recently used.
+
+        Args:
+            key (Hashable): The key to look up.
+
+        Returns:
+            Any: The cached value, or None if the key is not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value under a key, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (Hashable): The key to store the value under.
+            value (Any): The value to cache.
+        """
+        if self.maxSize == 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last = False)
+
+    def clear(self) -> None:
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Report the cache counters.
+
+        Returns:
+            dict[str, int]: The number of hits, misses, the current size and the maximum size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxSize": self.maxSize
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
\ No newline at end of file
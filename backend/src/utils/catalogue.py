@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor
+from appwrite.query import Query
+from src.utils.exceptions import CustomException
+from src.utils.metrics import metrics
+from src.utils.logger import logger
+from typing import Any
+from io import BytesIO
+from PIL import Image
+import threading
+import hashlib
+import json
+import os
+
+class LocalStorage:
+    """
+    A filesystem-backed stand-in for the Appwrite storage service.
+
+    Every file in `root` is exposed as a bucket file whose ID is the file name without its
+    extension, so the catalogue can be loaded and tested offline. Only the two calls used by
+    the catalogue loader are implemented, with the same signatures and response shapes.
+
+    Attributes:
+        root (str): The directory holding the catalogue files.
+
+    Methods:
+        list_files(bucket_id: str, queries: list = None) -> dict:
+            Lists the files of the directory with Appwrite-style metadata.
+
+        get_file_view(bucket_id: str, file_id: str) -> bytes:
+            Returns the content of a file.
+    """
+
+    def __init__(self, root: str):
+        """Initialize the LocalStorage on top of a directory."""
+        self.root = root
+
+    def _paths(self) -> dict[str, str]:
+        return {
+            os.path.splitext(x)[0]: os.path.join(self.root, x)
+            for x in sorted(os.listdir(self.root)) if os.path.isfile(os.path.join(self.root, x))
+        }
+
+    def list_files(self, bucket_id: str, queries: list = None) -> dict:
+        """
+        List the files of the directory.
+
+        Args:
+            bucket_id (str): Ignored, the directory acts as a single bucket.
+            queries (list, optional): Ignored, the caller limits the listing.
+
+        Returns:
+            dict: The total number of files and their metadata, as returned by Appwrite.
+        """
+        files = []
+        for fileId, path in self._paths().items():
+            with open(path, "rb") as file:
+                signature = hashlib.md5(file.read()).hexdigest()
+            files.append({
+                "$id": fileId,
+                "name": os.path.basename(path),
+                "signature": signature,
+                "sizeOriginal": os.path.getsize(path),
+                "$updatedAt": str(os.path.getmtime(path))
+            })
+        return {"total": len(files), "files": files}
+
+    def get_file_view(self, bucket_id: str, file_id: str) -> bytes:
+        """
+        Read the content of a file.
+
+        Args:
+            bucket_id (str): Ignored, the directory acts as a single bucket.
+            file_id (str): The ID of the file.
+
+        Returns:
+            bytes: The content of the file.
+        """
+        with open(self._paths()[file_id], "rb") as file:
+            return file.read()
+
+
+class CatalogueItem:
+    """
+    A catalogue image stored in the local cache and decoded on first access.
+
+    Attributes:
+        fileId (str): The ID of the file in the storage bucket.
+        path (str): The path of the cached file.
+        thumbnailPath (str): The path of the small thumbnail used by the example galleries.
+
+    Methods:
+        image -> Image.Image:
+            The decoded image, loaded on first access.
+    """
+
+    def __init__(self, fileId: str, path: str, thumbnailPath: str):
+        """Initialize the CatalogueItem without decoding the image."""
+        self.fileId = fileId
+        self.path = path
+        self.thumbnailPath = thumbnailPath
+        self._image = None
+        self._lock = threading.Lock()
+
+    @property
+    def image(self) -> Image.Image:
+        """The decoded image, loaded from the cache on first access."""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    image = Image.open(self.path)
+                    image.load()
+                    self._image = image
+        return self._image
+
+    def __repr__(self) -> str:
+        return f"CatalogueItem(fileId = {self.fileId!r})"
+
+
+class CatalogueLoader:
+    """
+    A parallel catalogue fetcher backed by a content-addressed disk cache.
+
+    The storage listing is compared with a manifest of previously downloaded files. Files whose
+    signature, size and update time are unchanged are served from the cache; the others are
+    fetched with a bounded thread pool, verified against their signature and stored under their
+    MD5 digest. A small thumbnail is generated for every file, and the full images are only
+    decoded when they are first accessed.
+
+    Attributes:
+        storage (Any): The Appwrite Storage service or a LocalStorage stand-in.
+        bucketId (str): The ID of the storage bucket.
+        cacheDirectory (str): The directory holding the cached files, thumbnails and manifest.
+        maxWorkers (int): The maximum number of concurrent downloads.
+        thumbnailSize (int): The maximum width and height of the thumbnails.
+
+    Methods:
+        load(nImages: int) -> list[CatalogueItem]:
+            Returns the cached items of the first `nImages` files of the bucket.
+    """
+
+    def __init__(self, storage: Any, bucketId: str, cacheDirectory: str, maxWorkers: int = 8, thumbnailSize: int = 256):
+        """Initialize the CatalogueLoader and create the cache directories."""
+        self.storage = storage
+        self.bucketId = bucketId
+        self.cacheDirectory = cacheDirectory
+        self.maxWorkers = max(int(maxWorkers), 1)
+        self.thumbnailSize = thumbnailSize
+        self._objectDirectory = os.path.join(cacheDirectory, "objects")
+        self._thumbnailDirectory = os.path.join(cacheDirectory, "thumbnails")
+        self._manifestPath = os.path.join(cacheDirectory, "manifest.json")
+        os.makedirs(self._objectDirectory, exist_ok = True)
+        os.makedirs(self._thumbnailDirectory, exist_ok = True)
+
+    def load(self, nImages: int) -> list[CatalogueItem]:
+        """
+        Bring the cache up to date with the bucket and return its items.
+
+        Args:
+            nImages (int): The maximum number of files to retrieve from the bucket.
+
+        Returns:
+            list[CatalogueItem]: The cached items, in listing order. Files that cannot be fetched,
+                verified or decoded are logged and left out.
+        """
+        listing = self.storage.list_files(bucket_id = self.bucketId, queries = [Query.limit(nImages)])
+        files = listing["files"][:nImages]
+        manifest = self._readManifest()
+
+        def fetch(file: dict) -> tuple[str, dict]:
+            try:
+                return fetchFile(file)
+            except Exception as e:
+                metrics.recordError("catalogueLoader", e)
+                logger.error(CustomException(e))
+                return file["$id"], None
+
+        def fetchFile(file: dict) -> tuple[str, dict]:
+            metadata = {
+                "signature": file.get("signature"),
+                "sizeOriginal": file.get("sizeOriginal"),
+                "updatedAt": file.get("$updatedAt")
+            }
+            cached = manifest.get(file["$id"])
+            if cached is not None and all(cached.get(x) == y for x, y in metadata.items()) \
+                    and os.path.exists(self._objectPath(cached["digest"])):
+                digest = cached["digest"]
+            else:
+                logger.info(f"fetching catalogue file {file['$id']}")
+                content = self.storage.get_file_view(bucket_id = self.bucketId, file_id = file["$id"])
+                digest = hashlib.md5(content).hexdigest()
+                if metadata["signature"] and metadata["signature"] != digest:
+                    raise ValueError(f"signature mismatch for catalogue file {file['$id']}")
+                self._writeAtomically(self._objectPath(digest), content)
+
+            if not os.path.exists(self._thumbnailPath(digest)):
+                with Image.open(self._objectPath(digest)) as image:
+                    if image.mode not in ("RGB", "RGBA", "L"):
+                        image = image.convert("RGBA")
+                    image.thumbnail((self.thumbnailSize, self.thumbnailSize))
+                    buffer = BytesIO()
+                    image.save(buffer, format = "PNG")
+                self._writeAtomically(self._thumbnailPath(digest), buffer.getvalue())
+            return file["$id"], {**metadata, "digest": digest}
+
+        with ThreadPoolExecutor(max_workers = self.maxWorkers) as executor:
+            entries = {x: y for x, y in executor.map(fetch, files) if y is not None}
+        files = [x for x in files if x["$id"] in entries]
+
+        self._writeAtomically(self._manifestPath, json.dumps(entries, indent = 2).encode())
+        return [
+            CatalogueItem(
+                fileId = x["$id"],
+                path = self._objectPath(entries[x["$id"]]["digest"]),
+                thumbnailPath = self._thumbnailPath(entries[x["$id"]]["digest"])
+            ) for x in files
+        ]
+
+    def _objectPath(self, digest: str) -> str:
+        return os.path.join(self._objectDirectory, digest)
+
+    def _thumbnailPath(self, digest: str) -> str:
+        return os.path.join(self._thumbnailDirectory, f"{digest}.png")
+
+    def _readManifest(self) -> dict:
+        if not os.path.exists(self._manifestPath):
+            return {}
+        try:
+            with open(self._manifestPath, "r") as file:
+                return json.load(file)
+        except ValueError:
+            logger.warning("discarding unreadable catalogue manifest")
+            return {}
+
+    def _writeAtomically(self, path: str, content: bytes) -> None:
+        temporaryPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporaryPath, "wb") as file:
+            file.write(content)
+        os.replace(temporaryPath, path)
\ No newline at end of file
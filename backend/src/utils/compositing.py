@@ -0,0 +1,121 @@
+import numpy as np
+import cv2
+
+def getVisibleRegion(shape: tuple[int, ...], spriteShape: tuple[int, ...], position: tuple[int, int]) -> tuple[tuple[slice, slice], tuple[slice, slice]]:
+    """
+    Clip a sprite placed at `position` to the bounds of an image.
+
+    Args:
+        shape (tuple[int, ...]): The shape of the image.
+        spriteShape (tuple[int, ...]): The shape of the sprite.
+        position (tuple[int, int]): The (x, y) coordinates of the top-left corner of the sprite.
+
+    Returns:
+        tuple[tuple[slice, slice], tuple[slice, slice]]: The (rows, columns) slices of the visible
+            region in the image and in the sprite, or None if the sprite lies outside the image.
+    """
+    x, y = position
+    x1, y1 = max(x, 0), max(y, 0)
+    x2 = min(x + spriteShape[1], shape[1])
+    y2 = min(y + spriteShape[0], shape[0])
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (slice(y1, y2), slice(x1, x2)), (slice(y1 - y, y2 - y), slice(x1 - x, x2 - x))
+
+
+def blendRegion(region: np.ndarray, sprite: np.ndarray) -> None:
+    """
+    Blend a premultiplied RGBA sprite over a uint8 region of the same size in place.
+
+    The blend is computed in 16-bit integers as `sprite + region * (255 - alpha) / 255`, with
+    rounding, so no floating-point copy of the region is ever made.
+
+    Args:
+        region (np.ndarray): The uint8 RGB region of the image to draw onto.
+        sprite (np.ndarray): The premultiplied RGBA sprite, clipped to the region.
+    """
+    inverseAlpha = 255 - sprite[:, :, 3:4].astype(np.uint16)
+    background = region.astype(np.uint16)
+    background *= inverseAlpha
+    background += 127
+    background //= 255
+    background += sprite[:, :, :3]
+    np.minimum(background, 255, out = background)
+    region[:] = background
+
+
+def overlayPremultiplied(background: np.ndarray, sprite: np.ndarray, position: tuple[int, int]) -> np.ndarray:
+    """
+    Overlay a premultiplied RGBA sprite onto an image in place.
+
+    Only the bounding box of the sprite is touched. Positions that are negative or push the
+    sprite past the edges of the image are handled by clipping the sprite to the visible region.
+
+    Args:
+        background (np.ndarray): The uint8 image to draw onto, with three or more channels.
+        sprite (np.ndarray): The premultiplied RGBA sprite.
+        position (tuple[int, int]): The (x, y) coordinates of the top-left corner of the sprite.
+
+    Returns:
+        np.ndarray: The background image with the sprite composited onto it.
+    """
+    visible = getVisibleRegion(background.shape, sprite.shape, position)
+    if visible is None:
+        return background
+    (rows, columns), (spriteRows, spriteColumns) = visible
+    blendRegion(background[rows, columns, :3], sprite[spriteRows, spriteColumns])
+    return background
+
+
+def compositeWithMask(image: np.ndarray, sprite: np.ndarray, position: tuple[int, int], threshold: int = 5) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Overlay a premultiplied RGBA sprite onto an image in place and build its binary mask in the same pass.
+
+    A pixel belongs to the mask when the luminance of the premultiplied sprite colour is above
+    `threshold`, which is what compositing the sprite onto a black frame and thresholding it
+    gives, without allocating that frame. Only the bounding box of the sprite is processed.
+
+    Args:
+        image (np.ndarray): The uint8 image to draw onto, with three or more channels.
+        sprite (np.ndarray): The premultiplied RGBA sprite.
+        position (tuple[int, int]): The (x, y) coordinates of the top-left corner of the sprite.
+        threshold (int, optional): The luminance above which a sprite pixel is part of the mask. Defaults to 5.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The image with the sprite composited onto it, and the
+            uint8 mask of the same height and width, 255 on the necklace and 0 elsewhere.
+    """
+    mask = np.zeros(image.shape[:2], dtype = np.uint8)
+    visible = getVisibleRegion(image.shape, sprite.shape, position)
+    if visible is None:
+        return image, mask
+    (rows, columns), (spriteRows, spriteColumns) = visible
+    sprite = sprite[spriteRows, spriteColumns]
+
+    # the sprite colours are RGB but converted as BGR, as the original mask was built
+    luminance = cv2.cvtColor(np.ascontiguousarray(sprite[:, :, :3]), cv2.COLOR_BGR2GRAY)
+    _, mask[rows, columns] = cv2.threshold(luminance, threshold, 255, cv2.THRESH_BINARY)
+    blendRegion(image[rows, columns, :3], sprite)
+    return image, mask
+
+def makeContactSheet(variants: np.ndarray, columns: int) -> np.ndarray:
+    """
+    Tile a stack of equally sized images into a single contact sheet.
+
+    The tiling is a single reshape of the stack, so no image is copied one by one.
+    Empty slots in the last row are left black.
+
+    Args:
+        variants (np.ndarray): The (n, height, width, channels) stack of images.
+        columns (int): The number of tiles per row.
+
+    Returns:
+        np.ndarray: The (rows * height, columns * width, channels) contact sheet.
+    """
+    count, height, width, channels = variants.shape
+    columns = max(min(columns, count), 1)
+    rows = -(-count // columns)
+    if rows * columns > count:
+        padding = np.zeros((rows * columns - count, height, width, channels), dtype = variants.dtype)
+        variants = np.concatenate([variants, padding])
+    return variants.reshape(rows, columns, height, width, channels).transpose(0, 2, 1, 3, 4).reshape(rows * height, columns * width, channels)
\ No newline at end of file
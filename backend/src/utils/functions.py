@@ -1,24 +1,42 @@
 from appwrite.services.storage import Storage
 from appwrite.client import Client
-from appwrite.query import Query
+from src.utils.catalogue import CatalogueLoader, CatalogueItem, LocalStorage
 import os
+import hashlib
 import configparser
-from io import BytesIO
+import numpy as np
 from PIL import Image
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def getImages(nImages: int) -> dict[str, list[Image.Image]]:
+SHORT_NECKLACE_IDS = [
+    "68e63579002d0fd0557a",
+    "68e63bea000ce6ebaaee",
+    "68e63e64002f6e34b0ad"
+]
+
+LONG_NECKLACE_IDS = [
+    "68e63c940013989934a8",
+    "68e62eac0009909b9a32",
+    "68e689b10013a68c5ec1",
+    "68e690a4002036c35eb1"
+]
+
+def getStorage():
     """
-    Retrieves images from the configured Appwrite S3 bucket.
+    Create the storage service the catalogue is read from.
 
-    Args:
-        nImages (int): The maximum number of images to retrieve from the bucket.
+    If the CATALOGUE_LOCAL_DIR environment variable is set, a filesystem-backed stand-in 
+    serving that directory is returned, which allows running the catalogue offline. 
+    Otherwise the configured Appwrite bucket is used.
 
     Returns:
-        dict[str, list[Image.Image]]: A dictionary where each key is a category (str) and each value is a list of PIL images (list[Image.Image]) belonging to that category.
+        Storage | LocalStorage: The storage service.
     """
+    if os.environ.get("CATALOGUE_LOCAL_DIR"):
+        return LocalStorage(root = os.environ["CATALOGUE_LOCAL_DIR"])
+
     # configuring the appwrite client
     client = Client()
     (client
@@ -28,47 +46,52 @@ def getImages(nImages: int) -> dict[str, list[Image.Image]]:
     .set_self_signed()
     .set_session("")
     )
+    return Storage(client)
 
-    # retrieving names of all files from the storage bucket
-    storage = Storage(client)
-    allFiles = storage.list_files(bucket_id = os.environ["APPWRITE_BUCKET_ID"], queries = [Query.limit(nImages)])
-    allFiles = [file["$id"] for file in allFiles["files"]]
-
-    shortNecklaceIDs = [
-        "68e63579002d0fd0557a",
-        "68e63bea000ce6ebaaee",
-        "68e63e64002f6e34b0ad"
-    ]
-
-    longNecklaceIDs = [
-        "68e63c940013989934a8",
-        "68e62eac0009909b9a32",
-        "68e689b10013a68c5ec1",
-        "68e690a4002036c35eb1"
-    ]
-        
-    extractedData = {
-        "chokers": [x for x in allFiles if x.startswith("CH")],
-        "shortNecklaces": [x for x in allFiles if x in shortNecklaceIDs],
-        "longNecklaces": [x for x in allFiles if x in longNecklaceIDs],
-        "models": [x for x in allFiles if x.startswith("MD")]
-    }
-    
-    # getting PIL images out of the files
-    extractedData = {
-        x: [
-            Image.open(
-                BytesIO(
-                    storage.get_file_view(
-                        bucket_id = os.environ["APPWRITE_BUCKET_ID"],
-                        file_id = y
-                    )
-                )
-            ) for y in extractedData[x]
-        ] for x in extractedData
+
+def getCatalogue(nImages: int) -> dict[str, list[CatalogueItem]]:
+    """
+    Retrieves the catalogue from the configured storage bucket through the local disk cache.
+
+    Files are fetched in parallel and only when they changed since the last run. The images 
+    are decoded lazily the first time they are accessed.
+
+    Args:
+        nImages (int): The maximum number of images to retrieve from the bucket.
+
+    Returns:
+        dict[str, list[CatalogueItem]]: A dictionary where each key is a category (str) and each value is a list of catalogue items belonging to that category.
+    """
+    config = getConfig("config.ini")
+    loader = CatalogueLoader(
+        storage = getStorage(),
+        bucketId = os.environ.get("APPWRITE_BUCKET_ID", "catalogue"),
+        cacheDirectory = config.get("CATALOGUE", "cacheDirectory", fallback = "artifacts/catalogue"),
+        maxWorkers = config.getint("CATALOGUE", "maxWorkers", fallback = 8),
+        thumbnailSize = config.getint("CATALOGUE", "thumbnailSize", fallback = 256)
+    )
+    allFiles = loader.load(nImages = nImages)
+
+    return {
+        "chokers": [x for x in allFiles if x.fileId.startswith("CH")],
+        "shortNecklaces": [x for x in allFiles if x.fileId in SHORT_NECKLACE_IDS],
+        "longNecklaces": [x for x in allFiles if x.fileId in LONG_NECKLACE_IDS],
+        "models": [x for x in allFiles if x.fileId.startswith("MD")]
     }
 
-    return extractedData
+
+def getImages(nImages: int) -> dict[str, list[Image.Image]]:
+    """
+    Retrieves images from the configured Appwrite S3 bucket.
+
+    Args:
+        nImages (int): The maximum number of images to retrieve from the bucket.
+
+    Returns:
+        dict[str, list[Image.Image]]: A dictionary where each key is a category (str) and each value is a list of PIL images (list[Image.Image]) belonging to that category.
+    """
+    catalogue = getCatalogue(nImages = nImages)
+    return {x: [y.image for y in catalogue[x]] for x in catalogue}
 
 
 
@@ -84,4 +107,38 @@ def getConfig(path: str):
     """
     config = configparser.ConfigParser()
     config.read(path)
-    return config
\ No newline at end of file
+    return config
+
+
+def getColours(config: configparser.ConfigParser) -> list[str]:
+    """
+    Read the list of saree colours to generate from the configuration.
+
+    Args:
+        config (ConfigParser): The loaded configuration object.
+
+    Returns:
+        list[str]: The configured colours, in order.
+    """
+    colours = config.get("CLOTHING TRY ON", "colours", fallback = "Red, Blue, Green")
+    return [x.strip() for x in colours.split(",") if x.strip()]
+
+
+def getImageHash(image: np.ndarray) -> str:
+    """
+    Compute a content hash of an image array.
+
+    The hash covers the pixel data as well as the shape and dtype of the array, so 
+    two images only share a hash when they are identical pixel for pixel.
+
+    Args:
+        image (np.ndarray): The image to hash.
+
+    Returns:
+        str: The hexadecimal BLAKE2b digest of the image.
+    """
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(digest_size = 16)
+    digest.update(str((image.shape, image.dtype.str)).encode())
+    digest.update(image.data)
+    return digest.hexdigest()
\ No newline at end of file
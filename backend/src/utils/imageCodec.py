@@ -0,0 +1,60 @@
+from src.utils.ingest import getProxy
+import numpy as np
+import cv2
+
+MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+QUALITY_FLAGS = {"jpeg": cv2.IMWRITE_JPEG_QUALITY, "webp": cv2.IMWRITE_WEBP_QUALITY}
+
+def decodeImage(data: bytes, alpha: bool = False) -> np.ndarray:
+    """
+    Decode a JPEG, WebP or PNG body straight into an RGB or RGBA array.
+
+    Args:
+        data (bytes): The encoded image.
+        alpha (bool, optional): Whether to keep or add an alpha channel, as needed for necklaces. Defaults to False.
+
+    Returns:
+        np.ndarray: The decoded RGB image, or RGBA image if `alpha` is set.
+
+    Raises:
+        ValueError: If the body is empty or not a supported image.
+    """
+    buffer = np.frombuffer(data, dtype = np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED if alpha else cv2.IMREAD_COLOR) if buffer.size else None
+    if image is None:
+        raise ValueError("the request body is not a JPEG, WebP or PNG image")
+
+    if image.dtype != np.uint8:
+        image = (image >> 8).astype(np.uint8)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGBA if alpha else cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGBA if alpha else cv2.COLOR_BGR2RGB)
+
+
+def encodeImage(image: np.ndarray, format: str = "jpeg", quality: int = 85, maxSide: int = 0) -> bytes:
+    """
+    Encode an RGB array as the body of a response.
+
+    Args:
+        image (np.ndarray): The RGB image.
+        format (str, optional): One of "jpeg", "webp" or "png". Defaults to "jpeg".
+        quality (int, optional): The JPEG or WebP quality from 1 to 100, ignored for PNG. Defaults to 85.
+        maxSide (int, optional): The maximum length of the longer side, the image is downscaled
+            before encoding if it is larger. Defaults to 0, which keeps the size.
+
+    Returns:
+        bytes: The encoded image.
+
+    Raises:
+        ValueError: If the format is not supported or the image cannot be encoded.
+    """
+    if format not in MEDIA_TYPES:
+        raise ValueError(f"unsupported output format: {format}")
+    image, _ = getProxy(image, maxSide)
+    parameters = [QUALITY_FLAGS[format], int(quality)] if format in QUALITY_FLAGS else []
+    success, buffer = cv2.imencode(f".{format}", cv2.cvtColor(image, cv2.COLOR_RGB2BGR), parameters)
+    if not success:
+        raise ValueError(f"the image could not be encoded as {format}")
+    return buffer.tobytes()
\ No newline at end of file
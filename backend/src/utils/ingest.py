@@ -0,0 +1,87 @@
+from configparser import ConfigParser
+from PIL import Image
+import numpy as np
+import cv2
+
+def getMaxSide(config: ConfigParser) -> int:
+    """
+    Read the working resolution of the try-on components from the configuration.
+
+    Args:
+        config (ConfigParser): The loaded configuration object.
+
+    Returns:
+        int: The maximum longer side of the working images, 0 if the original resolution is kept.
+    """
+    if config.getboolean("INGEST", "keepOriginalResolution", fallback = False):
+        return 0
+    return config.getint("INGEST", "maxSide", fallback = 0)
+
+
+def ingestImage(image: Image.Image | np.ndarray, maxSide: int = 0) -> np.ndarray:
+    """
+    Convert an uploaded image to the RGB array the try-on components work on.
+
+    Phone photos can be far larger than anything the try-on needs, so images whose longer
+    side exceeds `maxSide` are downscaled before they are converted, and every later step
+    works on the smaller copy. Arrays that were already decoded, such as the bodies of the
+    HTTP API, are resized directly without going through PIL. The caller's array is never
+    returned, since the try-on components draw on the returned image in place.
+
+    Args:
+        image (Image.Image | np.ndarray): The uploaded image, or an RGB array.
+        maxSide (int, optional): The maximum length of the longer side in pixels. Defaults to 0,
+            which keeps the original resolution.
+
+    Returns:
+        np.ndarray: The writable RGB image at working resolution.
+    """
+    if isinstance(image, np.ndarray):
+        proxy, _ = getProxy(image, maxSide)
+        return proxy.copy() if proxy is image else proxy
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width, height = image.size
+    if maxSide and max(width, height) > maxSide:
+        scale = maxSide / max(width, height)
+        image = image.resize(
+            (max(round(width * scale), 1), max(round(height * scale), 1)),
+            Image.BILINEAR, reducing_gap = 2.0
+        )
+    return np.array(image)
+
+
+def getImageSize(image: Image.Image | np.ndarray) -> tuple[int, int]:
+    """
+    Read the size of an uploaded image without converting it.
+
+    Args:
+        image (Image.Image | np.ndarray): The uploaded image, or an RGB array.
+
+    Returns:
+        tuple[int, int]: The (width, height) of the image.
+    """
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def getProxy(image: np.ndarray, maxSide: int) -> tuple[np.ndarray, float]:
+    """
+    Downscale an image to a proxy for analysis steps that do not need full resolution.
+
+    Args:
+        image (np.ndarray): The image to downscale.
+        maxSide (int): The maximum length of the longer side of the proxy, 0 to use the image as is.
+
+    Returns:
+        tuple[np.ndarray, float]: The proxy and its scale relative to the image, so that a proxy
+            coordinate divided by the scale is the matching image coordinate.
+    """
+    height, width = image.shape[:2]
+    if not maxSide or max(width, height) <= maxSide:
+        return image, 1.0
+    scale = maxSide / max(width, height)
+    size = (max(round(width * scale), 1), max(round(height * scale), 1))
+    return cv2.resize(image, size, interpolation = cv2.INTER_AREA), scale
\ No newline at end of file
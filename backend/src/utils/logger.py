@@ -1,13 +1,16 @@
+from logging.handlers import QueueHandler, QueueListener
 import logging
+import atexit
+import queue
 import os
 
 # Create a logger instance
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)  
+logger.setLevel(logging.DEBUG)
 
 # Define the directory for log files
 LOG_DIR = os.path.join(os.getcwd(), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)  
+os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "runningLogs.log")
 
 # Initialize stream handler and file handler for console output
@@ -15,14 +18,42 @@ streamHandler = logging.StreamHandler()
 fileHandler = logging.FileHandler(LOG_FILE)
 
 # Set the logging level for each handler
-streamHandler.setLevel(logging.INFO)  
-fileHandler.setLevel(logging.DEBUG)    
+streamHandler.setLevel(logging.INFO)
+fileHandler.setLevel(logging.DEBUG)
 
 # Configure the logging format for both handlers
 logFormatter = logging.Formatter("[%(asctime)s: %(levelname)s: %(module)s: %(message)s]")
-streamHandler.setFormatter(logFormatter)  
-fileHandler.setFormatter(logFormatter)    
+streamHandler.setFormatter(logFormatter)
+fileHandler.setFormatter(logFormatter)
 
-# Add the configured handlers to the logger
-logger.addHandler(streamHandler)
-logger.addHandler(fileHandler)
\ No newline at end of file
+# Hand records to a queue so request threads never wait on the console or the log file,
+# a background listener thread writes them to the configured handlers
+logQueue = queue.SimpleQueue()
+queueListener = QueueListener(logQueue, streamHandler, fileHandler, respect_handler_level=True)
+queueListener.start()
+queueHandler = QueueHandler(logQueue)
+
+def stopLogger():
+    """
+    Stop the listener thread after it has written every queued record.
+    """
+    queueListener.stop()
+
+def restartLoggerAfterFork():
+    """
+    Give a forked process its own log queue and listener thread.
+
+    Only the forking thread survives a fork, so the listener inherited from the parent is gone
+    and records put on the inherited queue would pile up without ever being written.
+    """
+    global logQueue, queueListener
+    logQueue = queue.SimpleQueue()
+    queueListener = QueueListener(logQueue, streamHandler, fileHandler, respect_handler_level=True)
+    queueListener.start()
+    queueHandler.queue = logQueue
+
+atexit.register(stopLogger)
+os.register_at_fork(after_in_child=restartLoggerAfterFork)
+
+# Add the queue handler to the logger
+logger.addHandler(queueHandler)
\ No newline at end of file
@@ -0,0 +1,267 @@
+from src.utils.logger import logger
+from contextlib import contextmanager
+from typing import Iterator
+import contextvars
+import threading
+import bisect
+import time
+import uuid
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class Histogram:
+    """
+    A cumulative latency histogram in the Prometheus format.
+
+    Attributes:
+        buckets (tuple[float]): The upper bounds of the buckets in seconds.
+        counts (list[int]): The number of observations per bucket, the last one counting values above every bound.
+        total (float): The sum of every observation.
+        count (int): The number of observations.
+    """
+
+    def __init__(self, buckets: tuple[float] = DEFAULT_BUCKETS):
+        """Initialize an empty Histogram with the given bucket bounds."""
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add an observation to the histogram."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    A thread-safe registry of latency histograms, counters and gauges.
+
+    Metrics are identified by their name and labels and rendered in the Prometheus text
+    exposition format, so they can be scraped from the metrics endpoint without an extra
+    client library.
+
+    Methods:
+        observe(name: str, value: float, **labels) -> None:
+            Adds a latency observation in seconds to a histogram.
+
+        increment(name: str, amount: float = 1, **labels) -> None:
+            Increases a counter.
+
+        setGauge(name: str, value: float, **labels) -> None:
+            Sets the current value of a gauge.
+
+        recordError(component: str, error: Exception) -> None:
+            Counts an error raised by a component.
+
+        drain(exclude: tuple[str] = ()) -> dict[str, dict]:
+            Takes the metrics recorded since the last drain, such as those of a worker process.
+
+        merge(snapshot: dict[str, dict], **labels) -> None:
+            Adds the metrics drained from another registry.
+
+        render() -> str:
+            Returns every metric in the Prometheus text format.
+    """
+
+    def __init__(self, buckets: tuple[float] = DEFAULT_BUCKETS):
+        """Initialize an empty MetricsRegistry."""
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Add a latency observation to a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            value (float): The observed latency in seconds.
+            **labels: The labels of the series.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        """
+        Increase a counter.
+
+        Args:
+            name (str): The name of the counter.
+            amount (float, optional): The amount to add. Defaults to 1.
+            **labels: The labels of the series.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def setGauge(self, name: str, value: float, **labels) -> None:
+        """
+        Set the current value of a gauge.
+
+        Args:
+            name (str): The name of the gauge.
+            value (float): The current value.
+            **labels: The labels of the series.
+        """
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def recordError(self, component: str, error: Exception) -> None:
+        """
+        Count an error raised by a component, labelled with its exception type.
+
+        Args:
+            component (str): The component the error was raised in.
+            error (Exception): The error.
+        """
+        self.increment("gemfit_errors_total", component = component, type = type(error).__name__)
+
+    def drain(self, exclude: tuple[str] = ()) -> dict[str, dict]:
+        """
+        Take the metrics recorded since the last drain and reset the counters and histograms.
+
+        Args:
+            exclude (tuple[str], optional): The names of the metrics to leave out, which are reset all the same. 
+                Defaults to ().
+
+        Returns:
+            dict[str, dict]: The "histograms", "counters" and "gauges" by name and labels, picklable 
+                so they can be sent to another process.
+        """
+        with self._lock:
+            snapshot = {"histograms": self._histograms, "counters": self._counters, "gauges": dict(self._gauges)}
+            self._histograms, self._counters = {}, {}
+        return {
+            kind: {x: y for x, y in series.items() if x[0] not in exclude} for kind, series in snapshot.items()
+        }
+
+    def merge(self, snapshot: dict[str, dict], **labels) -> None:
+        """
+        Add the metrics drained from another registry to this one.
+
+        Counters and histograms are added to the series of the same name and labels. Gauges hold the 
+        current value of their process, so they are set with the extra labels instead.
+
+        Args:
+            snapshot (dict[str, dict]): The metrics returned by `drain`.
+            **labels: The labels identifying the source of the gauges, such as the worker.
+        """
+        with self._lock:
+            for key, histogram in snapshot["histograms"].items():
+                target = self._histograms.get(key)
+                if target is None:
+                    target = self._histograms[key] = Histogram(histogram.buckets)
+                target.counts = [x + y for x, y in zip(target.counts, histogram.counts)]
+                target.total += histogram.total
+                target.count += histogram.count
+            for key, value in snapshot["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for (name, seriesLabels), value in snapshot["gauges"].items():
+                self._gauges[(name, tuple(sorted(seriesLabels + tuple(labels.items()))))] = value
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        lines = []
+        with self._lock:
+            for metricType, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({x[0] for x in series}):
+                    lines.append(f"# TYPE {name} {metricType}")
+                    for (seriesName, labels), value in sorted(series.items()):
+                        if seriesName == name:
+                            lines.append(f"{name}{formatLabels(labels)} {value}")
+
+            for name in sorted({x[0] for x in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (seriesName, labels), histogram in sorted(self._histograms.items(), key = lambda x: x[0]):
+                    if seriesName != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{formatLabels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{formatLabels(labels)} {histogram.total}")
+                    lines.append(f"{name}_count{formatLabels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def formatLabels(labels: tuple[tuple[str, str]]) -> str:
+    """Format the labels of a series, escaping their values."""
+    if not labels:
+        return ""
+    escaped = [
+        (x, str(y).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for x, y in labels
+    ]
+    return "{" + ",".join(f"{x}=\"{y}\"" for x, y in escaped) + "}"
+
+
+# the registry shared by every component and scraped by the metrics endpoint
+metrics = MetricsRegistry()
+
+# the request whose stages are currently being timed on this thread or task
+currentRequest = contextvars.ContextVar("currentRequest", default = None)
+
+@contextmanager
+def requestSpan(endpoint: str) -> Iterator[str]:
+    """
+    Time a whole request and collect the spans of its stages.
+
+    When the request finishes, its total latency is added to the `gemfit_request_seconds`
+    histogram and a single structured line with the duration of every stage is logged.
+
+    Args:
+        endpoint (str): The name of the endpoint handling the request.
+
+    Yields:
+        str: The ID of the request.
+    """
+    requestId = uuid.uuid4().hex[:12]
+    spans = []
+    # streaming generators may be resumed in a different context than they started in,
+    # so the previous value is restored explicitly instead of through a reset token
+    previous = currentRequest.get()
+    currentRequest.set({"requestId": requestId, "spans": spans})
+    started = time.perf_counter()
+    try:
+        yield requestId
+    finally:
+        elapsed = time.perf_counter() - started
+        currentRequest.set(previous)
+        metrics.observe("gemfit_request_seconds", elapsed, endpoint = endpoint)
+        stages = " ".join(f"{x}={y * 1000:.1f}ms" for x, y in spans)
+        logger.info(f"request={requestId} endpoint={endpoint} total={elapsed * 1000:.1f}ms {stages}".rstrip())
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a stage of the try-on pipeline.
+
+    The latency is added to the `gemfit_stage_seconds` histogram and, inside a request,
+    to the spans reported when the request finishes.
+
+    Args:
+        stage (str): The name of the stage, such as "landmarks" or "diffusion".
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("gemfit_stage_seconds", elapsed, stage = stage)
+        request = currentRequest.get()
+        if request is not None:
+            request["spans"].append((stage, elapsed))
\ No newline at end of file
@@ -0,0 +1,120 @@
+from PIL import Image, ImageColor
+import numpy as np
+import cv2
+
+def getColourTarget(colour: str) -> np.ndarray:
+    """
+    Convert a colour name, such as a configured saree colour, to CIELAB.
+
+    Args:
+        colour (str): A CSS colour name or hex code, case and spaces are ignored.
+
+    Returns:
+        np.ndarray: The (L, a, b) coordinates of the colour.
+
+    Raises:
+        ValueError: If the colour name is not known.
+    """
+    rgb = ImageColor.getrgb(colour.strip().lower().replace(" ", ""))[:3]
+    return cv2.cvtColor(np.array([[rgb]], dtype = np.float32) / 255, cv2.COLOR_RGB2Lab)[0, 0]
+
+
+def getHueDistance(hue: np.ndarray, reference: float) -> np.ndarray:
+    """Return the absolute angle between hues in radians, wrapped to [0, pi]."""
+    return np.abs((hue - reference + np.pi) % (2 * np.pi) - np.pi)
+
+
+def segmentGarment(lab: np.ndarray, region: np.ndarray, hue: float, minSaturation: float, tolerance: float) -> np.ndarray:
+    """
+    Estimate how much every pixel of the inpainted region belongs to the generated garment.
+
+    A pixel belongs to the garment when its hue is close to the colour the garment was
+    generated in and its saturation, the chroma relative to the lightness, is high enough,
+    which leaves out skin, hair and the background inside the region while keeping the
+    shaded folds of the garment. Both conditions are soft, so the recoloured garment fades
+    into its surroundings instead of showing a hard edge.
+
+    Args:
+        lab (np.ndarray): The float32 CIELAB image.
+        region (np.ndarray): The boolean inpainting mask.
+        hue (float): The hue angle of the garment colour in the a*b* plane.
+        minSaturation (float): The saturation at which the weight reaches 1, it is 0 below half of it.
+        tolerance (float): The hue distance in radians at which the weight reaches 0, it is 1 below half of it.
+
+    Returns:
+        np.ndarray: The float32 weight of every pixel, from 0 to 1.
+    """
+    L, a, b = lab[:, :, 0], lab[:, :, 1], lab[:, :, 2]
+    hueWeight = np.clip((tolerance - getHueDistance(np.arctan2(b, a), hue)) / (tolerance / 2), 0, 1)
+    saturationWeight = np.clip((np.hypot(a, b) / np.maximum(L, 1) - minSaturation / 2) / (minSaturation / 2), 0, 1)
+    weight = (hueWeight * saturationWeight * region).astype(np.float32)
+    return cv2.GaussianBlur(weight, (0, 0), sigmaX = 1)
+
+
+def recolourVariants(
+    image: Image.Image,
+    mask: Image.Image,
+    source: str,
+    targets: list[str],
+    lightnessTransfer: float = 0.5,
+    minCoverage: float = 0.05
+) -> list[Image.Image]:
+    """
+    Derive colour variants of a generated garment by moving its colour in CIELAB.
+
+    The lightness channel, which carries the shading, folds and texture, is kept and only
+    shifted towards the target colour, while the a*b* chroma of every garment pixel is
+    rotated to the target hue and scaled to the target saturation. All variants are
+    computed at once on a stacked array and converted back in a single call.
+
+    Args:
+        image (Image.Image): The generated image, in the source colour.
+        mask (Image.Image): The inpainting mask of the image.
+        source (str): The colour the image was generated in.
+        targets (list[str]): The colours to derive.
+        lightnessTransfer (float, optional): The fraction of the lightness difference between the
+            colours applied to the garment. Defaults to 0.5.
+        minCoverage (float, optional): The fraction of the mask the garment must cover. Defaults to 0.05.
+
+    Returns:
+        list[Image.Image]: One image per target colour, or None if no garment in the source colour
+            was found inside the mask, for example when the source colour is grey.
+
+    Raises:
+        ValueError: If a colour name is not known.
+    """
+    lab = cv2.cvtColor(np.asarray(image.convert("RGB"), dtype = np.float32) / 255, cv2.COLOR_RGB2Lab)
+    region = np.asarray(mask.convert("L").resize(image.size, Image.NEAREST)) > 127
+    sourceLab = getColourTarget(source)
+    weight = segmentGarment(lab, region, np.arctan2(sourceLab[2], sourceLab[1]), minSaturation = 0.3, tolerance = np.pi / 4)
+    if not region.any() or weight.sum() < minCoverage * region.sum():
+        return None
+
+    # measuring the colour that was actually generated rather than the nominal one,
+    # then segmenting the garment again more tightly around it
+    referenceL, referenceA, referenceB = np.median(lab[weight > 0.5], axis = 0)
+    referenceChroma = max(float(np.hypot(referenceA, referenceB)), 1e-3)
+    weight = segmentGarment(
+        lab, region, np.arctan2(referenceB, referenceA),
+        minSaturation = 0.5 * referenceChroma / max(float(referenceL), 1), tolerance = np.pi / 6
+    )
+
+    targetLab = np.stack([getColourTarget(x) for x in targets])
+    rotation = np.arctan2(targetLab[:, 2], targetLab[:, 1]) - np.arctan2(referenceB, referenceA)
+    gain = np.clip(np.hypot(targetLab[:, 1], targetLab[:, 2]) / referenceChroma, 0.25, 4)
+    cosine = (np.cos(rotation) * gain)[:, None, None]
+    sine = (np.sin(rotation) * gain)[:, None, None]
+
+    L, a, b = lab[None, :, :, 0], lab[None, :, :, 1], lab[None, :, :, 2]
+    recoloured = np.stack([
+        L + (lightnessTransfer * (targetLab[:, 0] - referenceL))[:, None, None],
+        a * cosine - b * sine,
+        a * sine + b * cosine
+    ], axis = -1)
+    alpha = weight[None, :, :, None]
+    variants = (lab[None] * (1 - alpha) + recoloured * alpha).astype(np.float32)
+
+    height, width = region.shape
+    rgb = cv2.cvtColor(variants.reshape(len(targets) * height, width, 3), cv2.COLOR_Lab2RGB)
+    rgb = (np.clip(rgb, 0, 1) * 255 + 0.5).astype(np.uint8).reshape(len(targets), height, width, 3)
+    return [Image.fromarray(x) for x in rgb]
\ No newline at end of file
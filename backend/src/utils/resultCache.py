@@ -0,0 +1,336 @@
+from src.utils.imageCodec import decodeImage, encodeImage
+from src.utils.functions import getImageHash
+from src.utils.exceptions import CustomException
+from src.utils.cache import LRUCache
+from src.utils.metrics import metrics
+from src.utils.logger import logger
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from collections import OrderedDict
+from PIL import Image
+import numpy as np
+import threading
+import hashlib
+import shutil
+import json
+import os
+
+# bump when the rendering code changes in a way that makes stored results stale
+FORMAT_VERSION = 1
+
+# the configuration sections each kind of result depends on
+FINGERPRINT_SECTIONS = {
+    "necklace": ["NECKLACE TRY ON", "POSE LANDMARKS", "CATALOGUE INDEX", "INGEST"],
+    "clothing": ["CLOTHING TRY ON", "NECKLACE TRY ON", "POSE LANDMARKS", "CATALOGUE INDEX", "INGEST", "SHARED PREFIX", "CPU PROFILE"]
+}
+
+def getConfigFingerprint(config: ConfigParser, sections: list[str]) -> str:
+    """
+    Hash the settings a result depends on, so results are invalidated when any of them change.
+
+    Args:
+        config (ConfigParser): The loaded configuration object.
+        sections (list[str]): The configuration sections to hash.
+
+    Returns:
+        str: A short hexadecimal digest of the sections and the result format version.
+    """
+    values = {x: dict(config.items(x)) if config.has_section(x) else {} for x in sections}
+    payload = json.dumps([FORMAT_VERSION, values], sort_keys = True)
+    return hashlib.blake2b(payload.encode(), digest_size = 8).hexdigest()
+
+
+class ResultCache:
+    """
+    A content-addressed, two-tier cache of finished try-on results.
+
+    Results are keyed by the hashes of the user's image and the necklace, and by the request
+    options. Everything else a result depends on, such as the colours, seed and model ID of
+    the clothing try-on, is part of a configuration fingerprint. Results of each fingerprint
+    are stored in their own directory and the directories of other fingerprints are deleted
+    at startup, so changing the configuration or the model invalidates every stale result.
+
+    Recent results are kept in memory. All results are also written to disk as PNG images,
+    where the least recently used ones are evicted once `maxDiskSize` is exceeded, so the
+    cache survives restarts. Encoding and writing a result takes longer than most necklace
+    try-ons, so it runs on a background writer thread and requests only wait for the memory
+    tier. Files are written atomically and unreadable files are discarded.
+
+    Attributes:
+        config (ConfigParser): Configuration settings loaded from the config.ini file.
+        directory (str): The directory results are persisted to.
+        maxDiskSize (int): The largest total size of the persisted results in bytes.
+        maxPendingWrites (int): The most results queued for the writer; further results are only kept in memory.
+        memoryCache (LRUCache): The in-memory tier, keyed by kind and key.
+        fingerprints (dict[str, str]): The configuration fingerprint of each kind of result.
+
+    Methods:
+        getKey(image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray, **options) -> str:
+            Returns the cache key of a request, or None if an input is missing.
+
+        get(kind: str, key: str) -> list[np.ndarray]:
+            Returns the cached images of a result, or None if it is not cached.
+
+        put(kind: str, key: str, images: list[np.ndarray]) -> None:
+            Stores the images of a result in memory and queues them to be written to disk.
+
+        flush() -> None:
+            Waits until every queued result is written to disk.
+
+        contains(kind: str, key: str) -> bool:
+            Checks whether a result is persisted without counting a lookup.
+
+        isFull() -> bool:
+            Checks whether storing more results would evict older ones from disk.
+
+        stats() -> dict[str, float]:
+            Returns the hit counters, hit rate and size of both tiers.
+    """
+
+    def __init__(self, config: ConfigParser):
+        """
+        Initialize the ResultCache and index the results persisted by earlier runs.
+
+        Args:
+            config (ConfigParser): The loaded configuration object.
+        """
+        self.config = config
+        self.directory = config.get("RESULT CACHE", "directory", fallback = "artifacts/resultCache")
+        self.maxDiskSize = config.getint("RESULT CACHE", "maxDiskMegabytes", fallback = 2048) * 1024 * 1024
+        self.maxPendingWrites = max(config.getint("RESULT CACHE", "maxPendingWrites", fallback = 32), 1)
+        self.memoryCache = LRUCache(maxSize = config.getint("RESULT CACHE", "memoryEntries", fallback = 16))
+        self.fingerprints = {x: getConfigFingerprint(config, y) for x, y in FINGERPRINT_SECTIONS.items()}
+        self._diskEntries = OrderedDict()
+        self._diskSize = 0
+        self._counts = {"memoryHits": 0, "diskHits": 0, "misses": 0}
+        self._pendingWrites = 0
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "ResultCacheWriter")
+        self._loadDiskIndex()
+
+    def getKey(self, image: Image.Image | np.ndarray, jewellery: Image.Image | np.ndarray, **options) -> str:
+        """
+        Compute the cache key of a request.
+
+        Args:
+            image (Image.Image | np.ndarray): The user's image.
+            jewellery (Image.Image | np.ndarray): The image of the necklace.
+            **options: The request options that change the result, such as the variant mode.
+
+        Returns:
+            str: The hexadecimal key, or None if the image or the necklace is missing.
+        """
+        if image is None or jewellery is None:
+            return None
+        payload = json.dumps(
+            [getImageHash(np.asarray(image)), getImageHash(np.asarray(jewellery)), options], sort_keys = True
+        )
+        return hashlib.blake2b(payload.encode(), digest_size = 16).hexdigest()
+
+    def get(self, kind: str, key: str) -> list[np.ndarray]:
+        """
+        Look up a result, first in memory and then on disk.
+
+        Args:
+            kind (str): The kind of result, "necklace" or "clothing".
+            key (str): The cache key of the request.
+
+        Returns:
+            list[np.ndarray]: The read-only RGB images of the result, or None if it is not cached.
+        """
+        if key is None:
+            return None
+        images = self.memoryCache.get((kind, key))
+        if images is not None:
+            self._count(kind, "memoryHits")
+            return images
+
+        path = self._path(kind, key)
+        with self._lock:
+            known = path in self._diskEntries
+            if known:
+                self._diskEntries.move_to_end(path)
+        if known:
+            try:
+                with np.load(path) as data:
+                    images = [decodeImage(data[f"image{x}"].tobytes()) for x in range(int(data["nImages"]))]
+                os.utime(path)
+            except Exception as e:
+                logger.warning(f"discarding unreadable cached result {path}: {e}")
+                self._remove(path)
+                images = None
+        if images is None:
+            self._count(kind, "misses")
+            return None
+
+        images = self._freeze(images)
+        self.memoryCache.put((kind, key), images)
+        self._count(kind, "diskHits")
+        return images
+
+    def put(self, kind: str, key: str, images: list[np.ndarray]) -> None:
+        """
+        Store a result in memory and queue it to be written to disk by the background writer.
+
+        The memory tier is updated before this returns. A result that cannot be written to disk, 
+        or that arrives while `maxPendingWrites` results are already queued, is only kept in memory.
+
+        Args:
+            kind (str): The kind of result, "necklace" or "clothing".
+            key (str): The cache key of the request.
+            images (list[np.ndarray]): The RGB images of the result.
+        """
+        if key is None:
+            return
+        images = self._freeze([np.array(x, dtype = np.uint8) for x in images])
+        self.memoryCache.put((kind, key), images)
+
+        with self._lock:
+            queued = self._pendingWrites < self.maxPendingWrites
+            if queued:
+                self._pendingWrites += 1
+        if not queued:
+            logger.warning(f"the result writer is behind, keeping the result {key} in memory only")
+            return
+        self._writer.submit(self._write, kind, key, images)
+
+    def flush(self) -> None:
+        """
+        Wait until every result queued so far is written to disk.
+        """
+        # the writer runs the queued writes in order, so an empty task finishes after all of them
+        self._writer.submit(lambda: None).result()
+
+    def contains(self, kind: str, key: str) -> bool:
+        """
+        Check whether a result is persisted, without counting a lookup.
+
+        Args:
+            kind (str): The kind of result, "necklace" or "clothing".
+            key (str): The cache key of the request.
+
+        Returns:
+            bool: True if the result is on disk.
+        """
+        with self._lock:
+            return self._path(kind, key) in self._diskEntries
+
+    def isFull(self) -> bool:
+        """
+        Check whether the disk tier has reached its size limit.
+
+        Returns:
+            bool: True if storing more results would evict older ones.
+        """
+        with self._lock:
+            return self._diskSize >= self.maxDiskSize
+
+    def stats(self) -> dict[str, float]:
+        """
+        Report the counters of both tiers.
+
+        Returns:
+            dict[str, float]: The memory hits, disk hits, misses and overall hit rate, and the
+                number of results and bytes held by each tier.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            lookups = sum(counts.values())
+            return {
+                **counts,
+                "hitRate": (counts["memoryHits"] + counts["diskHits"]) / lookups if lookups else 0.0,
+                "memoryEntries": len(self.memoryCache),
+                "diskEntries": len(self._diskEntries),
+                "diskBytes": self._diskSize
+            }
+
+    def _count(self, kind: str, result: str) -> None:
+        """Count a lookup in the statistics and the metrics."""
+        with self._lock:
+            self._counts[result] += 1
+        metrics.increment("gemfit_result_cache_lookups_total", kind = kind, result = result)
+
+    def _write(self, kind: str, key: str, images: list[np.ndarray]) -> None:
+        """Encode a result as PNG images and persist it, evicting the least recently used results from disk if needed."""
+        path = self._path(kind, key)
+        temporaryPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporaryPath, "wb") as file:
+                np.savez(
+                    file,
+                    nImages = len(images),
+                    **{f"image{x}": np.frombuffer(encodeImage(y, format = "png"), dtype = np.uint8) for x, y in enumerate(images)}
+                )
+            os.replace(temporaryPath, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"could not persist the result {path}: {e}")
+            return
+        except Exception as e:
+            metrics.recordError("resultCache", e)
+            logger.error(CustomException(e))
+            return
+        finally:
+            with self._lock:
+                self._pendingWrites -= 1
+
+        with self._lock:
+            self._diskSize += size - self._diskEntries.pop(path, 0)
+            self._diskEntries[path] = size
+        self._evict()
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, kind, self.fingerprints[kind], f"{key}.npz")
+
+    @staticmethod
+    def _freeze(images: list[np.ndarray]) -> list[np.ndarray]:
+        """Make the cached arrays read-only, since they are shared between requests."""
+        for x in images:
+            x.setflags(write = False)
+        return images
+
+    def _remove(self, path: str) -> None:
+        """Forget a persisted result and delete its file."""
+        with self._lock:
+            self._diskSize -= self._diskEntries.pop(path, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """Delete the least recently used results until the disk tier fits its size limit."""
+        while True:
+            with self._lock:
+                if self._diskSize <= self.maxDiskSize or not self._diskEntries:
+                    return
+                path, size = self._diskEntries.popitem(last = False)
+                self._diskSize -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _loadDiskIndex(self) -> None:
+        """Delete the results of other fingerprints and index the remaining ones by their last use."""
+        files = []
+        for kind, fingerprint in self.fingerprints.items():
+            kindDirectory = os.path.join(self.directory, kind)
+            os.makedirs(os.path.join(kindDirectory, fingerprint), exist_ok = True)
+            for x in os.listdir(kindDirectory):
+                if x != fingerprint:
+                    logger.info(f"discarding {kind} results cached under an older configuration or model")
+                    shutil.rmtree(os.path.join(kindDirectory, x), ignore_errors = True)
+
+            for entry in os.scandir(os.path.join(kindDirectory, fingerprint)):
+                if entry.name.endswith(".tmp"):
+                    os.remove(entry.path)
+                elif entry.name.endswith(".npz"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+
+        for _, path, size in sorted(files):
+            self._diskEntries[path] = size
+            self._diskSize += size
+        logger.info(f"indexed {len(files)} cached results")
+        self._evict()
\ No newline at end of file
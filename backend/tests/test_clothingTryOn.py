@@ -0,0 +1,71 @@
+from benchmarks.tryOnBenchmark import SyntheticLandmarkService, StubInpaintPipeline, makePortrait, makeNecklace
+from src.components.catalogueIndex import CatalogueIndex
+from src.components.clothingTryOn import ClothingTryOn, InpaintingJob
+import numpy as np
+import pytest
+
+class RecordingInpaintPipeline(StubInpaintPipeline):
+    """A stub pipeline recording the batch size of every denoising step."""
+
+    def __init__(self, numInferenceSteps: int = 4):
+        """Initialize the RecordingInpaintPipeline with an empty record."""
+        super().__init__(numInferenceSteps = numInferenceSteps)
+        self.batchSizes = []
+        denoiser = self.denoiser
+        def record(latents):
+            self.batchSizes.append(latents.shape[0])
+            return denoiser(latents)
+        self.denoiser = record
+
+
+@pytest.fixture
+def clothingTryOn(tmp_path) -> ClothingTryOn:
+    """A clothing try-on in shared-prefix mode on the recording stub pipeline."""
+    catalogueIndex = CatalogueIndex()
+    catalogueIndex.directory = str(tmp_path)
+    clothingTryOn = ClothingTryOn(
+        landmarkService = SyntheticLandmarkService(), catalogueIndex = catalogueIndex, pipeline = RecordingInpaintPipeline()
+    )
+    clothingTryOn.sharedPrefix, clothingTryOn.branchFraction = True, 0.5
+    return clothingTryOn
+
+
+def makeJob(clothingTryOn: ClothingTryOn, seed: int = 0) -> InpaintingJob:
+    """Prepare the diffusion inputs of a synthetic portrait."""
+    tryOn, mask = clothingTryOn.getBinaryMask(makePortrait(480, 640, seed = seed), makeNecklace())
+    return clothingTryOn.prepareJob(image = tryOn, mask = mask)
+
+
+def getArrays(outputs: list) -> list[np.ndarray]:
+    """Turn the images of a job into arrays."""
+    return [np.asarray(x) for x in outputs]
+
+
+@pytest.mark.parametrize("batchSize", [1, 2])
+def test_sharedPrefixDenoisesInBatchesOfAtMostBatchSize(clothingTryOn: ClothingTryOn, batchSize: int):
+    assert len(clothingTryOn.colours) > batchSize
+    job = makeJob(clothingTryOn)
+    clothingTryOn.maxBatchSize = clothingTryOn.streamBatchSize = batchSize
+    clothingTryOn.runDiffusion([job])
+    pipeline = clothingTryOn.pipeline
+    branchStep = round(clothingTryOn.branchFraction * pipeline.numInferenceSteps)
+    assert pipeline.batchSizes[:branchStep] == [1] * branchStep
+    assert max(pipeline.batchSizes) == batchSize
+    assert sum(pipeline.batchSizes[branchStep:]) == len(clothingTryOn.colours) * (pipeline.numInferenceSteps - branchStep)
+
+
+def test_sharedPrefixOutputsDoNotDependOnBatchSize(clothingTryOn: ClothingTryOn):
+    job = makeJob(clothingTryOn)
+    clothingTryOn.maxBatchSize = 1
+    single = getArrays(clothingTryOn.runDiffusion([job])[0])
+    clothingTryOn.maxBatchSize = len(clothingTryOn.colours)
+    batched = getArrays(clothingTryOn.runDiffusion([job])[0])
+    assert all(np.array_equal(x, y) for x, y in zip(single, batched))
+
+
+def test_sharedPrefixOutputsDoNotDependOnSchedulerBatch(clothingTryOn: ClothingTryOn):
+    job, otherJob = makeJob(clothingTryOn), makeJob(clothingTryOn, seed = 1)
+    alone = getArrays(clothingTryOn.runDiffusion([job])[0])
+    together = clothingTryOn.runDiffusion([otherJob, job])
+    assert len(together[0]) == len(together[1]) == len(clothingTryOn.colours)
+    assert all(np.array_equal(x, y) for x, y in zip(alone, getArrays(together[1])))
\ No newline at end of file
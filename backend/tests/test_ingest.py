@@ -0,0 +1,40 @@
+from benchmarks.tryOnBenchmark import SyntheticLandmarkService, makePortrait, makeNecklace
+from src.components.necklaceTryOn import NecklaceTryOn
+from src.components.catalogueIndex import CatalogueIndex
+from src.components.clothingTryOn import ClothingTryOn
+from src.utils.ingest import ingestImage
+import numpy as np
+import pytest
+
+@pytest.fixture
+def catalogueIndex(tmp_path) -> CatalogueIndex:
+    """A catalogue index persisting to a temporary directory."""
+    catalogueIndex = CatalogueIndex()
+    catalogueIndex.directory = str(tmp_path)
+    return catalogueIndex
+
+
+@pytest.mark.parametrize("maxSide", [0, 4096, 320])
+def test_ingestImageNeverReturnsTheInputArray(maxSide: int):
+    image = np.asarray(makePortrait(480, 640)).copy()
+    original = image.copy()
+    result = ingestImage(image, maxSide = maxSide)
+    result[:] = 0
+    assert np.array_equal(image, original)
+
+
+def test_necklaceTryOnLeavesTheInputArrayUnchanged(catalogueIndex: CatalogueIndex):
+    image = np.asarray(makePortrait(480, 640)).copy()
+    original = image.copy()
+    necklaceTryOn = NecklaceTryOn(landmarkService = SyntheticLandmarkService(), catalogueIndex = catalogueIndex)
+    result = necklaceTryOn.necklaceTryOn(image = image, jewellery = makeNecklace(), asArray = True)
+    assert result is not None and not np.array_equal(result, original)
+    assert np.array_equal(image, original)
+
+
+def test_getBinaryMaskLeavesTheInputArrayUnchanged(catalogueIndex: CatalogueIndex):
+    image = np.asarray(makePortrait(480, 640)).copy()
+    original = image.copy()
+    clothingTryOn = ClothingTryOn(landmarkService = SyntheticLandmarkService(), catalogueIndex = catalogueIndex, pipeline = object())
+    assert clothingTryOn.getBinaryMask(image = image, jewellery = makeNecklace()) is not None
+    assert np.array_equal(image, original)
\ No newline at end of file